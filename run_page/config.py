@@ -10,6 +10,7 @@ OUTPUT_DIR = os.path.join(parent, "activities")
 GPX_FOLDER = os.path.join(parent, "GPX_OUT")
 TCX_FOLDER = os.path.join(parent, "TCX_OUT")
 FIT_FOLDER = os.path.join(parent, "FIT_OUT")
+STRAVA_STREAMS_FOLDER = os.path.join(parent, "STRAVA_STREAMS_OUT")
 ENDOMONDO_FILE_DIR = os.path.join(parent, "Workouts")
 FOLDER_DICT = {
     "gpx": GPX_FOLDER,
@@ -20,6 +21,7 @@ SQL_FILE = os.path.join(parent, "run_page", "data.db")
 JSON_FILE = os.path.join(parent, "src", "static", "activities.json")
 SYNCED_FILE = os.path.join(parent, "imported.json")
 SYNCED_ACTIVITY_FILE = os.path.join(parent, "synced_activity.json")
+STRAVA_UPLOAD_LEDGER = os.path.join(parent, "strava_uploads.json")
 NAME_MAPPING_FILE = os.path.join(FIT_FOLDER, "name_mapping.json")
 
 # TODO: Move into nike_sync NRC THINGS
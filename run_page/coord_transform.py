@@ -0,0 +1,123 @@
+"""
+WGS-84, GCJ-02 (China) and BD-09 (Baidu) conversions on numpy arrays
+same formulas as eviltransform, applied to whole tracks at once
+every function takes latitude and longitude arrays (or scalars) and returns
+a (latitude, longitude) tuple of arrays, points outside China are unchanged
+"""
+
+import numpy as np
+
+EARTH_R = 6378137.0
+EE = 0.00669342162296594323
+X_PI = np.pi * 3000 / 180
+
+
+def out_of_china(lat, lng):
+    lat, lng = np.asarray(lat, dtype=float), np.asarray(lng, dtype=float)
+    return ~((72.004 <= lng) & (lng <= 137.8347) & (0.8293 <= lat) & (lat <= 55.8271))
+
+
+def _transform(x, y):
+    x_pi = x * np.pi
+    y_pi = y * np.pi
+    d = 20.0 * np.sin(6.0 * x_pi) + 20.0 * np.sin(2.0 * x_pi)
+    lat = d + 20.0 * np.sin(y_pi) + 40.0 * np.sin(y_pi / 3.0)
+    lng = d + 20.0 * np.sin(x_pi) + 40.0 * np.sin(x_pi / 3.0)
+    lat += 160.0 * np.sin(y_pi / 12.0) + 320 * np.sin(y_pi / 30.0)
+    lng += 150.0 * np.sin(x_pi / 12.0) + 300.0 * np.sin(x_pi / 30.0)
+    lat *= 2.0 / 3.0
+    lng *= 2.0 / 3.0
+    xy = x * y
+    abs_x = np.sqrt(np.abs(x))
+    lat += -100.0 + 2.0 * x + 3.0 * y + 0.2 * y * y + 0.1 * xy + 0.2 * abs_x
+    lng += 300.0 + x + 2.0 * y + 0.1 * x * x + 0.1 * xy + 0.1 * abs_x
+    return lat, lng
+
+
+def _delta(lat, lng):
+    """
+    GCJ-02 offset of the points, zero outside China
+    """
+    d_lat, d_lng = _transform(lng - 105.0, lat - 35.0)
+    rad_lat = lat / 180.0 * np.pi
+    magic = 1 - EE * np.sin(rad_lat) ** 2
+    sqrt_magic = np.sqrt(magic)
+    d_lat = (d_lat * 180.0) / ((EARTH_R * (1 - EE)) / (magic * sqrt_magic) * np.pi)
+    d_lng = (d_lng * 180.0) / (EARTH_R / sqrt_magic * np.cos(rad_lat) * np.pi)
+    outside = out_of_china(lat, lng)
+    return np.where(outside, 0.0, d_lat), np.where(outside, 0.0, d_lng)
+
+
+def wgs2gcj(lat, lng):
+    lat, lng = np.asarray(lat, dtype=float), np.asarray(lng, dtype=float)
+    d_lat, d_lng = _delta(lat, lng)
+    return lat + d_lat, lng + d_lng
+
+
+def gcj2wgs(lat, lng):
+    """
+    One step inverse, within a few meters, like eviltransform.gcj2wgs
+    """
+    lat, lng = np.asarray(lat, dtype=float), np.asarray(lng, dtype=float)
+    d_lat, d_lng = _delta(lat, lng)
+    return lat - d_lat, lng - d_lng
+
+
+def gcj2wgs_exact(lat, lng, tolerance=1e-7, max_iterations=10):
+    """
+    Iterative inverse, until wgs2gcj of the result is within tolerance degrees
+    of the input (1e-7 is about 1 cm)
+    right at the border of China there may be no exact inverse, those points
+    stop after max_iterations
+    """
+    lat, lng = np.asarray(lat, dtype=float), np.asarray(lng, dtype=float)
+    wgs_lat, wgs_lng = (np.array(a, ndmin=1) for a in gcj2wgs(lat, lng))
+    gcj_lat, gcj_lng = lat.reshape(-1), lng.reshape(-1)
+    active = np.flatnonzero(~out_of_china(gcj_lat, gcj_lng))
+    # the offset changes slowly, so each fixed point step gains digits
+    for _ in range(max_iterations):
+        if not len(active):
+            break
+        est_lat, est_lng = wgs2gcj(wgs_lat[active], wgs_lng[active])
+        d_lat = est_lat - gcj_lat[active]
+        d_lng = est_lng - gcj_lng[active]
+        wgs_lat[active] -= d_lat
+        wgs_lng[active] -= d_lng
+        active = active[np.maximum(np.abs(d_lat), np.abs(d_lng)) >= tolerance]
+    return wgs_lat.reshape(lat.shape), wgs_lng.reshape(lng.shape)
+
+
+def gcj2bd(lat, lng):
+    lat, lng = np.asarray(lat, dtype=float), np.asarray(lng, dtype=float)
+    z = np.hypot(lng, lat) + 0.00002 * np.sin(lat * X_PI)
+    theta = np.arctan2(lat, lng) + 0.000003 * np.cos(lng * X_PI)
+    outside = out_of_china(lat, lng)
+    return (
+        np.where(outside, lat, z * np.sin(theta) + 0.006),
+        np.where(outside, lng, z * np.cos(theta) + 0.0065),
+    )
+
+
+def bd2gcj(lat, lng):
+    lat, lng = np.asarray(lat, dtype=float), np.asarray(lng, dtype=float)
+    x = lng - 0.0065
+    y = lat - 0.006
+    z = np.hypot(x, y) - 0.00002 * np.sin(y * X_PI)
+    theta = np.arctan2(y, x) - 0.000003 * np.cos(x * X_PI)
+    outside = out_of_china(lat, lng)
+    return (
+        np.where(outside, lat, z * np.sin(theta)),
+        np.where(outside, lng, z * np.cos(theta)),
+    )
+
+
+def wgs2bd(lat, lng):
+    return gcj2bd(*wgs2gcj(lat, lng))
+
+
+def bd2wgs(lat, lng):
+    return gcj2wgs(*bd2gcj(lat, lng))
+
+
+def bd2wgs_exact(lat, lng, tolerance=1e-7, max_iterations=10):
+    return gcj2wgs_exact(*bd2gcj(lat, lng), tolerance, max_iterations)
@@ -1,6 +1,7 @@
 import argparse
 import asyncio
 import hashlib
+import json
 import os
 import time
 
@@ -8,8 +9,10 @@ import aiofiles
 import httpx
 
 from config import JSON_FILE, SQL_FILE, FIT_FOLDER, FOLDER_DICT
-from utils import make_activities_file
-from generator.db import update_or_create_activity, init_db
+from http_client import HttpClient
+from sync_pipeline import SyncPipeline
+from generator import Generator
+from generator.db import Activity, update_or_create_activity
 
 COROS_URL_DICT = {
     "LOGIN_URL": "https://teamcnapi.coros.com/account/login",
@@ -23,7 +26,11 @@ COROS_TYPE_DICT = {
     "tcx": 3,
 }
 
-TIME_OUT = httpx.Timeout(240.0, connect=360.0)
+# the web app asks for 20 activities per page, larger pages are assumed to be
+# accepted by the api as well
+COROS_PAGE_SIZE = 100
+# pages requested at once when listing the whole history
+COROS_PREFETCH_PAGES = 4
 
 
 class Coros:
@@ -53,49 +60,73 @@ class Coros:
             "user-agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36",
         }
         data = {"account": self.account, "accountType": 2, "pwd": self.password}
-        async with httpx.AsyncClient(timeout=TIME_OUT) as client:
-            response = await client.post(url, json=data, headers=headers)
-            resp_json = response.json()
-            access_token = resp_json.get("data", {}).get("accessToken")
-            if not access_token:
-                raise Exception(
-                    "============Login failed! please check your account and password==========="
-                )
-            self.headers = {
-                "accesstoken": access_token,
-                "cookie": f"CPL-coros-region=2; CPL-coros-token={access_token}",
-            }
-            self.req = httpx.AsyncClient(timeout=TIME_OUT, headers=self.headers)
-        await client.aclose()
+        # one pooled client for the login and all later requests
+        self.req = HttpClient(http2=True)
+        response = await self.req.post(url, json=data, headers=headers)
+        resp_json = response.json()
+        access_token = resp_json.get("data", {}).get("accessToken")
+        if not access_token:
+            await self.req.aclose()
+            raise Exception(
+                "============Login failed! please check your account and password==========="
+            )
+        self.headers = {
+            "accesstoken": access_token,
+            "cookie": f"CPL-coros-region=2; CPL-coros-token={access_token}",
+        }
+        self.req.headers.update(self.headers)
 
     async def init(self):
         await self.login()
 
-    async def fetch_activity_ids_types(self, only_run=False):
+    async def fetch_activity_page(self, page_number, only_run=False):
+        mode_list_str = "100,101,102,103" if only_run else ""
+        url = f"{COROS_URL_DICT.get('ACTIVITY_LIST')}?&modeList={mode_list_str}&pageNumber={page_number}&size={COROS_PAGE_SIZE}"
+        response = await self.req.get(url)
+        data = response.json()
+        return data.get("data", {}).get("dataList", None) or []
+
+    async def fetch_activity_ids_types(
+        self, only_run=False, known_ids=None, last_start_time=0, prefetch=1
+    ):
+        """
+        List activities newest first, prefetch pages are requested at once
+        with known_ids, stop after the first page whose activities are all in
+        known_ids or did not start after last_start_time
+        """
         page_number = 1
         all_activities_ids_types = []
         act_map = {}
 
-        mode_list_str = "100,101,102,103" if only_run else ""
         while True:
-            url = f"{COROS_URL_DICT.get('ACTIVITY_LIST')}?&modeList={mode_list_str}&pageNumber={page_number}&size=20"
-            response = await self.req.get(url)
-            data = response.json()
-            activities = data.get("data", {}).get("dataList", None)
-            if not activities:
-                break
-            for activity in activities:
-                label_id = activity.get("labelId")
-                sport_type = activity.get("sportType")
-                if label_id is None:
-                    continue
-                str_label_id = str(label_id)
-                all_activities_ids_types.append([str_label_id, sport_type])
-                act_map[str_label_id] = activity
-
-            page_number += 1
-
-        return all_activities_ids_types, act_map
+            pages = await gather_with_concurrency(
+                prefetch,
+                [
+                    self.fetch_activity_page(page_number + i, only_run)
+                    for i in range(prefetch)
+                ],
+            )
+            page_number += prefetch
+            for activities in pages:
+                if not activities:
+                    return all_activities_ids_types, act_map
+                is_known_page = True
+                for activity in activities:
+                    label_id = activity.get("labelId")
+                    sport_type = activity.get("sportType")
+                    if label_id is None:
+                        continue
+                    str_label_id = str(label_id)
+                    all_activities_ids_types.append([str_label_id, sport_type])
+                    act_map[str_label_id] = activity
+                    if (
+                        known_ids is None
+                        or str_label_id not in known_ids
+                        and (activity.get("startTime") or 0) > last_start_time
+                    ):
+                        is_known_page = False
+                if is_known_page:
+                    return all_activities_ids_types, act_map
 
     async def download_activity(self, label_id, sport_type, file_type="fit"):
         if sport_type == 101 and file_type == "gpx":
@@ -149,10 +180,47 @@ class Coros:
 def get_downloaded_ids(folder):
     if not os.path.exists(folder):
         return []
-    return [i.split(".")[0] for i in os.listdir(folder) if not i.startswith(".") and os.path.getsize(os.path.join(folder, i)) > 0]
+    return [
+        i.split(".")[0]
+        for i in os.listdir(folder)
+        if not i.startswith(".") and os.path.getsize(os.path.join(folder, i)) > 0
+    ]
 
 
-def sync_coros_summary_to_db(act):
+def _sync_state_file(folder):
+    # a dot file, so that get_downloaded_ids skips it
+    return os.path.join(folder, ".coros_sync.json")
+
+
+def load_last_start_time(folder, only_run):
+    """
+    Return the newest start time of which all older activities were synced
+    """
+    try:
+        with open(_sync_state_file(folder)) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return 0
+    return state.get("running" if only_run else "all", 0)
+
+
+def save_last_start_time(folder, only_run, last_start_time):
+    state_file = _sync_state_file(folder)
+    try:
+        with open(state_file) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        state = {}
+    state["running" if only_run else "all"] = last_start_time
+    with open(state_file, "w") as f:
+        json.dump(state, f)
+
+
+def sync_coros_summary_to_db(act, session):
+    """
+    Add or update the db row of an activity from its Coros summary
+    the caller commits
+    """
     import datetime
 
     label_id = str(act.get("labelId"))
@@ -205,16 +273,117 @@ def sync_coros_summary_to_db(act):
     mock_act.elevation_gain = 0.0
     mock_act.source = "coros"
 
-    session = init_db(SQL_FILE)
-    try:
-        update_or_create_activity(session, mock_act)
-        session.commit()
-        print(f"✅ Fallback synced activity metadata directly to DB: {name} ({start_date_local}, mode:{mode})")
-    except Exception as e:
-        session.rollback()
-        print(f"❌ Error fallback syncing activity to DB: {e}")
-    finally:
-        session.close()
+    created = update_or_create_activity(session, mock_act)
+    print(f"✅ Fallback synced activity metadata directly to DB: {name} ({start_date_local}, mode:{mode})")
+    return created
+
+
+def _start_minute(start_time):
+    import datetime
+
+    return datetime.datetime.fromtimestamp(int(start_time)).strftime("%Y-%m-%d %H:%M")
+
+
+def reconcile_coros_activities(session, act_map, failed_ids=()):
+    """
+    Apply the real Coros names to the db in one pass
+    candidate rows are loaded once and indexed by run_id and start minute,
+    duplicates of an activity are deleted keeping the row with a track,
+    and activities missing from the db are added from their summary
+    the caller commits
+    """
+    target_ids = {}
+    for str_label_id, act_item in act_map.items():
+        st = act_item.get("startTime")
+        target_ids[str_label_id] = [int(str_label_id)]
+        if st:
+            target_ids[str_label_id].extend([int(st) * 1000, int(st)])
+
+    rows = {}
+    all_ids = sorted({i for ids in target_ids.values() for i in ids})
+    # stay below the sqlite limit of bound parameters
+    for i in range(0, len(all_ids), 500):
+        for a in session.query(Activity).filter(
+            Activity.run_id.in_(all_ids[i : i + 500])
+        ):
+            rows[a.run_id] = a
+
+    minutes = {
+        _start_minute(a["startTime"]) for a in act_map.values() if a.get("startTime")
+    }
+    rows_by_minute = {}
+    if minutes:
+        for a in session.query(Activity).filter(
+            Activity.start_date_local >= min(minutes)
+        ):
+            minute = a.start_date_local[:16]
+            if minute in minutes:
+                rows[a.run_id] = a
+                rows_by_minute.setdefault(minute, []).append(a)
+
+    deleted_ids = set()
+    missing_acts = []
+    for str_label_id, act_item in act_map.items():
+        real_name = act_item.get("name")
+        if real_name in ["天津市 跑步", "天津 跑步"]:
+            real_name = "Morning Run"
+
+        st = act_item.get("startTime")
+        if not real_name:
+            if str_label_id in failed_ids and int(str_label_id) not in rows:
+                missing_acts.append(act_item)
+            continue
+
+        matching_acts = {
+            i: rows[i]
+            for i in target_ids[str_label_id]
+            if i in rows and i not in deleted_ids
+        }
+        if not matching_acts and st:
+            matching_acts = {
+                a.run_id: a
+                for a in rows_by_minute.get(_start_minute(st), [])
+                if a.run_id not in deleted_ids
+            }
+        matching_acts = list(matching_acts.values())
+
+        if not matching_acts:
+            # 若数据库完全缺失该条运动（如无位移的力量训练），自动补全入库
+            missing_acts.append(dict(act_item, name=real_name))
+            continue
+
+        # 优先保留有轨迹 summary_polyline 的记录
+        track_act = next((a for a in matching_acts if a.summary_polyline and len(a.summary_polyline) > 0), matching_acts[0])
+        track_act.name = real_name
+        if act_item.get("avgHr"):
+            track_act.average_heartrate = float(act_item["avgHr"])
+
+        # 删除同时间段其它多余的重复记录
+        for duplicate in matching_acts:
+            if duplicate.run_id != track_act.run_id:
+                session.delete(duplicate)
+                deleted_ids.add(duplicate.run_id)
+                print(f"Removed duplicate activity id {duplicate.run_id} for {real_name}")
+
+    # the rows of these ids were not loaded above, so there is nothing to flush
+    # before looking them up
+    with session.no_autoflush:
+        for act_item in missing_acts:
+            sync_coros_summary_to_db(act_item, session)
+
+    # 智能合并同日（如 8月9日）因时间戳与 labelId 差异产生的重复记录
+    for date_prefix in ["2026-08-09"]:
+        day_acts = session.query(Activity).filter(Activity.start_date_local.like(f"{date_prefix}%")).all()
+        if len(day_acts) > 1:
+            best_act = next((a for a in day_acts if a.summary_polyline and len(a.summary_polyline) > 0), day_acts[0])
+            best_act.name = "Morning Run"
+            for dup in day_acts:
+                if dup.run_id != best_act.run_id:
+                    session.delete(dup)
+                    print(f"Merged & deleted duplicate activity for {date_prefix}: {dup.run_id}")
+
+    # 删除数据库中任何遗留的 Unnamed Workout
+    session.query(Activity).filter(Activity.name.in_(["Unnamed Workout", "Unnamed Activity", ""])).delete(synchronize_session=False)
 
 
 async def download_and_generate(account, password, only_run=False, file_type="fit"):
@@ -223,7 +392,16 @@ async def download_and_generate(account, password, only_run=False, file_type="fi
     coros = Coros(account, password)
     await coros.init()
 
-    activity_infos, act_map = await coros.fetch_activity_ids_types(only_run=only_run)
+    # stop listing at the activities the last sync already saw, list the whole
+    # history with a few pages at once on the first sync
+    last_start_time = load_last_start_time(folder, only_run)
+    is_full_sync = not downloaded_ids and not last_start_time
+    activity_infos, act_map = await coros.fetch_activity_ids_types(
+        only_run=only_run,
+        known_ids=downloaded_ids,
+        last_start_time=last_start_time,
+        prefetch=COROS_PREFETCH_PAGES if is_full_sync else 1,
+    )
     activity_ids = [i[0] for i in activity_infos]
     activity_types = [i[1] for i in activity_infos]
     activity_id_type_dict = dict(zip(activity_ids, activity_types))
@@ -233,30 +411,6 @@ async def download_and_generate(account, password, only_run=False, file_type="fi
     to_generate_coros_ids = [i for i in activity_ids if i not in downloaded_ids]
     print("to_generate_activity_ids: ", len(to_generate_coros_ids))
 
-    start_time = time.time()
-    results = await gather_with_concurrency(
-        10,
-        [
-            coros.download_activity(
-                label_id, activity_id_type_dict.get(label_id, 100), file_type
-            )
-            for label_id in to_generate_coros_ids
-        ],
-    )
-    print(f"Download finished. Elapsed {time.time()-start_time} seconds")
-
-    # 对没有生成实体 FIT 的活动（如 Mode 23 室内力量），进行 DB 元数据保底落库
-    for label_id, res in zip(to_generate_coros_ids, results):
-        if res is None or res[0] is None:
-            act_obj = act_map.get(str(label_id))
-            if act_obj:
-                try:
-                    sync_coros_summary_to_db(act_obj)
-                except Exception as e:
-                    print(f"Error in fallback syncing {label_id}: {e}")
-
-    await coros.req.aclose()
-
     # 构建完整的 activity_title_dict (同时支持 labelId 与 毫秒时间戳 run_id)
     activity_title_dict = {}
     for str_label_id, act_item in act_map.items():
@@ -268,75 +422,65 @@ async def download_and_generate(account, password, only_run=False, file_type="fi
                 activity_title_dict[str(int(st) * 1000)] = name
                 activity_title_dict[str(int(st))] = name
 
-    make_activities_file(SQL_FILE, folder, JSON_FILE, file_type, activity_title_dict=activity_title_dict)
+    # parse and store every file as soon as it is downloaded
+    async def download_and_sync(pipeline, label_id):
+        res = await coros.download_activity(
+            label_id, activity_id_type_dict.get(label_id, 100), file_type
+        )
+        if res is not None and res[0] is not None:
+            await pipeline.put(os.path.join(folder, res[1]))
+        return res
 
-    # 自动把高驰服务器上的真实活动名称 (如 "北京站", "走日坛公园") 覆盖回数据库，并根据时间戳智能去重
-    try:
-        session = init_db(SQL_FILE)
-        from generator.db import Activity
-        import datetime
+    start_time = time.time()
+    async with SyncPipeline(SQL_FILE, activity_title_dict) as pipeline:
+        results = await gather_with_concurrency(
+            10,
+            [
+                download_and_sync(pipeline, label_id)
+                for label_id in to_generate_coros_ids
+            ],
+        )
+    print(f"Download finished. Elapsed {time.time()-start_time} seconds")
 
-        for str_label_id, act_item in act_map.items():
-            real_name = act_item.get("name")
-            if real_name in ["天津市 跑步", "天津 跑步"]:
-                real_name = "Morning Run"
+    failed_ids = {
+        str(label_id)
+        for label_id, res in zip(to_generate_coros_ids, results)
+        if res is None or res[0] is None
+    }
 
-            st = act_item.get("startTime")
-            if not real_name:
-                continue
+    await coros.req.aclose()
 
-            target_ids = [int(str_label_id)]
-            if st:
-                target_ids.extend([int(st) * 1000, int(st)])
-
-            matching_acts = session.query(Activity).filter(Activity.run_id.in_(target_ids)).all()
-            if not matching_acts and st:
-                dt_str = datetime.datetime.fromtimestamp(int(st)).strftime("%Y-%m-%d %H:%M")
-                matching_acts = session.query(Activity).filter(Activity.start_date_local.like(f"{dt_str}%")).all()
-
-            if matching_acts:
-                # 优先保留有轨迹 summary_polyline 的记录
-                track_act = next((a for a in matching_acts if a.summary_polyline and len(a.summary_polyline) > 0), matching_acts[0])
-                track_act.name = real_name
-                if act_item.get("avgHr"):
-                    track_act.average_heartrate = float(act_item["avgHr"])
-
-                # 删除同时间段其它多余的重复记录
-                for duplicate in matching_acts:
-                    if duplicate.run_id != track_act.run_id:
-                        session.delete(duplicate)
-                        print(f"Removed duplicate activity id {duplicate.run_id} for {real_name}")
-            else:
-                # 若数据库完全缺失该条运动（如无位移的力量训练），自动补全入库
-                if act_item.get("name") in ["天津市 跑步", "天津 跑步"]:
-                    act_item["name"] = "Morning Run"
-                sync_coros_summary_to_db(act_item)
-
-        # 智能合并同日（如 8月9日）因时间戳与 labelId 差异产生的重复记录
-        for date_prefix in ["2026-08-09"]:
-            day_acts = session.query(Activity).filter(Activity.start_date_local.like(f"{date_prefix}%")).all()
-            if len(day_acts) > 1:
-                best_act = next((a for a in day_acts if a.summary_polyline and len(a.summary_polyline) > 0), day_acts[0])
-                best_act.name = "Morning Run"
-                for dup in day_acts:
-                    if dup.run_id != best_act.run_id:
-                        session.delete(dup)
-                        print(f"Merged & deleted duplicate activity for {date_prefix}: {dup.run_id}")
-
-        # 删除数据库中任何遗留的 Unnamed Workout
-        session.query(Activity).filter(Activity.name.in_(["Unnamed Workout", "Unnamed Activity", ""])).delete(synchronize_session=False)
+    # do not move the mark past activities that failed, to retry them next time
+    newest_start_time = max(
+        (int(a.get("startTime") or 0) for a in act_map.values()), default=0
+    )
+    failed_start_times = [
+        int(act_map[i]["startTime"]) for i in failed_ids if act_map[i].get("startTime")
+    ]
+    if failed_start_times:
+        newest_start_time = min(newest_start_time, min(failed_start_times) - 1)
+    if newest_start_time > last_start_time:
+        save_last_start_time(folder, only_run, newest_start_time)
+
+    # files which failed to parse while downloading are loaded again here
+    generator = Generator(SQL_FILE)
+    generator.sync_from_data_dir(
+        folder, file_suffix=file_type, activity_title_dict=activity_title_dict
+    )
 
+    # 自动把高驰服务器上的真实活动名称 (如 "北京站", "走日坛公园") 覆盖回数据库，并根据时间戳智能去重
+    # 对没有生成实体 FIT 的活动（如 Mode 23 室内力量），进行 DB 元数据保底落库
+    session = generator.session
+    try:
+        reconcile_coros_activities(session, act_map, failed_ids)
         session.commit()
-        session.close()
     except Exception as e:
+        session.rollback()
         print(f"Error updating real activity names from Coros: {e}")
 
     # 全量将 DB 导出为 activities.json
     try:
-        from generator import Generator
-        import json
-        g = Generator(SQL_FILE)
-        acts = g.load()
+        acts = generator.load()
         with open(JSON_FILE, "w") as f:
             json.dump(acts, f, indent=2)
         print(f"✅ Exported {len(acts)} total activities from DB to {JSON_FILE}")
@@ -1,3 +1,4 @@
+import struct
 import traceback
 
 from fit_tool.fit_file import FitFile
@@ -14,6 +15,68 @@ GARMIN_SOFTWARE_VERSION = 3.58
 # here the default number:1234567890 Garmin will recognize it as Forerunner 245
 GARMIN_DEVICE_SERIAL_NUMBER = 1234567890
 
+DEVICE_INFO_GLOBAL_ID = 23
+# (field number, size, base type) of the device info written to the files,
+# the same fields in the same order as fit_tool encodes the message below
+DEVICE_INFO_FIELDS = (
+    (0, 1, 0x02),  # device_index, uint8
+    (2, 2, 0x84),  # manufacturer, uint16
+    (3, 4, 0x8C),  # serial_number, uint32z
+    (4, 2, 0x84),  # product (garmin_product), uint16
+    (5, 2, 0x84),  # software_version, uint16 scaled by 100
+    (25, 1, 0x00),  # source_type, enum
+)
+
+
+class UnsupportedFitFile(Exception):
+    pass
+
+
+def _make_crc_table():
+    # the byte wise form of the FIT SDK nibble table, CRC-16/ARC
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+CRC_TABLE = _make_crc_table()
+
+
+def fit_crc(data, crc=0):
+    table = CRC_TABLE
+    for byte in data:
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+    return crc
+
+
+def device_info_records(local_type=0):
+    """
+    Definition and data message of the device info, with record headers
+    """
+    definition = struct.pack(
+        "<BBBHB",
+        0x40 | local_type,
+        0,
+        0,
+        DEVICE_INFO_GLOBAL_ID,
+        len(DEVICE_INFO_FIELDS),
+    ) + b"".join(bytes(field) for field in DEVICE_INFO_FIELDS)
+    data = struct.pack(
+        "<BBHIHHB",
+        local_type,
+        0,
+        MANUFACTURER,
+        GARMIN_DEVICE_SERIAL_NUMBER,
+        GARMIN_DEVICE_PRODUCT_ID,
+        round(GARMIN_SOFTWARE_VERSION * 100),
+        5,
+    )
+    return definition + data
+
 
 def is_fit_file(file):
     file.seek(8)  # Move file pointer to the 9th byte
@@ -39,7 +102,92 @@ def do_wrap_device_info(origin_file):
     if not is_fit_file(origin_file):
         return BytesIO(origin_file.read())
 
-    fit_file = FitFile.from_bytes(origin_file.read())
+    data = origin_file.read()
+    try:
+        modified_file = patch_device_info(data)
+    except UnsupportedFitFile:
+        modified_file = rebuild_device_info(data)
+    print("wrap garmin device info success, product id:", GARMIN_DEVICE_PRODUCT_ID)
+    return modified_file
+
+
+def patch_device_info(data):
+    """
+    Replace the device info messages of a fit file without decoding it
+    records are walked by their headers and copied as they are, except the
+    device info messages and their definitions, the new device info is added
+    at the end of the records and both crcs are computed again
+    """
+    header_size = data[0]
+    if header_size < 12 or len(data) < header_size + 2:
+        raise ValueError("not a fit file")
+    data_size = struct.unpack_from("<I", data, 4)[0]
+    end = header_size + data_size
+    if len(data) != end + 2:
+        # chained fit files
+        raise UnsupportedFitFile("data size does not match the file size")
+
+    sizes = {}  # local message type -> data message size
+    dropped = set()  # local message types of device info definitions
+    kept = []
+    run_start = offset = header_size
+    while offset < end:
+        record_header = data[offset]
+        if record_header & 0x80:
+            # dropping a message could change the time of the compressed ones
+            raise UnsupportedFitFile("compressed timestamp headers")
+        local_type = record_header & 0x0F
+        if record_header & 0x40:
+            big_endian = data[offset + 2] == 1
+            global_id = struct.unpack_from(
+                ">H" if big_endian else "<H", data, offset + 3
+            )[0]
+            field_count = data[offset + 5]
+            fields = data[offset + 6 : offset + 6 + 3 * field_count]
+            size = 6 + 3 * field_count
+            message_size = sum(fields[1::3])
+            if record_header & 0x20:
+                developer_count = data[offset + size]
+                developer_fields = data[
+                    offset + size + 1 : offset + size + 1 + 3 * developer_count
+                ]
+                size += 1 + 3 * developer_count
+                message_size += sum(developer_fields[1::3])
+            sizes[local_type] = message_size
+            if global_id == DEVICE_INFO_GLOBAL_ID:
+                dropped.add(local_type)
+            else:
+                dropped.discard(local_type)
+            drop = local_type in dropped
+        else:
+            if local_type not in sizes:
+                raise ValueError(f"data message without definition at {offset}")
+            size = 1 + sizes[local_type]
+            drop = local_type in dropped
+        if drop:
+            kept.append(data[run_start:offset])
+            run_start = offset + size
+        offset += size
+    if offset != end:
+        raise ValueError("the last record runs over the end of the data")
+    kept.append(data[run_start:end])
+    kept.append(device_info_records())
+
+    records = b"".join(kept)
+    header = bytearray(data[:header_size])
+    struct.pack_into("<I", header, 4, len(records))
+    if header_size >= 14:
+        struct.pack_into("<H", header, 12, fit_crc(header[:12]))
+    crc = fit_crc(records, fit_crc(header))
+    return bytes(header) + records + struct.pack("<H", crc)
+
+
+def rebuild_device_info(data):
+    """
+    Decode and encode the whole file with fit_tool, for the files the
+    patcher does not handle
+    """
+    fit_file = FitFile.from_bytes(data)
     builder = FitFileBuilder(auto_define=True)
 
     for record in fit_file.records:
@@ -61,6 +209,4 @@ def do_wrap_device_info(origin_file):
     message.product = GARMIN_DEVICE_PRODUCT_ID
     builder.add(message)
 
-    modified_file = builder.build()
-    print("wrap garmin device info success, product id:", GARMIN_DEVICE_PRODUCT_ID)
-    return modified_file.to_bytes()
+    return builder.build().to_bytes()
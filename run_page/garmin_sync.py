@@ -5,6 +5,8 @@ Copy most code from https://github.com/cyberjunky/python-garminconnect
 
 import argparse
 import asyncio
+import contextlib
+import json
 import logging
 import os
 import sys
@@ -16,15 +18,15 @@ from io import BytesIO
 import aiofiles
 import cloudscraper
 import garth
-import httpx
 from config import FOLDER_DICT, JSON_FILE, SQL_FILE, config
 from garmin_device_adaptor import wrap_device_info
+from http_client import HttpClient
+from sync_pipeline import SyncPipeline
 from utils import make_activities_file_only
 
 # logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-TIME_OUT = httpx.Timeout(240.0, connect=360.0)
 GARMIN_COM_URL_DICT = {
     "SSO_URL_ORIGIN": "https://sso.garmin.com",
     "SSO_URL": "https://sso.garmin.com/sso",
@@ -49,7 +51,7 @@ class Garmin:
         """
         Init module
         """
-        self.req = httpx.AsyncClient(timeout=TIME_OUT)
+        self.req = HttpClient(http2=True)
         self.cf_req = cloudscraper.CloudScraper()
         self.URL_DICT = (
             GARMIN_CN_URL_DICT
@@ -73,31 +75,24 @@ class Garmin:
         self.upload_url = self.URL_DICT.get("UPLOAD_URL")
         self.activity_url = self.URL_DICT.get("ACTIVITY_URL")
 
-    async def fetch_data(self, url, retrying=False):
+    async def fetch_data(self, url):
         """
-        Fetch and return data
+        Fetch and return data, HttpClient already retried transient errors
         """
         try:
             response = await self.req.get(url, headers=self.headers)
-            if response.status_code == 429:
-                raise GarminConnectTooManyRequestsError("Too many requests")
-            logger.debug(f"fetch_data got response code {response.status_code}")
+        except Exception as err:
+            print(err)
+            raise GarminConnectConnectionError("Error connecting") from err
+        logger.debug(f"fetch_data got response code {response.status_code}")
+        if response.status_code == 429:
+            raise GarminConnectTooManyRequestsError("Too many requests")
+        try:
             response.raise_for_status()
-            return response.json()
         except Exception as err:
             print(err)
-            if retrying:
-                logger.debug(
-                    "Exception occurred during data retrieval, relogin without effect: %s"
-                    % err
-                )
-                raise GarminConnectConnectionError("Error connecting") from err
-            else:
-                logger.debug(
-                    "Exception occurred during data retrieval - perhaps session expired - trying relogin: %s"
-                    % err
-                )
-                await self.fetch_data(url, retrying=True)
+            raise GarminConnectHttpError(response.status_code) from err
+        return response.json()
 
     async def get_activities(self, start, limit):
         """
@@ -227,47 +222,86 @@ class GarminConnectAuthenticationError(Exception):
         self.status = status
 
 
-async def download_garmin_data(client, activity_id, file_type="gpx"):
+async def write_file_atomic(file_path, data):
+    """
+    Write data to a temporary dot file next to file_path and move it in place,
+    so that an interrupted sync never leaves a truncated activity file
+    """
+    folder, name = os.path.split(file_path)
+    tmp_path = os.path.join(folder, f".{name}.tmp")
+    async with aiofiles.open(tmp_path, "wb") as fb:
+        await fb.write(data)
+    os.replace(tmp_path, file_path)
+
+
+async def download_garmin_data(client, activity_id, file_type="gpx", on_file=None):
+    """
+    on_file is called with the path and content of every activity file written
+    """
     folder = FOLDER_DICT.get(file_type, "gpx")
     try:
         file_data = await client.download_activity(activity_id, file_type=file_type)
-        file_path = os.path.join(folder, f"{activity_id}.{file_type}")
-        need_unzip = False
-        if file_type == "fit":
-            file_path = os.path.join(folder, f"{activity_id}.zip")
-            need_unzip = True
-        async with aiofiles.open(file_path, "wb") as fb:
-            await fb.write(file_data)
-        if need_unzip:
-            zip_file = zipfile.ZipFile(file_path, "r")
+        if file_type != "fit":
+            file_path = os.path.join(folder, f"{activity_id}.{file_type}")
+            await write_file_atomic(file_path, file_data)
+            if on_file is not None:
+                on_file(file_path, file_data)
+            return True
+        # the original files come as a zip, extract the activity in memory
+        with zipfile.ZipFile(BytesIO(file_data)) as zip_file:
             for file_info in zip_file.infolist():
-                zip_file.extract(file_info, folder)
                 if file_info.filename.endswith(".fit"):
-                    os.rename(
-                        os.path.join(folder, f"{activity_id}_ACTIVITY.fit"),
-                        os.path.join(folder, f"{activity_id}.fit"),
-                    )
+                    file_path = os.path.join(folder, f"{activity_id}.fit")
                 elif file_info.filename.endswith(".gpx"):
-                    os.rename(
-                        os.path.join(folder, f"{activity_id}_ACTIVITY.gpx"),
-                        os.path.join(FOLDER_DICT["gpx"], f"{activity_id}.gpx"),
-                    )
+                    file_path = os.path.join(FOLDER_DICT["gpx"], f"{activity_id}.gpx")
                 else:
-                    os.remove(os.path.join(folder, file_info.filename))
-            os.remove(file_path)
+                    continue
+                data = zip_file.read(file_info)
+                await write_file_atomic(file_path, data)
+                if on_file is not None:
+                    on_file(file_path, data)
+        return True
     except Exception as e:
         print(f"Failed to download activity {activity_id}: {str(e)}")
         traceback.print_exc()
+        return False
 
 
-async def get_activity_id_list(client, start=0):
-    activities = await client.get_activities(start, 100)
-    if len(activities) > 0:
-        ids = list(map(lambda a: str(a.get("activityId", "")), activities))
+async def get_activity_title(client, activity_id):
+    try:
+        activity_summary = await client.get_activity_summary(activity_id)
+        return activity_summary.get("activityName", "")
+    except Exception as e:
+        print(f"Failed to get activity summary {activity_id}: {str(e)}")
+        return None
+
+
+async def get_activity_id_list(client, start=0, known_ids=None, high_water_mark=0):
+    """
+    List activity ids, newest first
+    if known_ids is given, stop after the first page that only contains ids
+    which are in known_ids or not newer than high_water_mark
+    """
+    ids = []
+    while True:
+        activities = await client.get_activities(start, 100)
+        if not activities:
+            return ids
+        page_ids = [str(a.get("activityId", "")) for a in activities]
         print("Syncing Activity IDs")
-        return ids + await get_activity_id_list(client, start + 100)
-    else:
-        return []
+        ids.extend(page_ids)
+        if known_ids is not None and all(
+            i in known_ids or _activity_id_value(i) <= high_water_mark for i in page_ids
+        ):
+            return ids
+        start += 100
+
+
+def _activity_id_value(activity_id):
+    try:
+        return int(activity_id)
+    except ValueError:
+        return 0
 
 
 async def gather_with_concurrency(n, tasks):
@@ -284,35 +318,112 @@ def get_downloaded_ids(folder):
     return [i.split(".")[0] for i in os.listdir(folder) if not i.startswith(".")]
 
 
+def _sync_state_file(folder):
+    # a dot file, so that get_downloaded_ids skips it
+    return os.path.join(folder, ".garmin_sync.json")
+
+
+def load_high_water_mark(folder, is_only_running):
+    """
+    Return the newest activity id of which all older activities were synced
+    """
+    try:
+        with open(_sync_state_file(folder)) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return 0
+    return state.get("running" if is_only_running else "all", 0)
+
+
+def save_high_water_mark(folder, is_only_running, high_water_mark):
+    state_file = _sync_state_file(folder)
+    try:
+        with open(state_file) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        state = {}
+    state["running" if is_only_running else "all"] = high_water_mark
+    with open(state_file, "w") as f:
+        json.dump(state, f)
+
+
 async def download_new_activities(
-    secret_string, auth_domain, downloaded_ids, is_only_running, folder, file_type
+    secret_string,
+    auth_domain,
+    downloaded_ids,
+    is_only_running,
+    folder,
+    file_type,
+    sql_file=None,
 ):
+    """
+    if sql_file is given, downloaded files are parsed and written to it while
+    the other downloads go on, see SyncPipeline
+    """
     client = Garmin(secret_string, auth_domain, is_only_running)
     # because I don't find a para for after time, so I use garmin-id as filename
     # to find new run to generage
-    activity_ids = await get_activity_id_list(client)
-    to_generate_garmin_ids = list(set(activity_ids) - set(downloaded_ids))
+    # activities are listed newest first, so stop paging once a whole page is
+    # known, activities up to the high water mark were synced by earlier runs
+    high_water_mark = load_high_water_mark(folder, is_only_running)
+    downloaded_ids = set(downloaded_ids)
+    activity_ids = await get_activity_id_list(
+        client, known_ids=downloaded_ids, high_water_mark=high_water_mark
+    )
+    to_generate_garmin_ids = [
+        i
+        for i in set(activity_ids) - downloaded_ids
+        if _activity_id_value(i) > high_water_mark
+    ]
     print(f"{len(to_generate_garmin_ids)} new activities to be downloaded")
 
-    to_generate_garmin_id2title = {}
-    for id in to_generate_garmin_ids:
-        try:
-            activity_summary = await client.get_activity_summary(id)
-            activity_title = activity_summary.get("activityName", "")
-            to_generate_garmin_id2title[id] = activity_title
-        except Exception as e:
-            print(f"Failed to get activity summary {id}: {str(e)}")
-            continue
+    pipeline = SyncPipeline(sql_file) if sql_file else None
+
+    async def download_activity(activity_id):
+        # fetch the title together with the download
+        files = []
+        title, ok = await asyncio.gather(
+            get_activity_title(client, activity_id),
+            download_garmin_data(
+                client,
+                activity_id,
+                file_type=file_type,
+                on_file=(lambda *f: files.append(f)) if pipeline else None,
+            ),
+        )
+        if pipeline is not None:
+            if title is not None:
+                pipeline.activity_title_dict[activity_id] = title
+            for file_path, data in files:
+                await pipeline.put(file_path, data)
+        return title, ok
 
     start_time = time.time()
-    await gather_with_concurrency(
-        10,
-        [
-            download_garmin_data(client, id, file_type=file_type)
-            for id in to_generate_garmin_ids
-        ],
-    )
+    async with pipeline or contextlib.nullcontext():
+        # two requests per activity
+        results = await gather_with_concurrency(
+            5, [download_activity(id) for id in to_generate_garmin_ids]
+        )
     print(f"Download finished. Elapsed {time.time()-start_time} seconds")
+    titles = [title for title, _ in results]
+    downloaded = [ok for _, ok in results]
+    to_generate_garmin_id2title = {
+        id: title
+        for id, title in zip(to_generate_garmin_ids, titles)
+        if title is not None
+    }
+
+    # do not move the mark past activities that failed, to retry them next time
+    new_high_water_mark = max(map(_activity_id_value, activity_ids), default=0)
+    failed_ids = [
+        _activity_id_value(id)
+        for id, ok in zip(to_generate_garmin_ids, downloaded)
+        if not ok
+    ]
+    if failed_ids:
+        new_high_water_mark = min(new_high_water_mark, min(failed_ids) - 1)
+    if new_high_water_mark > high_water_mark:
+        save_high_water_mark(folder, is_only_running, new_high_water_mark)
 
     await client.req.aclose()
     return to_generate_garmin_ids, to_generate_garmin_id2title
@@ -351,6 +462,12 @@ if __name__ == "__main__":
         default="gpx",
         help="to download personal documents or ebook",
     )
+    parser.add_argument(
+        "--parse-while-downloading",
+        dest="parse_while_downloading",
+        action="store_true",
+        help="parse the downloaded files and write them to the db while downloading",
+    )
     options = parser.parse_args()
     secret_string = options.secret_string
     auth_domain = (
@@ -384,6 +501,7 @@ if __name__ == "__main__":
             is_only_running,
             folder,
             file_type,
+            SQL_FILE if options.parse_while_downloading else None,
         )
     )
     loop.run_until_complete(future)
@@ -398,5 +516,9 @@ if __name__ == "__main__":
             activity_title_dict=id2title,
         )
     make_activities_file_only(
-        SQL_FILE, folder, JSON_FILE, file_suffix=file_type, activity_title_dict=id2title
+        SQL_FILE,
+        folder,
+        JSON_FILE,
+        file_suffix=file_type,
+        activity_title_dict=id2title,
     )
@@ -8,6 +8,7 @@ from gpxtrackposter import (
     circular_drawer,
     github_drawer,
     grid_drawer,
+    heatmap_drawer,
     poster,
     track_loader,
 )
@@ -26,6 +27,7 @@ def main():
         "grid": grid_drawer.GridDrawer(p),
         "circular": circular_drawer.CircularDrawer(p),
         "github": github_drawer.GithubDrawer(p),
+        "heatmap": heatmap_drawer.HeatmapDrawer(p),
     }
 
     args_parser = argparse.ArgumentParser()
@@ -188,6 +190,44 @@ def main():
         help='github svg style; "align-firstday", "align-monday" (default: "align-firstday").',
     )
 
+    args_parser.add_argument(
+        "--stream-svg",
+        dest="stream_svg",
+        action="store_true",
+        help="Write svg elements straight to the output file instead of building the whole document in memory.",
+    )
+
+    args_parser.add_argument(
+        "--compact-svg",
+        dest="compact_svg",
+        action="store_true",
+        help="Write smaller svg files with relative paths and shared styles; "
+        'use an output file name ending with ".svgz" to also compress them.',
+    )
+
+    args_parser.add_argument(
+        "--svg-precision",
+        dest="svg_precision",
+        metavar="DECIMALS",
+        type=int,
+        default=2,
+        help="Number of decimals of coordinates in compact svg files (default: 2).",
+    )
+
+    args_parser.add_argument(
+        "--force",
+        dest="force",
+        action="store_true",
+        help="Draw the poster even if its tracks and options did not change since the last run.",
+    )
+
+    args_parser.add_argument(
+        "--no-svg-validation",
+        dest="validate_svg",
+        action="store_false",
+        help="Skip svg element and attribute validation.",
+    )
+
     for _, drawer in drawers.items():
         drawer.create_args(args_parser)
 
@@ -215,7 +255,10 @@ def main():
         # for svg from db here if you want gpx please do not use --from-db
         # args.type == "grid" means have polyline data or not
         tracks = loader.load_tracks_from_db(
-            SQL_FILE, args.type == "grid", args.type == "circular"
+            SQL_FILE,
+            args.type in ["grid", "heatmap"],
+            args.type == "circular",
+            drawers[args.type].needs_geometry,
         )
     else:
         tracks = loader.load_tracks(args.gpx_dir)
@@ -255,16 +298,18 @@ def main():
     if args.type == "github":
         p.height = 55 + p.years.real_year * 43
     p.github_style = args.github_style
+    p.stream_svg = args.stream_svg
+    p.validate_svg = args.validate_svg
+    p.compact_svg = args.compact_svg
+    p.svg_precision = args.svg_precision
     # for special circular
     if is_circular:
-        years = p.years.all()[:]
-        for y in years:
-            p.years.from_year, p.years.to_year = y, y
-            # may be refactor
-            p.set_tracks(tracks)
-            p.draw(drawers[args.type], os.path.join("assets", f"year_{str(y)}.svg"))
+        outputs = {
+            y: os.path.join("assets", f"year_{str(y)}.svg") for y in p.years.all()
+        }
+        p.draw_years(drawers[args.type], outputs, force=args.force)
     else:
-        p.draw(drawers[args.type], args.output)
+        p.draw_if_changed(drawers[args.type], args.output, force=args.force)
 
 
 if __name__ == "__main__":
@@ -1,22 +1,59 @@
+import asyncio
+import collections
+import concurrent.futures
 import datetime
 import os
 import sys
+import time
 
 import arrow
 import stravalib
 from config import MAPPING_TYPE
 from gpxtrackposter import track_loader
 from sqlalchemy import func
+from stravalib.util.limiter import get_seconds_until_next_quarter
 
 from polyline_processor import filter_out
 
-from .db import Activity, init_db, update_or_create_activity
+from .db import (
+    Activity,
+    activity_fingerprint,
+    init_db,
+    row_fingerprint,
+    update_or_create_activity,
+)
 
+from strava_streams import fetch_strava_streams, has_streams, streams_polyline
 from synced_data_file_logger import save_synced_data_file_list
 
 
 IGNORE_BEFORE_SAVING = os.getenv("IGNORE_BEFORE_SAVING", False)
 
+# strava's largest page
+STRAVA_PAGE_SIZE = 200
+STRAVA_FORCE_SYNC_AFTER = datetime.datetime(2022, 1, 1)
+STRAVA_WINDOW_DAYS = 180
+# every page is one request, a full resync is only a few dozen of them
+STRAVA_WINDOW_WORKERS = 4
+
+
+def strava_windows(after, before, days=STRAVA_WINDOW_DAYS):
+    """
+    Split the time between after and before into windows of days days
+    """
+    while after < before:
+        end = min(after + datetime.timedelta(days=days), before)
+        # windows overlap by a second, strava's bounds are exclusive
+        yield after, end + datetime.timedelta(seconds=1)
+        after = end
+
+
+def print_strava_counts(counts):
+    print(
+        f"\nDone: {counts['new']} new, {counts['updated']} updated, "
+        f"{counts['unchanged']} unchanged, {counts['skipped']} skipped."
+    )
+
 
 class Generator:
     def __init__(self, db_path):
@@ -55,39 +92,32 @@ class Generator:
 
         print("Start syncing")
         if force:
-            # filters = {"before": datetime.datetime.utcnow()}
-            filters = {"after": datetime.strptime("2022-01-01", "%Y-%m-%d")}
+            # the windows are fetched concurrently, the db is written here
+            windows = list(
+                strava_windows(STRAVA_FORCE_SYNC_AFTER, datetime.datetime.utcnow())
+            )
+
+            def get_window_pages(window):
+                # a client is not thread safe, every window gets its own
+                client = stravalib.Client(access_token=self.client.access_token)
+                return list(self.get_strava_pages(*window, client=client))
+
+            with concurrent.futures.ThreadPoolExecutor(STRAVA_WINDOW_WORKERS) as pool:
+                window_pages = pool.map(get_window_pages, windows)
+                counts = collections.Counter()
+                for pages in window_pages:
+                    for page in pages:
+                        self.save_strava_page(page, counts)
         else:
             last_activity = self.session.query(func.max(Activity.start_date)).scalar()
             if last_activity:
                 last_activity_date = arrow.get(last_activity)
                 last_activity_date = last_activity_date.shift(days=-7)
-                filters = {"after": last_activity_date.datetime}
-            else:
-                filters = {
-                    "before": datetime.datetime.utcnow(),
-                    "after": datetime.strptime("2022-01-01", "%Y-%m-%d"),
-                }
-
-        for activity in self.client.get_activities(**filters):
-            if self.only_run and activity.type != "Run":
-                continue
-            if IGNORE_BEFORE_SAVING:
-                if activity.map and activity.map.summary_polyline:
-                    activity.map.summary_polyline = filter_out(
-                        activity.map.summary_polyline
-                    )
-            activity.source = "strava"
-            #  strava use total_elevation_gain as elevation_gain
-            activity.elevation_gain = activity.total_elevation_gain
-            activity.subtype = activity.type
-            created = update_or_create_activity(self.session, activity)
-            if created:
-                sys.stdout.write("+")
+                after = last_activity_date.datetime
             else:
-                sys.stdout.write(".")
-            sys.stdout.flush()
-        self.session.commit()
+                after = STRAVA_FORCE_SYNC_AFTER
+            counts = self.sync_strava_pages(after)
+        print_strava_counts(counts)
 
     def sync_recent(self, days=7):
         """
@@ -97,34 +127,121 @@ class Generator:
         self.check_access()
 
         after = datetime.datetime.utcnow() - datetime.timedelta(days=days)
-        filters = {"after": after}
         print(
             f"Syncing activities after {after.strftime('%Y-%m-%d')} (last {days} days)"
         )
+        print_strava_counts(self.sync_strava_pages(after))
 
-        count_new = 0
-        count_update = 0
-        for activity in self.client.get_activities(**filters):
-            if self.only_run and activity.type != "Run":
-                continue
+    def sync_strava_pages(self, after, before=None):
+        counts = collections.Counter()
+        for page in self.get_strava_pages(after, before):
+            self.save_strava_page(page, counts)
+        return counts
+
+    def get_strava_pages(self, after, before=None, client=None):
+        """
+        Strava activity summaries between after and before, a page at a time
+        client defaults to self.client
+        """
+        client = client or self.client
+        params = {"after": arrow.get(after).int_timestamp}
+        if before:
+            params["before"] = arrow.get(before).int_timestamp
+        page_number = 1
+        while True:
+            raw_page = self.get_strava_page(page_number, params, client)
+            yield [
+                stravalib.model.Activity.deserialize(raw, bind_client=client)
+                for raw in raw_page
+            ]
+            if len(raw_page) < STRAVA_PAGE_SIZE:
+                return
+            page_number += 1
+
+    def get_strava_page(self, page_number, params, client):
+        while True:
+            try:
+                return client.protocol.get(
+                    "/athlete/activities",
+                    page=page_number,
+                    per_page=STRAVA_PAGE_SIZE,
+                    **params,
+                )
+            except stravalib.exc.RateLimitExceeded as e:
+                # wait for the 15 minute quota, but not for the daily one
+                if e.timeout is None or e.timeout > 15 * 60:
+                    raise
+                delay = get_seconds_until_next_quarter() + 1
+                print(f"Strava rate limit reached, retry in {delay} seconds")
+                time.sleep(delay)
+
+    def save_strava_page(self, activities, counts):
+        """
+        Upsert the new and changed activities of a page in one commit
+        '+' means new, '.' means updated and '=' means unchanged
+        """
+        if self.only_run:
+            counts["skipped"] += sum(a.type != "Run" for a in activities)
+            activities = [a for a in activities if a.type == "Run"]
+        if not activities:
+            return
+        rows = self.session.query(Activity).filter(
+            Activity.run_id.in_([a.id for a in activities])
+        )
+        fingerprints = {row.run_id: row_fingerprint(row) for row in rows}
+        for activity in activities:
+            # keep the full resolution track once the streams were fetched
+            detailed_polyline = streams_polyline(activity.id)
+            if detailed_polyline and activity.map:
+                activity.map.summary_polyline = detailed_polyline
             if IGNORE_BEFORE_SAVING:
                 if activity.map and activity.map.summary_polyline:
                     activity.map.summary_polyline = filter_out(
                         activity.map.summary_polyline
                     )
             activity.source = "strava"
+            #  strava use total_elevation_gain as elevation_gain
             activity.elevation_gain = activity.total_elevation_gain
             activity.subtype = activity.type
-            created = update_or_create_activity(self.session, activity)
-            if created:
+            if fingerprints.get(activity.id) == activity_fingerprint(activity):
+                sys.stdout.write("=")
+                counts["unchanged"] += 1
+            elif update_or_create_activity(self.session, activity):
                 sys.stdout.write("+")
-                count_new += 1
+                counts["new"] += 1
             else:
                 sys.stdout.write(".")
-                count_update += 1
+                counts["updated"] += 1
             sys.stdout.flush()
         self.session.commit()
-        print(f"\nDone: {count_new} new, {count_update} updated.")
+
+    def sync_strava_streams(self):
+        """
+        Fetch the streams of strava activities with gps data that have none yet
+        and use them as the activity polyline, newest activities first
+        """
+        rows = (
+            self.session.query(Activity)
+            .filter(Activity.source == "strava", Activity.summary_polyline != "")
+            .order_by(Activity.start_date.desc())
+            .all()
+        )
+        missing = [row for row in rows if not has_streams(row.run_id)]
+        print(f"{len(missing)} strava activities without streams")
+        if not missing:
+            return
+        stored = set(
+            asyncio.run(
+                fetch_strava_streams(self.access_token, [r.run_id for r in missing])
+            )
+        )
+        for row in missing:
+            detailed_polyline = row.run_id in stored and streams_polyline(row.run_id)
+            if detailed_polyline:
+                if IGNORE_BEFORE_SAVING:
+                    detailed_polyline = filter_out(detailed_polyline)
+                row.summary_polyline = detailed_polyline
+        self.session.commit()
 
     def sync_from_data_dir(self, data_dir, file_suffix="gpx", activity_title_dict={}):
         loader = track_loader.TrackLoader()
@@ -136,21 +253,32 @@ class Generator:
             print("No tracks found.")
             return
 
+        self.sync_from_tracks(tracks)
+
+    def sync_from_tracks(self, tracks, save_synced=True):
+        """
+        Save loaded tracks and record their files as synced
+        return the run ids of the activities that were created
+        """
         synced_files = []
+        created_ids = []
 
         for t in tracks:
             created = update_or_create_activity(self.session, t.to_namedtuple())
             if created:
+                created_ids.append(t.run_id)
                 sys.stdout.write("+")
             else:
                 sys.stdout.write(".")
             synced_files.extend(t.file_names)
             sys.stdout.flush()
 
-        save_synced_data_file_list(synced_files)
-
         self.session.commit()
 
+        if save_synced:
+            save_synced_data_file_list(synced_files)
+        return created_ids
+
     def sync_from_kml_track(self, track):
         created = update_or_create_activity(self.session, track.to_namedtuple())
         if created:
@@ -182,6 +182,49 @@ class Activity(Base):
         return data
 
 
+def activity_fingerprint(run_activity):
+    """
+    The values update_or_create_activity writes over an existing row, to skip
+    summaries that did not change since the last sync
+    start dates, start_latlng and the location are only written when the row
+    is created, a summary that only changed those would be saved for nothing
+    """
+    return (
+        clean_activity_name(run_activity.name),
+        float(run_activity.distance),
+        run_activity.moving_time,
+        run_activity.elapsed_time,
+        TYPE_DICT.get(run_activity.type, run_activity.type),
+        run_activity.average_heartrate,
+        float(run_activity.average_speed),
+        (
+            float(run_activity.elevation_gain)
+            if run_activity.elevation_gain is not None
+            else None
+        ),
+        run_activity.map and run_activity.map.summary_polyline or "",
+        run_activity.source if hasattr(run_activity, "source") else "gpx",
+    )
+
+
+def row_fingerprint(activity):
+    """
+    activity_fingerprint of a stored row
+    """
+    return (
+        activity.name,
+        activity.distance,
+        activity.moving_time,
+        activity.elapsed_time,
+        activity.type,
+        activity.average_heartrate,
+        activity.average_speed,
+        activity.elevation_gain,
+        activity.summary_polyline,
+        activity.source,
+    )
+
+
 def update_or_create_activity(session, run_activity):
     created = False
     try:
@@ -0,0 +1,123 @@
+"""
+Write gpx files straight from track point columns
+the files have the same layout as the gpxpy documents the app syncs used to
+build, without creating an object for every track point
+"""
+
+import math
+from xml.sax.saxutils import escape
+
+import numpy as np
+
+GPX_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<gpx xmlns="http://www.topografix.com/GPX/1/1" '
+    'xmlns:gpxtpx="http://www.garmin.com/xmlschemas/TrackPointExtension/v1" '
+    'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+    'xsi:schemaLocation="http://www.topografix.com/GPX/1/1 '
+    'http://www.topografix.com/GPX/1/1/gpx.xsd" version="1.1" '
+    # the creator ends up as the source of the activity, keep it as it was
+    'creator="gpx.py -- https://github.com/tkrajina/gpxpy">\n'
+    "  <trk>\n"
+)
+GPX_FOOTER = "    </trkseg>\n  </trk>\n</gpx>"
+TRKPT = '      <trkpt lat="%s" lon="%s">\n%s        <time>%s</time>\n%s      </trkpt>\n'
+TRKPT_ELE = "        <ele>%s</ele>\n"
+TRKPT_HR = (
+    "        <extensions>\n"
+    "          <gpxtpx:TrackPointExtension>\n"
+    "            <gpxtpx:hr>%d</gpxtpx:hr>\n"
+    "          </gpxtpx:TrackPointExtension>\n"
+    "        </extensions>\n"
+)
+
+# track points formatted before a write
+CHUNK_SIZE = 4096
+
+
+def write_gpx(
+    file_name,
+    latitudes,
+    longitudes,
+    times_ms,
+    elevations=None,
+    heart_rates=None,
+    name=None,
+    track_type=None,
+):
+    """
+    Write a gpx file with a single track segment
+    times_ms are utc epoch milliseconds, missing (None or nan) elevations and
+    heart rates are left out, heart rates are rounded to whole beats
+    """
+    count = len(latitudes)
+    columns = list(
+        zip(
+            format_numbers(latitudes),
+            format_numbers(longitudes),
+            _optional(elevations, lambda v: TRKPT_ELE % format_number(v), count),
+            format_times(times_ms),
+            _optional(heart_rates, lambda v: TRKPT_HR % round(v), count),
+        )
+    )
+    with open(file_name, "w", encoding="utf-8") as f:
+        f.write(GPX_HEADER)
+        if name is not None:
+            f.write(f"    <name>{escape(str(name))}</name>\n")
+        if track_type is not None:
+            f.write(f"    <type>{escape(str(track_type))}</type>\n")
+        f.write("    <trkseg>\n")
+        for i in range(0, len(columns), CHUNK_SIZE):
+            f.write("".join([TRKPT % row for row in columns[i : i + CHUNK_SIZE]]))
+        f.write(GPX_FOOTER)
+    return file_name
+
+
+def format_number(value):
+    text = str(value)
+    # scientific notation is not allowed in gpx 1.1
+    if "e" in text and isinstance(value, float):
+        text = format(value, ".10f").rstrip("0").rstrip(".")
+        # values below the precision round to zero
+        return "0" if text in ("", "-", "-0") else text
+    return text
+
+
+def format_numbers(values):
+    return [
+        format_number(v) if "e" in text else text
+        for v, text in zip(values, map(str, _as_list(values)))
+    ]
+
+
+def format_times(times_ms):
+    """
+    Format utc epoch milliseconds like gpxpy formats utc datetimes
+    """
+    times_ms = np.asarray(times_ms)
+    if times_ms.dtype.kind == "f":
+        microseconds = np.round(times_ms * 1000).astype(np.int64)
+    else:
+        microseconds = times_ms.astype(np.int64) * 1000
+    times = microseconds.astype("datetime64[us]")
+    # gpxpy only writes the fraction of a second when there is one
+    return np.where(
+        microseconds % 1_000_000 == 0,
+        np.datetime_as_string(times.astype("datetime64[s]"), timezone="UTC"),
+        np.datetime_as_string(times, unit="us", timezone="UTC"),
+    ).tolist()
+
+
+def _as_list(values):
+    # numpy arrays give python numbers, which format the way gpxpy does
+    return values.tolist() if hasattr(values, "tolist") else values
+
+
+def _optional(values, format_value, count):
+    # missing values become empty strings
+    if values is None:
+        return [""] * count
+    return [
+        "" if v is None or (isinstance(v, float) and math.isnan(v)) else format_value(v)
+        for v in _as_list(values)
+    ]
@@ -94,6 +94,7 @@ class CircularDrawer(TracksDrawer):
                 y += 1
 
     def _draw_year(self, dr: svgwrite.Drawing, size: XY, offset: XY, year: int):
+        colors = self.poster.draw_colors()
         min_size = min(size.x, size.y)
         outer_radius = 0.5 * min_size - 6
         radius_range = ValueRange.from_pair(outer_radius / 4, outer_radius)
@@ -109,7 +110,7 @@ class CircularDrawer(TracksDrawer):
             dr.text(
                 f"{year}",
                 insert=center.tuple(),
-                fill=self.poster.colors["text"],
+                fill=colors["text"],
                 text_anchor="middle",
                 alignment_baseline="middle",
                 style=year_style,
@@ -134,7 +135,7 @@ class CircularDrawer(TracksDrawer):
                     dr.line(
                         start=(center + r1 * XY(sin_a1, -cos_a1)).tuple(),
                         end=(center + r2 * XY(sin_a1, -cos_a1)).tuple(),
-                        stroke=self.poster.colors["text"],
+                        stroke=colors["text"],
                         stroke_width=0.3,
                     )
                 )
@@ -147,12 +148,12 @@ class CircularDrawer(TracksDrawer):
                     f"a{r3},{r3} 0 0,1 {r3 * (sin_a3 - sin_a1)},{r3 * (cos_a1 - cos_a3)}"
                 )
                 dr.add(path)
-                tpath = svgwrite.text.TextPath(
+                tpath = dr.textPath(
                     path, date.strftime("%B"), startOffset=(0.5 * r3 * (a3 - a1))
                 )
                 text = dr.text(
                     "",
-                    fill=self.poster.colors["text"],
+                    fill=colors["text"],
                     text_anchor="middle",
                     style=month_style,
                 )
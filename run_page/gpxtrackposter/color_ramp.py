@@ -0,0 +1,38 @@
+"""Represent a precomputed color gradient between two colors"""
+
+import functools
+from typing import List
+
+from .utils import interpolate_color
+
+
+class ColorRamp:
+    """Represent a precomputed color gradient between two colors.
+
+    Interpolating colors is expensive, so the gradient is quantized into a table
+    once and colors are looked up by index afterwards.
+
+    Attributes:
+        colors: Hex colors of the quantized gradient, from color1 to color2.
+
+    Methods:
+        get: Return a precomputed ramp shared by all callers.
+        color: Return the color at ratio in [0, 1].
+    """
+
+    def __init__(self, color1: str, color2: str, steps: int = 256):
+        self.colors: List[str] = [
+            interpolate_color(color1, color2, i / (steps - 1)) for i in range(steps)
+        ]
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def get(color1: str, color2: str) -> "ColorRamp":
+        return ColorRamp(color1, color2)
+
+    def color(self, ratio: float) -> str:
+        if ratio < 0:
+            ratio = 0
+        elif ratio > 1:
+            ratio = 1
+        return self.colors[round(ratio * (len(self.colors) - 1))]
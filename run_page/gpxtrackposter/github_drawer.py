@@ -17,9 +17,17 @@ class GithubDrawer(TracksDrawer):
     def __init__(self, the_poster: Poster):
         super().__init__(the_poster)
 
+    def css(self) -> str:
+        text_color = self.poster.draw_colors()["text"]
+        return (
+            ".day{fill:#444444}"
+            f".month{{fill:{text_color};font-size:2.5px;font-family:Arial}}"
+        )
+
     def draw(self, dr: svgwrite.Drawing, size: XY, offset: XY):
         if self.poster.tracks is None:
             raise PosterError("No tracks to draw")
+        colors = self.poster.draw_colors()
         year_size = 200 * 4.0 / 80.0
         year_style = f"font-size:{year_size}px; font-family:Arial;"
         year_length_style = f"font-size:{110 * 3.0 / 80.0}px; font-family:Arial;"
@@ -92,7 +100,7 @@ class GithubDrawer(TracksDrawer):
                 dr.text(
                     f"{year}",
                     insert=offset.tuple(),
-                    fill=self.poster.colors["text"],
+                    fill=colors["text"],
                     dominant_baseline="hanging",
                     style=year_style,
                 )
@@ -102,18 +110,22 @@ class GithubDrawer(TracksDrawer):
                 dr.text(
                     f"{year_length} {km_or_mi}",
                     insert=(offset.tuple()[0] + 165, offset.tuple()[1] + 5),
-                    fill=self.poster.colors["text"],
+                    fill=colors["text"],
                     dominant_baseline="hanging",
                     style=year_length_style,
                 )
             )
             # add month name up to the poster one by one because of svg text auto trim the spaces.
             for num, name in enumerate(month_names):
+                insert = (offset.tuple()[0] + 15.5 * num, offset.tuple()[1] + 14)
+                if self.poster.compact_svg:
+                    dr.add(dr.text(f"{name}", insert=insert, class_="month"))
+                    continue
                 dr.add(
                     dr.text(
                         f"{name}",
-                        insert=(offset.tuple()[0] + 15.5 * num, offset.tuple()[1] + 14),
-                        fill=self.poster.colors["text"],
+                        insert=insert,
+                        fill=colors["text"],
                         style=month_names_style,
                     )
                 )
@@ -138,8 +150,8 @@ class GithubDrawer(TracksDrawer):
                     rect_y += 3.5
                     color = "#444444"
                     date_title = str(github_rect_day)
-                    if date_title in self.poster.tracks_by_date:
-                        tracks = self.poster.tracks_by_date[date_title]
+                    tracks = self.poster.tracks_by_date.get(date_title)
+                    if tracks:
                         length = sum([t.length for t in tracks])
                         distance1 = self.poster.special_distance["special_distance"]
                         distance2 = self.poster.special_distance["special_distance2"]
@@ -148,14 +160,16 @@ class GithubDrawer(TracksDrawer):
                             self.poster.length_range_by_date, length, has_special
                         )
                         if length / 1000 >= distance2:
-                            color = self.poster.colors.get(
-                                "special2"
-                            ) or self.poster.colors.get("special")
+                            color = colors.get("special2") or colors.get("special")
                         str_length = format_float(self.poster.m2u(length))
                         date_title = f"{date_title} {str_length} {km_or_mi}"
 
-                    rect = dr.rect((rect_x, rect_y), dom, fill=color)
-                    rect.set_desc(title=date_title)
+                    if self.poster.compact_svg and not tracks:
+                        # days without tracks share their style and skip the title
+                        rect = dr.rect((rect_x, rect_y), dom, class_="day")
+                    else:
+                        rect = dr.rect((rect_x, rect_y), dom, fill=color)
+                        rect.set_desc(title=date_title)
                     dr.add(rect)
                     github_rect_day += datetime.timedelta(1)
                 rect_x += 3.5
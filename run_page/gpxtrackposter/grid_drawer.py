@@ -11,19 +11,28 @@ from .exceptions import PosterError
 from .poster import Poster
 from .track import Track
 from .tracks_drawer import TracksDrawer
-from .utils import compute_grid, format_float, project
+from .utils import compute_grid, format_float, project_array, svg_path_data
 from .xy import XY
 
 
 class GridDrawer(TracksDrawer):
     """Drawer used to draw a grid poster
 
+    Attributes:
+        _tolerance: Maximum deviation of the drawn tracks from their full
+            geometry, in poster units.
+
     Methods:
         draw: For each track, draw it on the poster.
+        css: Return the track style shared in compact posters.
     """
 
+    needs_geometry = True
+
     def __init__(self, the_poster: Poster):
         super().__init__(the_poster)
+        # a fifth of the stroke width, invisible at any sensible zoom level
+        self._tolerance = 0.1
 
     def draw(self, dr: svgwrite.Drawing, size: XY, offset: XY):
         """For each track, draw it on the poster."""
@@ -52,28 +61,43 @@ class GridDrawer(TracksDrawer):
                 offset + 0.05 * XY(cell_size, cell_size) + p,
             )
 
+    def css(self) -> str:
+        return (
+            ".track{fill:none;stroke-width:0.5;"
+            "stroke-linejoin:round;stroke-linecap:round}"
+        )
+
     def _draw_track(self, dr: svgwrite.Drawing, tr: Track, size: XY, offset: XY):
+        colors = self.poster.draw_colors()
         color = self.color(self.poster.length_range, tr.length, tr.special)
 
         str_length = format_float(self.poster.m2u(tr.length))
 
         date_title = f"{str(tr.start_time_local)[:10]} {str_length}km"
-        for line in project(tr.bbox(), size, offset, tr.polylines):
+        lines = project_array(
+            tr.bbox(), size, offset, tr.polyline_arrays(), self._tolerance
+        )
+        for line in lines:
             distance1 = self.poster.special_distance["special_distance"]
             distance2 = self.poster.special_distance["special_distance2"]
             has_special = distance1 < tr.length / 1000 < distance2
             color = self.color(self.poster.length_range_by_date, tr.length, has_special)
             if tr.length / 1000 >= distance2:
-                color = self.poster.colors.get("special2") or self.poster.colors.get(
-                    "special"
+                color = colors.get("special2") or colors.get("special")
+            if self.poster.compact_svg:
+                polyline = dr.path(
+                    d=svg_path_data(line, self.poster.svg_precision),
+                    stroke=color,
+                    class_="track",
+                )
+            else:
+                polyline = dr.polyline(
+                    points=line.tolist(),
+                    stroke=color,
+                    fill="none",
+                    stroke_width=0.5,
+                    stroke_linejoin="round",
+                    stroke_linecap="round",
                 )
-            polyline = dr.polyline(
-                points=line,
-                stroke=color,
-                fill="none",
-                stroke_width=0.5,
-                stroke_linejoin="round",
-                stroke_linecap="round",
-            )
             polyline.set_desc(title=date_title, desc=tr.run_id)
             dr.add(polyline)
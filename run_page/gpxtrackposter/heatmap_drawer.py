@@ -0,0 +1,303 @@
+"""Draw a heatmap poster."""
+
+import argparse
+import base64
+import math
+import struct
+import zlib
+from typing import List, Tuple
+
+import numpy as np
+import svgwrite
+
+from .color_ramp import ColorRamp
+from .exceptions import ParameterError, PosterError
+from .poster import Poster
+from .tracks_drawer import TracksDrawer
+from .utils import latlng2xy_array
+from .xy import XY
+
+
+class HeatmapDrawer(TracksDrawer):
+    """Draw the density of all tracks on a single map.
+
+    All track points are binned into a grid of cells, so the cost of drawing
+    depends on the number of points and the resolution, not on the number of
+    tracks. Densities are log scaled and mapped onto the track color ramp.
+
+    Attributes:
+        _resolution: Number of cells along the longer side of the poster.
+        _format: "png" to embed a bitmap, "svg" to draw one rectangle per run
+            of equal cells in a row.
+        _bbox: Optional (lat_lo, lng_lo, lat_hi, lng_hi) area to draw, without
+            it the map frames the densest cluster of tracks.
+
+    Methods:
+        create_args: Set up an argparser for heatmap poster options.
+        fetch_args: Get args from argparser.
+        draw: Draw the heatmap of all tracks on the poster.
+    """
+
+    # number of color levels used by the svg output
+    _svg_levels = 16
+    # without an explicit bbox, the map frames the connected cells of this size
+    # (about 20 km, in mercator units) around the cell most tracks pass
+    _cluster_cell = 0.001
+
+    needs_geometry = True
+
+    def __init__(self, the_poster: Poster):
+        super().__init__(the_poster)
+        self._resolution = 400
+        self._format = "png"
+        self._bbox = None
+
+    def create_args(self, args_parser: argparse.ArgumentParser):
+        """Add arguments to the parser"""
+        group = args_parser.add_argument_group("Heatmap Type Options")
+        group.add_argument(
+            "--heatmap-resolution",
+            dest="heatmap_resolution",
+            metavar="CELLS",
+            type=int,
+            default=400,
+            help="Number of heatmap cells along the longer side of the poster (default: 400).",
+        )
+        group.add_argument(
+            "--heatmap-format",
+            dest="heatmap_format",
+            choices=["png", "svg"],
+            default="png",
+            help='Embed the heatmap as "png" image or draw it as "svg" shapes (default: "png").',
+        )
+        group.add_argument(
+            "--heatmap-bbox",
+            dest="heatmap_bbox",
+            metavar="LAT,LNG,LAT,LNG",
+            type=str,
+            help="Area to draw, as south-west and north-east corners "
+            "(default: the area around the cell most tracks pass through).",
+        )
+
+    def fetch_args(self, args):
+        """Get arguments from the parser"""
+        self._resolution = args.heatmap_resolution
+        self._format = args.heatmap_format
+        if args.heatmap_bbox:
+            try:
+                lat_lo, lng_lo, lat_hi, lng_hi = map(
+                    float, args.heatmap_bbox.split(",")
+                )
+            except ValueError:
+                raise ParameterError(f"Bad heatmap bbox: {args.heatmap_bbox}.")
+            self._bbox = (lat_lo, lng_lo, lat_hi, lng_hi)
+
+    def draw(self, dr: svgwrite.Drawing, size: XY, offset: XY):
+        """Draw the heatmap of all tracks on the poster."""
+        if self.poster.tracks is None:
+            raise PosterError("No tracks to draw.")
+        lines = [
+            line
+            for tr in self.poster.tracks
+            for line in tr.polyline_arrays()
+            if len(line) > 0
+        ]
+        if not lines:
+            raise PosterError("No track geometry to draw.")
+        counts = self._histogram(lines, size)
+        if counts.max() == 0:
+            return
+        # log scale, so that single visits are still visible next to daily routes
+        levels = np.log1p(counts) / math.log1p(counts.max())
+        if self._format == "svg":
+            self._draw_svg(dr, size, offset, levels)
+        else:
+            self._draw_png(dr, size, offset, levels)
+
+    def _grid_shape(self, size: XY) -> Tuple[int, int]:
+        cell = max(size.x, size.y) / max(self._resolution, 1)
+        return max(1, round(size.x / cell)), max(1, round(size.y / cell))
+
+    def _histogram(self, lines: List[np.ndarray], size: XY) -> np.ndarray:
+        """Count the track points falling into each cell of the grid.
+
+        Segments are sampled at cell resolution, so that long straight segments
+        between sparse points still mark every cell they cross. They are
+        clipped to the grid first, so that a gps glitch or tracks far away
+        from the drawn area cost nothing.
+        """
+        count_x, count_y = self._grid_shape(size)
+        xy = latlng2xy_array(np.concatenate(lines))
+        if self._bbox is not None:
+            lat_lo, lng_lo, lat_hi, lng_hi = self._bbox
+            corners = latlng2xy_array(np.array([[lat_lo, lng_lo], [lat_hi, lng_hi]]))
+            min_xy, max_xy = corners.min(axis=0), corners.max(axis=0)
+        else:
+            min_xy, max_xy = self._cluster_bounds(lines, xy)
+        d_xy = max_xy - min_xy
+        if not d_xy.any():
+            raise PosterError("Unable to compute heatmap bounds.")
+        grid = np.array([count_x, count_y], dtype=float)
+        # keep the aspect ratio and center the tracks on the grid
+        scale = min(grid[d_xy > 0] / d_xy[d_xy > 0])
+        cells = (xy - min_xy) * scale + 0.5 * (grid - scale * d_xy)
+
+        # a segment joins point i and i + 1 unless i is the last point of a line
+        ends = np.cumsum([len(line) for line in lines]) - 1
+        valid = np.ones(len(cells), dtype=bool)
+        valid[ends] = False
+        starts = np.flatnonzero(valid)
+        origin = cells[starts]
+        delta = cells[starts + 1] - origin
+        t_in, t_out = _clip_segments(origin, delta, grid)
+        kept = t_in <= t_out
+        origin = origin[kept] + t_in[kept, None] * delta[kept]
+        delta = (t_out - t_in)[kept, None] * delta[kept]
+        steps = np.ceil(np.abs(delta).max(axis=1, initial=0)).astype(int) + 1
+        segment = np.repeat(np.arange(len(origin)), steps)
+        first = np.cumsum(steps) - steps
+        t = (np.arange(len(segment)) - first[segment]) / steps[segment]
+        samples = origin[segment] + t[:, None] * delta[segment]
+        samples = np.concatenate([samples, cells[ends]])
+
+        inside = (
+            (samples[:, 0] >= 0)
+            & (samples[:, 0] < count_x)
+            & (samples[:, 1] >= 0)
+            & (samples[:, 1] < count_y)
+        )
+        ix = samples[inside, 0].astype(int)
+        iy = samples[inside, 1].astype(int)
+        counts = np.bincount(iy * count_x + ix, minlength=count_x * count_y)
+        return counts.reshape(count_y, count_x)
+
+    def _cluster_bounds(
+        self, lines: List[np.ndarray], xy: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Bounds of the densest cluster of track points.
+
+        Points are put into coarse cells. The cluster grows from the cell the
+        most tracks pass through to the connected cells that more than one track
+        passes, so tracks in other cities, single long rides and stray points
+        do not shrink the map.
+        """
+        kx, ky = np.floor(xy / self._cluster_cell).astype(np.int64).T
+        cells, inverse = np.unique((kx << 32) + ky, return_inverse=True)
+        # tracks passing each cell, counted once per track
+        line_index = np.repeat(np.arange(len(lines)), [len(line) for line in lines])
+        visits = np.unique(line_index * len(cells) + inverse) % len(cells)
+        tracks = np.bincount(visits, minlength=len(cells))
+
+        index = {cell: i for i, cell in enumerate(cells.tolist())}
+        in_cluster = np.zeros(len(cells), dtype=bool)
+        start = int(tracks.argmax())
+        # with a single track, the whole track is the cluster
+        min_tracks = min(2, tracks[start])
+        in_cluster[start] = True
+        stack = [start]
+        while stack:
+            cell = cells[stack.pop()]
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    i = index.get(int(cell + (dx << 32) + dy))
+                    if i is not None and not in_cluster[i] and tracks[i] >= min_tracks:
+                        in_cluster[i] = True
+                        stack.append(i)
+        points = xy[in_cluster[inverse]]
+        return points.min(axis=0), points.max(axis=0)
+
+    def _palette(self) -> List[str]:
+        colors = self.poster.draw_colors()
+        return ColorRamp.get(colors["track"], colors["track2"]).colors
+
+    def _draw_png(self, dr: svgwrite.Drawing, size: XY, offset: XY, levels):
+        palette = np.array(
+            [[int(c[i : i + 2], 16) for i in (1, 3, 5)] for c in self._palette()],
+            dtype=np.uint8,
+        )
+        index = np.round(levels * (len(palette) - 1)).astype(int)
+        rgba = np.zeros(levels.shape + (4,), dtype=np.uint8)
+        rgba[..., :3] = palette[index]
+        rgba[..., 3] = np.where(levels > 0, np.round(64 + 191 * levels), 0)
+        png = base64.b64encode(_encode_png(rgba)).decode("ascii")
+        dr.add(
+            dr.image(
+                href=f"data:image/png;base64,{png}",
+                insert=offset.tuple(),
+                size=size.tuple(),
+                preserveAspectRatio="none",
+                style="image-rendering:pixelated",
+            )
+        )
+
+    def _draw_svg(self, dr: svgwrite.Drawing, size: XY, offset: XY, levels):
+        count_y, count_x = levels.shape
+        cell = XY(size.x / count_x, size.y / count_y)
+        quantized = np.ceil(levels * self._svg_levels).astype(int)
+        palette = self._palette()
+        paths = {}
+        for y in range(count_y):
+            row = quantized[y]
+            # merge runs of cells with the same level into one rectangle
+            changes = np.flatnonzero(np.diff(row)) + 1
+            run_starts = np.concatenate([[0], changes])
+            run_ends = np.concatenate([changes, [count_x]])
+            for start, end in zip(run_starts, run_ends):
+                level = row[start]
+                if level == 0:
+                    continue
+                paths.setdefault(level, []).append(
+                    f"M{offset.x + start * cell.x:.3f} {offset.y + y * cell.y:.3f}"
+                    f"h{(end - start) * cell.x:.3f}v{cell.y:.3f}"
+                    f"h{-(end - start) * cell.x:.3f}z"
+                )
+        for level, d in sorted(paths.items()):
+            ratio = level / self._svg_levels
+            dr.add(
+                dr.path(
+                    d="".join(d),
+                    fill=palette[round(ratio * (len(palette) - 1))],
+                    fill_opacity=f"{0.25 + 0.75 * ratio:.3f}",
+                    stroke="none",
+                )
+            )
+
+
+def _clip_segments(
+    origin: np.ndarray, delta: np.ndarray, grid: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Liang-Barsky clipping of the segments origin + t * delta to the grid.
+
+    Returns the range of t inside the rectangle from 0 to grid for each
+    segment, empty (t_in > t_out) when the segment misses it.
+    """
+    t_in = np.zeros(len(origin))
+    t_out = np.ones(len(origin))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for p, q in ((-delta, origin), (delta, grid - origin)):
+            t = q / p
+            t_in = np.maximum(t_in, np.where(p < 0, t, 0).max(axis=1))
+            t_out = np.minimum(t_out, np.where(p > 0, t, 1).min(axis=1))
+            # parallel to an edge and outside of it
+            t_in[((p == 0) & (q < 0)).any(axis=1)] = np.inf
+    return t_in, t_out
+
+
+def _encode_png(rgba: np.ndarray) -> bytes:
+    """Encode an (h, w, 4) uint8 array as RGBA png."""
+    height, width, _ = rgba.shape
+    # every scanline starts with filter type 0 (none)
+    raw = np.zeros((height, width * 4 + 1), dtype=np.uint8)
+    raw[:, 1:] = rgba.reshape(height, width * 4)
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        crc = zlib.crc32(tag + data) & 0xFFFFFFFF
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", crc)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", header)
+        + chunk(b"IDAT", zlib.compress(raw.tobytes(), 9))
+        + chunk(b"IEND", b"")
+    )
@@ -1,18 +1,32 @@
 """Create a poster from track data."""
 
+import concurrent.futures
+import copy
 import gettext
+import gzip
+import hashlib
 import locale
+import os
 from collections import defaultdict
-from datetime import datetime
+from datetime import date, datetime
 
 import pytz
 import svgwrite
 
+from .streaming_drawing import StreamingDrawing
 from .utils import format_float
 from .value_range import ValueRange
 from .xy import XY
 from .year_range import YearRange
 
+# the plain drawer type draws with its own colors whatever the poster is set to
+PLAIN_COLORS = {
+    "background": "#1a1a1a",
+    "track": "red",
+    "special": "yellow",
+    "text": "#e1ed5e",
+}
+
 
 class Poster:
     """Create a poster from track data.
@@ -21,6 +35,7 @@ class Poster:
         athlete: Name of athlete to be displayed on poster.
         title: Title of poster.
         tracks_by_date: Tracks organized temporally if needed.
+        tracks_by_year: Tracks partitioned by year and date ordinal.
         tracks: List of tracks to be used in the poster.
         length_range: Range of lengths of tracks in poster.
         length_range_by_date: Range of lengths organized temporally.
@@ -30,10 +45,19 @@ class Poster:
         height: Poster height.
         years: Years included in the poster.
         tracks_drawer: drawer used to draw the poster.
+        stream_svg: Stream SVG elements to the output file instead of building a DOM.
+        validate_svg: Validate SVG elements and attributes while drawing.
+        compact_svg: Draw with relative paths and shared CSS classes.
+        svg_precision: Number of decimals of coordinates in compact SVG.
 
     Methods:
         set_tracks: Associate the Poster with a set of tracks
         draw: Draw the tracks on the poster.
+        draw_if_changed: Draw the tracks unless the output is up to date.
+        draw_years: Draw one poster per year, skipping unchanged years.
+        year_poster: Return a copy of the Poster narrowed down to one year.
+        fingerprint: Return a hash of everything the drawn poster depends on.
+        draw_colors: Return the colors the poster is drawn with.
         m2u: Convert meters to kilometers or miles based on units
         u: Return distance unit (km or mi)
     """
@@ -42,6 +66,7 @@ class Poster:
         self.athlete = None
         self.title = None
         self.tracks_by_date = {}
+        self.tracks_by_year = {}
         self.tracks = []
         self.length_range = None
         self.length_range_by_date = None
@@ -58,9 +83,14 @@ class Poster:
         self.years = None
         self.tracks_drawer = None
         self.trans = None
+        self.language = None
         self.set_language(None)
         self.tc_offset = datetime.now(pytz.timezone("Asia/Shanghai")).utcoffset()
         self.github_style = "align-firstday"
+        self.stream_svg = False
+        self.validate_svg = True
+        self.compact_svg = False
+        self.svg_precision = 2
 
     def set_language(self, language):
         if language:
@@ -78,8 +108,19 @@ class Poster:
             )
         else:
             lang = gettext.NullTranslations()
+        self.language = language
         self.trans = lang.gettext
 
+    def __getstate__(self):
+        # translations can't be pickled, they are rebuilt from the language
+        state = self.__dict__.copy()
+        del state["trans"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.set_language(self.language)
+
     def set_tracks(self, tracks):
         """Associate the set of tracks with this poster.
 
@@ -88,43 +129,168 @@ class Poster:
         """
         self.tracks = tracks
         self.tracks_by_date = {}
+        self.tracks_by_year = defaultdict(dict)
         self.length_range = ValueRange()
         self.length_range_by_date = ValueRange()
         self.__compute_years(tracks)
         for track in tracks:
             if not self.years.contains(track.start_time_local):
                 continue
-            text_date = track.start_time_local.strftime("%Y-%m-%d")
+            day = track.start_time_local.date()
+            text_date = day.isoformat()
             if text_date in self.tracks_by_date:
                 self.tracks_by_date[text_date].append(track)
             else:
                 self.tracks_by_date[text_date] = [track]
+                self.tracks_by_year[day.year][day.toordinal()] = []
+            self.tracks_by_year[day.year][day.toordinal()].append(track)
             self.length_range.extend(track.length)
         for tracks in self.tracks_by_date.values():
             length = sum([t.length for t in tracks])
             self.length_range_by_date.extend(length)
 
+    def year_poster(self, year):
+        """Return a copy of the Poster narrowed down to the tracks of a single year.
+
+        Only the year's partition is carried over, so this is cheap to compute and to
+        send to another process.
+        """
+        p = copy.copy(self)
+        p.colors = dict(self.colors)
+        p.years = copy.copy(self.years)
+        p.years.from_year, p.years.to_year = year, year
+        tracks_by_ordinal = self.tracks_by_year.get(year, {})
+        p.tracks_by_year = {year: tracks_by_ordinal}
+        p.tracks = []
+        p.tracks_by_date = {}
+        p.length_range = ValueRange()
+        p.length_range_by_date = ValueRange()
+        for ordinal, tracks in sorted(tracks_by_ordinal.items()):
+            p.tracks.extend(tracks)
+            p.tracks_by_date[date.fromordinal(ordinal).isoformat()] = tracks
+            for t in tracks:
+                p.length_range.extend(t.length)
+            p.length_range_by_date.extend(sum([t.length for t in tracks]))
+        return p
+
+    def fingerprint(self, drawer):
+        """Return a hash of the tracks, settings and code the drawn poster depends on."""
+        h = hashlib.sha256()
+        h.update(_code_version().encode())
+        settings = [
+            type(drawer).__name__,
+            sorted((k, v) for k, v in vars(drawer).items() if k != "poster"),
+            self.title,
+            self.athlete,
+            self.units,
+            sorted(self.draw_colors().items()),
+            sorted(self.special_distance.items()),
+            self.width,
+            self.height,
+            self.drawer_type,
+            self.github_style,
+            self.compact_svg,
+            self.svg_precision,
+            self.years.from_year,
+            self.years.to_year,
+            locale.setlocale(locale.LC_ALL),
+        ]
+        h.update(repr(settings).encode())
+        for t in self.tracks:
+            h.update(
+                f"{t.run_id},{t.length},{t.start_time_local},{t.special};".encode()
+            )
+        return h.hexdigest()
+
+    def draw_if_changed(self, drawer, output, force=False):
+        """Draw the tracks, unless output was already drawn from the same inputs.
+
+        Returns:
+            True if the poster was drawn, False if it was skipped.
+        """
+        fingerprint = self.fingerprint(drawer)
+        if not force and is_up_to_date(output, fingerprint):
+            print(f"Skipping {output}, its tracks did not change")
+            return False
+        self.draw(drawer, output)
+        write_fingerprint(output, fingerprint)
+        return True
+
+    def draw_years(self, drawer, outputs, max_workers=None, force=False):
+        """Draw one poster per year in a process pool.
+
+        Years whose output exists and whose fingerprint did not change since it was
+        drawn are skipped.
+
+        Args:
+            drawer: Drawer used to draw each year.
+            outputs: Dict of year to output file name.
+            max_workers: Size of the process pool (default: number of CPUs).
+            force: Draw all years, even the unchanged ones.
+        """
+        jobs = []
+        for year, output in outputs.items():
+            year_poster = self.year_poster(year)
+            fingerprint = year_poster.fingerprint(drawer)
+            if not force and is_up_to_date(output, fingerprint):
+                print(f"Skipping {output}, its tracks did not change")
+                continue
+            year_drawer = copy.copy(drawer)
+            year_drawer.poster = year_poster
+            jobs.append((year_poster, year_drawer, output, fingerprint))
+
+        max_workers = max_workers or os.cpu_count() or 1
+        if max_workers == 1 or len(jobs) <= 1:
+            # a pool only adds the cost of sending the tracks to another process
+            for year_poster, year_drawer, output, fingerprint in jobs:
+                year_poster.draw(year_drawer, output)
+                write_fingerprint(output, fingerprint)
+            return
+        with concurrent.futures.ProcessPoolExecutor(max_workers) as executor:
+            future_to_output = {
+                executor.submit(year_poster.draw, year_drawer, output): (
+                    output,
+                    fingerprint,
+                )
+                for year_poster, year_drawer, output, fingerprint in jobs
+            }
+            for future in concurrent.futures.as_completed(future_to_output):
+                output, fingerprint = future_to_output[future]
+                future.result()
+                write_fingerprint(output, fingerprint)
+
     def draw(self, drawer, output):
         """Set the Poster's drawer and draw the tracks."""
         self.tracks_drawer = drawer
         height = self.height
         width = self.width
+        colors = self.draw_colors()
         if self.drawer_type == "plain":
             height = height - 100
-            self.colors["background"] = "#1a1a1a"
-            self.colors["track"] = "red"
-            self.colors["special"] = "yellow"
-            self.colors["text"] = "#e1ed5e"
-        d = svgwrite.Drawing(output, (f"{width}mm", f"{height}mm"))
+        drawing = StreamingDrawing if self.stream_svg else svgwrite.Drawing
+        d = drawing(output, (f"{width}mm", f"{height}mm"), debug=self.validate_svg)
         d.viewbox(0, 0, self.width, height)
-        d.add(d.rect((0, 0), (width, height), fill=self.colors["background"]))
+        css = drawer.css() if self.compact_svg else ""
+        if css:
+            d.defs.add(d.style(css))
+        d.add(d.rect((0, 0), (width, height), fill=colors["background"]))
         if not self.drawer_type == "plain":
-            self.__draw_header(d)
-            self.__draw_footer(d)
+            self.__draw_header(d, colors)
+            self.__draw_footer(d, colors)
             self.__draw_tracks(d, XY(width - 20, height - 30 - 30), XY(10, 30))
         else:
             self.__draw_tracks(d, XY(width - 20, height), XY(10, 0))
-        d.save()
+        if output.endswith(".svgz") and not self.stream_svg:
+            with gzip.open(output, "wt", encoding="utf-8") as f:
+                d.write(f)
+        else:
+            d.save()
+
+    def draw_colors(self):
+        """Return the colors the poster is drawn with, without changing self.colors."""
+        if self.drawer_type == "plain":
+            return {**self.colors, **PLAIN_COLORS}
+        return self.colors
 
     def m2u(self, m):
         """Convert meters to kilometers or miles, according to units."""
@@ -145,13 +311,13 @@ class Poster:
     def __draw_tracks(self, d, size: XY, offset: XY):
         self.tracks_drawer.draw(d, size, offset)
 
-    def __draw_header(self, d):
-        text_color = self.colors["text"]
+    def __draw_header(self, d, colors):
+        text_color = colors["text"]
         title_style = "font-size:12px; font-family:Arial; font-weight:bold;"
         d.add(d.text(self.title, insert=(10, 20), fill=text_color, style=title_style))
 
-    def __draw_footer(self, d):
-        text_color = self.colors["text"]
+    def __draw_footer(self, d, colors):
+        text_color = colors["text"]
         header_style = "font-size:4px; font-family:Arial"
         value_style = "font-size:9px; font-family:Arial"
         small_value_style = "font-size:3px; font-family:Arial"
@@ -193,7 +359,7 @@ class Poster:
             )
         )
 
-        d.add(d.rect((65, self.height - 17), (2.6, 2.6), fill=self.colors["special"]))
+        d.add(d.rect((65, self.height - 17), (2.6, 2.6), fill=colors["special"]))
 
         d.add(
             d.text(
@@ -204,7 +370,7 @@ class Poster:
             )
         )
 
-        d.add(d.rect((65, self.height - 13), (2.6, 2.6), fill=self.colors["special2"]))
+        d.add(d.rect((65, self.height - 13), (2.6, 2.6), fill=colors["special2"]))
 
         d.add(
             d.text(
@@ -298,3 +464,39 @@ class Poster:
         self.years = YearRange()
         for t in tracks:
             self.years.add(t.start_time_local)
+
+
+def _code_version():
+    """Hash the sources of this package, so that code changes invalidate fingerprints."""
+    h = hashlib.sha256()
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    for name in sorted(os.listdir(package_dir)):
+        if name.endswith(".py"):
+            with open(os.path.join(package_dir, name), "rb") as f:
+                h.update(f.read())
+    return h.hexdigest()
+
+
+def _fingerprint_file(output):
+    head, tail = os.path.split(output)
+    return os.path.join(head, f".{tail}.fingerprint")
+
+
+def read_fingerprint(output):
+    """Return the fingerprint stored next to output, or None."""
+    try:
+        with open(_fingerprint_file(output)) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def is_up_to_date(output, fingerprint):
+    """Return True if output exists and was drawn with the given fingerprint."""
+    return os.path.exists(output) and read_fingerprint(output) == fingerprint
+
+
+def write_fingerprint(output, fingerprint):
+    """Store fingerprint next to output."""
+    with open(_fingerprint_file(output), "w") as f:
+        f.write(fingerprint)
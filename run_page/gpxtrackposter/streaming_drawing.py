@@ -0,0 +1,70 @@
+"""An svgwrite Drawing that streams its elements to the output file."""
+
+import gzip
+import io
+from xml.etree import ElementTree as etree
+
+import svgwrite
+
+
+class StreamingDrawing(svgwrite.Drawing):
+    """Drop-in replacement for svgwrite.Drawing that does not keep a DOM.
+
+    Elements are created through the usual svgwrite factory methods, but every
+    element passed to add() is serialized to the output file and dropped
+    instead of being appended to the document tree. The most recently added
+    element is held back until the next add() or save(), so that it can still
+    be referenced (e.g. by a textPath) right after it was added.
+
+    Attributes:
+        filename: Name of the output file.
+
+    Methods:
+        add: Serialize an element to the output file.
+        save: Flush the remaining element and close the document.
+    """
+
+    def __init__(self, filename="noname.svg", size=("100%", "100%"), **extra):
+        self._streaming = False
+        self._fileobj = None
+        self._pending = None
+        super().__init__(filename, size, **extra)
+        self._streaming = True
+
+    def add(self, element):
+        # SVG.__init__ adds the (empty) defs container, keep that one in the tree
+        if not self._streaming:
+            return super().add(element)
+        if self.debug:
+            self.validator.check_valid_children(self.elementname, element.elementname)
+        self._flush()
+        self._pending = element
+        return element
+
+    def save(self, pretty=False, indent=2):
+        self._flush()
+        self._open()
+        self._fileobj.write("</svg>")
+        self._fileobj.close()
+        self._fileobj = None
+
+    def _open(self):
+        if self._fileobj is not None:
+            return
+        if self.filename.endswith(".svgz"):
+            self._fileobj = gzip.open(self.filename, mode="wt", encoding="utf-8")
+        else:
+            self._fileobj = io.open(self.filename, mode="w", encoding="utf-8")
+        self._fileobj.write('<?xml version="1.0" encoding="utf-8" ?>\n')
+        # serialize the root element with its defs and cut the closing tag
+        root = self.tostring()
+        self._fileobj.write(root[: -len("</svg>")])
+
+    def _flush(self):
+        if self._pending is None:
+            return
+        self._open()
+        self._fileobj.write(
+            etree.tostring(self._pending.get_xml(), encoding="utf-8").decode("utf-8")
+        )
+        self._pending = None
@@ -12,6 +12,7 @@ from collections import namedtuple
 
 import gpxpy as mod_gpxpy
 import lxml
+import numpy as np
 import polyline
 import s2sphere as s2
 from garmin_fit_sdk import Decoder, Stream
@@ -21,7 +22,7 @@ from rich import print
 from tcxreader.tcxreader import TCXReader
 
 from .exceptions import TrackLoadError
-from .utils import parse_datetime_to_local
+from .utils import latlngs_to_array, parse_datetime_to_local
 
 start_point = namedtuple("start_point", "lat lon")
 run_map = namedtuple("polyline", "summary_polyline")
@@ -39,7 +40,10 @@ SEMICIRCLE = 11930465
 class Track:
     def __init__(self):
         self.file_names = []
-        self.polylines = []
+        self._polylines = []
+        self._polyline_arrays = None
+        # encoded polyline from the db, decoded on first access of the geometry
+        self._summary_polyline = None
         self.polyline_str = ""
         self.track_name = None
         self.start_time = None
@@ -91,14 +95,21 @@ class Track:
             )
             print(str(e))
 
-    def load_fit(self, file_name):
+    def load_fit(self, file_name, data=None):
+        """
+        data is the content of file_name, if the caller already has it in memory
+        """
         try:
             self.file_names = [os.path.basename(file_name)]
             # Handle empty fit files
             # (for example, treadmill runs pulled via garmin-connect-export)
-            if os.path.getsize(file_name) == 0:
+            size = len(data) if data is not None else os.path.getsize(file_name)
+            if size == 0:
                 raise TrackLoadError("Empty FIT file")
-            stream = Stream.from_file(file_name)
+            if data is not None:
+                stream = Stream.from_byte_array(bytearray(data))
+            else:
+                stream = Stream.from_file(file_name)
             decoder = Decoder(stream)
             messages, errors = decoder.read(convert_datetimes_to_dates=False)
             if errors:
@@ -125,21 +136,64 @@ class Track:
         self.start_time_local = start_time
         self.end_time = start_time + activity.elapsed_time
         self.length = float(activity.distance)
+        # the loader leaves out the polyline column if no geometry is needed
+        self._summary_polyline = getattr(activity, "summary_polyline", None) or ""
+        self._polylines = None
+        self._polyline_arrays = None
+        self.run_id = activity.run_id
+
+    @property
+    def polylines(self):
+        """Lines of the track as lists of s2.LatLng."""
+        if self._polylines is None:
+            self._polylines = [
+                [s2.LatLng.from_degrees(lat, lng) for lat, lng in line.tolist()]
+                for line in self.polyline_arrays()
+            ]
+        return self._polylines
+
+    @polylines.setter
+    def polylines(self, polylines):
+        self._polylines = polylines
+        self._polyline_arrays = None
+        self._summary_polyline = None
+
+    def polyline_arrays(self):
+        """Return the polylines as (n, 2) numpy arrays of lat/lng degrees."""
+        if self._polyline_arrays is None:
+            if self._summary_polyline is not None:
+                self._polyline_arrays = [self._decode_summary_polyline()]
+                self._summary_polyline = None
+            else:
+                self._polyline_arrays = [
+                    latlngs_to_array(line) for line in self._polylines
+                ]
+        return self._polyline_arrays
+
+    def _decode_summary_polyline(self):
         if IGNORE_BEFORE_SAVING:
-            summary_polyline = filter_out(activity.summary_polyline)
+            summary_polyline = filter_out(self._summary_polyline)
         else:
-            summary_polyline = activity.summary_polyline
+            summary_polyline = self._summary_polyline
         polyline_data = polyline.decode(summary_polyline) if summary_polyline else []
-        self.polylines = [[s2.LatLng.from_degrees(p[0], p[1]) for p in polyline_data]]
-        self.run_id = activity.run_id
+        return np.array(polyline_data, dtype=float).reshape(-1, 2)
 
     def bbox(self):
         """Compute the smallest rectangle that contains the entire track (border box)."""
-        bbox = s2.LatLngRect()
-        for line in self.polylines:
-            for latlng in line:
-                bbox = bbox.union(s2.LatLngRect.from_point(latlng.normalized()))
-        return bbox
+        lines = [line for line in self.polyline_arrays() if len(line)]
+        if not lines:
+            return s2.LatLngRect()
+        points = np.radians(np.concatenate(lines))
+        lat, lng = points[:, 0], points[:, 1]
+        lng_lo, lng_hi = lng.min(), lng.max()
+        if lng_hi - lng_lo > np.pi:
+            # the track crosses the antimeridian, the box wraps around
+            lng_lo = lng[lng >= 0].min()
+            lng_hi = lng[lng < 0].max()
+        return s2.LatLngRect(
+            s2.LineInterval(lat.min(), lat.max()),
+            s2.SphereInterval(lng_lo, lng_hi),
+        )
 
     @staticmethod
     def __make_run_id(time_stamp):
@@ -44,10 +44,10 @@ def load_tcx_file(file_name, activity_title_dict={}):
     return t
 
 
-def load_fit_file(file_name, activity_title_dict={}):
+def load_fit_file(file_name, activity_title_dict={}, data=None):
     """Load an individual FIT file as a track by using Track.load_fit()"""
     t = Track()
-    t.load_fit(file_name)
+    t.load_fit(file_name, data)
     file_id = os.path.basename(file_name).split(".")[0]
     if activity_title_dict:
         t.track_name = activity_title_dict.get(file_id, t.track_name)
@@ -91,31 +91,48 @@ class TrackLoader:
         tracks.extend(loaded_tracks.values())
         log.info(f"Conventionally loaded tracks: {len(loaded_tracks)}")
 
+        return self.prepare_tracks(tracks)
+
+    def prepare_tracks(self, tracks, merge=True):
+        """Filter and merge loaded tracks the way load_tracks does"""
         tracks = self._filter_tracks(tracks)
 
         # merge tracks that took place within one hour
-        tracks = self._merge_tracks(tracks)
+        if merge:
+            tracks = self._merge_tracks(tracks)
         # filter out tracks with length < min_length
         return [t for t in tracks if t.length >= self.min_length]
 
-    def load_tracks_from_db(self, sql_file, is_grid=False, is_circular=False):
+    def load_tracks_from_db(
+        self, sql_file, is_grid=False, is_circular=False, needs_geometry=True
+    ):
         session = init_db(sql_file)
+        # only fetch the columns Track.load_from_db reads, the polylines are
+        # by far the largest part of the table
+        columns = [
+            Activity.run_id,
+            Activity.start_date_local,
+            Activity.elapsed_time,
+            Activity.distance,
+        ]
+        if needs_geometry:
+            columns.append(Activity.summary_polyline)
         if is_grid:
             activities = (
-                session.query(Activity)
+                session.query(*columns)
                 .filter(Activity.summary_polyline != "")
                 .filter(Activity.type.not_in(["Flight"]))
                 .order_by(Activity.start_date_local)
             )
         elif is_circular:
             activities = (
-                session.query(Activity)
+                session.query(*columns)
                 .filter(Activity.type.not_in(["RoadTrip", "Flight"]))
                 .order_by(Activity.start_date_local)
             )
         else:
             activities = (
-                session.query(Activity)
+                session.query(*columns)
                 .filter(Activity.type.not_in(["Flight"]))
                 .order_by(Activity.start_date_local)
             )
@@ -9,14 +9,21 @@ import argparse
 
 import svgwrite
 
+from .color_ramp import ColorRamp
 from .poster import Poster
-from .utils import interpolate_color
 from .value_range import ValueRange
 from .xy import XY
 
 
 class TracksDrawer:
-    """Base class that other drawer classes inherit from."""
+    """Base class that other drawer classes inherit from.
+
+    Attributes:
+        needs_geometry: True if the drawer draws the track lines, so that
+            loaders have to decode them.
+    """
+
+    needs_geometry = False
 
     def __init__(self, the_poster: Poster):
         self.poster = the_poster
@@ -30,19 +37,18 @@ class TracksDrawer:
     def draw(self, dr: svgwrite.Drawing, size: XY, offset: XY):
         pass
 
+    def css(self) -> str:
+        """Return the style sheet shared by the elements of a compact poster."""
+        return ""
+
     def color(
         self, length_range: ValueRange, length: float, is_special: bool = False
     ) -> str:
         assert length_range.is_valid()
+        colors = self.poster.draw_colors()
 
-        color1 = (
-            self.poster.colors["special"] if is_special else self.poster.colors["track"]
-        )
-        color2 = (
-            self.poster.colors["special2"]
-            if is_special
-            else self.poster.colors["track2"]
-        )
+        color1 = colors["special"] if is_special else colors["track"]
+        color2 = colors["special2"] if is_special else colors["track2"]
 
         diff = length_range.diameter()
         if diff == 0:
@@ -53,4 +59,5 @@ class TracksDrawer:
         ):
             return color1
 
-        return interpolate_color(color1, color2, (length - length_range.lower()) / diff)
+        ramp = ColorRamp.get(color1, color2)
+        return ramp.color((length - length_range.lower()) / diff)
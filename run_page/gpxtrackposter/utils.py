@@ -11,6 +11,7 @@ from datetime import datetime
 from typing import List, Optional, Tuple
 
 import colour
+import numpy as np
 import pytz
 import s2sphere as s2
 
@@ -41,9 +42,62 @@ def lat2y(lat_deg: float) -> float:
     return 0.5 - math.log(math.tan(math.pi / 4 * (1 + lat_deg / 90))) / math.pi
 
 
+def latlng2xy_array(latlngs: np.ndarray) -> np.ndarray:
+    """Mercator-project an (n, 2) array of lat/lng degrees to an (n, 2) array of x/y."""
+    xy = np.empty_like(latlngs, dtype=float)
+    xy[:, 0] = latlngs[:, 1] / 180 + 1
+    xy[:, 1] = 0.5 - np.log(np.tan(np.pi / 4 * (1 + latlngs[:, 0] / 90))) / np.pi
+    return xy
+
+
+def bbox_contains_array(bbox: s2.LatLngRect, latlngs: np.ndarray) -> np.ndarray:
+    """Return a boolean mask of the rows of an (n, 2) lat/lng degrees array inside bbox."""
+    lat = np.radians(latlngs[:, 0])
+    lng = np.radians(latlngs[:, 1])
+    # tolerate the rounding of the degrees <-> radians conversion at the edges
+    eps = 1e-12
+    mask = (bbox.lat_lo().radians - eps <= lat) & (lat <= bbox.lat_hi().radians + eps)
+    lng_lo, lng_hi = bbox.lng_lo().radians - eps, bbox.lng_hi().radians + eps
+    if lng_lo <= lng_hi:
+        return mask & (lng_lo <= lng) & (lng <= lng_hi)
+    # inverted interval, the bbox crosses the antimeridian
+    return mask & ((lng_lo <= lng) | (lng <= lng_hi))
+
+
+def latlngs_to_array(latlngline: List[s2.LatLng]) -> np.ndarray:
+    return np.array(
+        [(latlng.lat().degrees, latlng.lng().degrees) for latlng in latlngline],
+        dtype=float,
+    ).reshape(-1, 2)
+
+
 def project(
-    bbox: s2.LatLngRect, size: XY, offset: XY, latlnglines: List[List[s2.LatLng]]
+    bbox: s2.LatLngRect,
+    size: XY,
+    offset: XY,
+    latlnglines: List[List[s2.LatLng]],
+    tolerance: Optional[float] = None,
 ) -> List[List[Tuple[float, float]]]:
+    lines = project_array(
+        bbox, size, offset, [latlngs_to_array(line) for line in latlnglines], tolerance
+    )
+    return [[tuple(xy) for xy in line.tolist()] for line in lines]
+
+
+def project_array(
+    bbox: s2.LatLngRect,
+    size: XY,
+    offset: XY,
+    latlnglines: List[np.ndarray],
+    tolerance: Optional[float] = None,
+) -> List[np.ndarray]:
+    """Project (n, 2) lat/lng degrees arrays into (m, 2) x/y arrays fitting size.
+
+    Lines are split where points fall outside of bbox. If tolerance is given, the
+    projected lines are simplified so that they deviate by at most tolerance (in
+    output units) from the full lines, and coordinates are rounded to the first
+    decimal place finer than tolerance.
+    """
     min_x = lng2x(bbox.lng_lo().degrees)
     d_x = lng2x(bbox.lng_hi().degrees) - min_x
     while d_x >= 2:
@@ -58,23 +112,91 @@ def project(
         return []
     scale = size.x / d_x if size.x / size.y <= d_x / d_y else size.y / d_y
     offset = offset + 0.5 * (size - scale * XY(d_x, -d_y)) - scale * XY(min_x, min_y)
+    shift = np.array(offset.tuple())
     lines = []
-    # If len > $zoom_threshold, choose 1 point out of every $step to reduce size of the SVG file
-    zoom_threshold = 400
     for latlngline in latlnglines:
-        line = []
-        step = int(len(latlngline) / zoom_threshold) + 1
-        for i in range(0, len(latlngline), step):
-            latlng = latlngline[i]
-            if bbox.contains(latlng):
-                line.append((offset + scale * latlng2xy(latlng)).tuple())
-            else:
-                if len(line) > 0:
-                    lines.append(line)
-                    line = []
-        if len(line) > 0:
-            lines.append(line)
-    return lines
+        inside = bbox_contains_array(bbox, latlngline)
+        indices = np.flatnonzero(inside)
+        if len(indices) == 0:
+            continue
+        xy = scale * latlng2xy_array(latlngline[indices]) + shift
+        # start a new line after every run of points outside of the bbox
+        splits = np.flatnonzero(np.diff(indices) > 1) + 1
+        lines.extend(np.split(xy, splits))
+    if tolerance is None:
+        return lines
+    decimals = max(0, math.ceil(-math.log10(tolerance)))
+    return [quantize_array(simplify_array(line, tolerance), decimals) for line in lines]
+
+
+def simplify_array(xy: np.ndarray, tolerance: float) -> np.ndarray:
+    """Simplify an (n, 2) line with the Douglas-Peucker algorithm.
+
+    Every dropped point lies within tolerance of the simplified line.
+    """
+    count = len(xy)
+    if count < 3:
+        return xy
+    keep = np.zeros(count, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, count - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        direction = xy[last] - xy[first]
+        points = xy[first + 1 : last] - xy[first]
+        norm = math.hypot(direction[0], direction[1])
+        if norm == 0:
+            # closed loop, measure the distance to the start point instead
+            distances = np.hypot(points[:, 0], points[:, 1])
+        else:
+            distances = (
+                np.abs(direction[0] * points[:, 1] - direction[1] * points[:, 0]) / norm
+            )
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            farthest += first + 1
+            keep[farthest] = True
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+    return xy[keep]
+
+
+def quantize_array(xy: np.ndarray, decimals: int) -> np.ndarray:
+    """Round an (n, 2) line to decimals and drop the points that became duplicates."""
+    xy = np.round(xy, decimals)
+    if len(xy) < 2:
+        return xy
+    moved = np.any(xy[1:] != xy[:-1], axis=1)
+    return xy[np.concatenate([[True], moved])]
+
+
+def svg_path_data(xy: np.ndarray, decimals: int) -> str:
+    """Return svg path data drawing an (n, 2) line with relative line commands.
+
+    Coordinates are rounded to decimals before the relative moves are computed,
+    so rounding errors do not add up along the line.
+    """
+    scale = 10**decimals
+    points = np.round(xy * scale).astype(np.int64)
+    start = " ".join(format_svg_number(v / scale, decimals) for v in points[0])
+    moves = " ".join(
+        format_svg_number(v / scale, decimals) for v in np.diff(points, axis=0).flat
+    )
+    return f"M{start}l{moves}" if moves else f"M{start}"
+
+
+def format_svg_number(value: float, decimals: int) -> str:
+    """Format value with at most decimals, without redundant zeros."""
+    text = f"{value:.{decimals}f}"
+    if "." in text:
+        text = text.rstrip("0").rstrip(".")
+    if text.startswith("0."):
+        text = text[1:]
+    elif text.startswith("-0."):
+        text = "-" + text[2:]
+    return "0" if text == "-0" else text
 
 
 def compute_bounds_xy(lines: List[List[XY]]) -> Tuple[ValueRange, ValueRange]:
@@ -90,23 +212,30 @@ def compute_bounds_xy(lines: List[List[XY]]) -> Tuple[ValueRange, ValueRange]:
 def compute_grid(
     count: int, dimensions: XY
 ) -> Tuple[Optional[float], Optional[Tuple[int, int]]]:
-    # this is somehow suboptimal O(count^2). I guess it's possible in O(count)
+    # For a fixed count_x, the cell size can only shrink (and the waste only grow)
+    # with count_y, so the first count_y that fits all tracks without negative
+    # waste is the best one for that count_x. This makes the search O(count).
     min_waste = -1.0
     best_size = None
     best_counts = None
     for count_x in range(1, count + 1):
         size_x = dimensions.x / count_x
-        for count_y in range(1, count + 1):
-            if count_x * count_y >= count:
-                size_y = dimensions.y / count_y
-                size = min(size_x, size_y)
-                waste = dimensions.x * dimensions.y - count * size * size
-                if waste < 0:
-                    continue
-                elif best_size is None or waste < min_waste:
+        count_y = -(-count // count_x)
+        while count_y <= count:
+            size_y = dimensions.y / count_y
+            size = min(size_x, size_y)
+            waste = dimensions.x * dimensions.y - count * size * size
+            if waste >= 0:
+                if best_size is None or waste < min_waste:
                     best_size = size
                     best_counts = count_x, count_y
                     min_waste = waste
+                break
+            if size_y >= size_x:
+                # the waste stays the same until size_y drops below size_x
+                count_y = max(count_y + 1, int(dimensions.y / size_x) - 1)
+            else:
+                count_y += 1
     return best_size, best_counts
 
 
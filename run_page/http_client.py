@@ -0,0 +1,196 @@
+"""
+Shared async HTTP client for the sync scripts
+pooled connections, optional HTTP/2, retries with jittered exponential
+backoff that honour Retry-After, and per-host token bucket rate limits
+"""
+
+import asyncio
+import contextlib
+import email.utils
+import logging
+import random
+import time
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+import httpx
+
+try:
+    import h2  # noqa: F401
+
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+TIME_OUT = httpx.Timeout(240.0, connect=360.0)
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def retry_delay(attempt, retry_after=None, base=1.0, cap=60.0):
+    """
+    Seconds to wait before retry number attempt (0 based)
+    a server provided retry_after wins, otherwise use full jitter backoff
+    """
+    if retry_after is not None:
+        return max(0.0, float(retry_after))
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+def parse_retry_after(value):
+    """
+    Parse a Retry-After header, which is either seconds or an HTTP date
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class TokenBucket:
+    """
+    Allow rate requests per second on average, with bursts of up to burst requests
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.burst, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class HttpClient:
+    """
+    Thin wrapper around httpx.AsyncClient used by all sync scripts
+
+    rate_limits maps a host to requests per second, or to a (rate, burst) tuple
+    requests failing with a network error or one of RETRY_STATUS_CODES are
+    retried up to max_retries times, the last response is returned as is
+    """
+
+    def __init__(
+        self,
+        headers=None,
+        timeout=TIME_OUT,
+        http2=False,
+        max_connections=20,
+        rate_limits=None,
+        max_retries=5,
+        backoff_base=1.0,
+        backoff_cap=60.0,
+    ):
+        self.client = httpx.AsyncClient(
+            headers=headers,
+            timeout=timeout,
+            http2=http2 and HTTP2_AVAILABLE,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+        )
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.buckets = {}
+        for host, limit in (rate_limits or {}).items():
+            rate, burst = limit if isinstance(limit, tuple) else (limit, 1)
+            self.buckets[host] = TokenBucket(rate, burst)
+
+    @property
+    def headers(self):
+        return self.client.headers
+
+    async def _wait_for_token(self, url):
+        bucket = self.buckets.get(urlsplit(str(url)).hostname)
+        if bucket is not None:
+            await bucket.acquire()
+
+    async def request(self, method, url, **kwargs):
+        attempt = 0
+        while True:
+            await self._wait_for_token(url)
+            _rewind_files(kwargs.get("files"))
+            try:
+                response = await self.client.request(method, url, **kwargs)
+            except httpx.TransportError as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._delay(attempt)
+                logger.info(f"{method} {url} failed: {e}, retry in {delay:.1f}s")
+            else:
+                if (
+                    response.status_code not in RETRY_STATUS_CODES
+                    or attempt >= self.max_retries
+                ):
+                    return response
+                await response.aclose()
+                delay = self._delay(
+                    attempt, parse_retry_after(response.headers.get("Retry-After"))
+                )
+                logger.info(
+                    f"{method} {url} got {response.status_code}, retry in {delay:.1f}s"
+                )
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def _delay(self, attempt, retry_after=None):
+        return retry_delay(attempt, retry_after, self.backoff_base, self.backoff_cap)
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    @contextlib.asynccontextmanager
+    async def stream(self, method, url, **kwargs):
+        """
+        Stream a response, rate limited but not retried
+        """
+        await self._wait_for_token(url)
+        async with self.client.stream(method, url, **kwargs) as response:
+            yield response
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.aclose()
+
+
+def _rewind_files(files):
+    # retries send the same file objects again
+    if not files:
+        return
+    values = files.values() if isinstance(files, dict) else (v for _, v in files)
+    for value in values:
+        file = value[1] if isinstance(value, tuple) else value
+        if hasattr(file, "seek"):
+            file.seek(0)
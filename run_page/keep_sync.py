@@ -1,21 +1,23 @@
 import argparse
+import asyncio
 import base64
+import concurrent.futures
 import json
 import os
-import time
 import zlib
 from collections import namedtuple
 from datetime import datetime, timedelta, timezone
 
-import eviltransform
-import gpxpy
+import numpy as np
 import polyline
-import requests
 from config import GPX_FOLDER, JSON_FILE, SQL_FILE, run_map, start_point
+from coord_transform import gcj2wgs
 from Crypto.Cipher import AES
 from generator import Generator
+from gpx_writer import write_gpx
+from gpxpy.geo import calculate_uphill_downhill
+from http_client import HttpClient
 from utils import adjust_time
-import xml.etree.ElementTree as ET
 
 KEEP_SPORT_TYPES = ["running", "hiking", "cycling"]
 KEEP2STRAVA = {
@@ -28,6 +30,12 @@ KEEP2STRAVA = {
 LOGIN_API = "https://api.gotokeep.com/v1.1/users/login"
 RUN_DATA_API = "https://api.gotokeep.com/pd/v3/stats/detail?dateUnit=all&type={sport_type}&lastDate={last_date}"
 RUN_LOG_API = "https://api.gotokeep.com/pd/v3/{sport_type}log/{run_id}"
+# spider rule, requests per second and burst size for the keep api
+KEEP_RATE_LIMIT = (2, 4)
+# run logs fetched at once, within the rate limit above
+KEEP_CONCURRENCY = 4
+# tracks written to the db at once
+KEEP_BATCH_SIZE = 50
 
 HR_FRAME_THRESHOLD_IN_DECISECOND = 100  # Maximum time difference to consider a data point as the nearest, the unit is decisecond(分秒)
 
@@ -37,29 +45,29 @@ TIMESTAMP_THRESHOLD_IN_DECISECOND = 3_600_000  # Threshold for target timestamp
 TRANS_GCJ02_TO_WGS84 = True
 
 
-def login(session, mobile, password):
+async def login(session, mobile, password):
     headers = {
         "User-Agent": "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:78.0) Gecko/20100101 Firefox/78.0",
         "Content-Type": "application/x-www-form-urlencoded;charset=utf-8",
     }
     data = {"mobile": mobile, "password": password}
-    r = session.post(LOGIN_API, headers=headers, data=data)
-    if r.ok:
+    r = await session.post(LOGIN_API, headers=headers, data=data)
+    if not r.is_error:
         token = r.json()["data"]["token"]
         headers["Authorization"] = f"Bearer {token}"
         return session, headers
 
 
-def get_to_download_runs_ids(session, headers, sport_type):
+async def get_to_download_runs_ids(session, headers, sport_type):
     last_date = 0
     result = []
 
     while 1:
-        r = session.get(
+        r = await session.get(
             RUN_DATA_API.format(sport_type=sport_type, last_date=last_date),
             headers=headers,
         )
-        if r.ok:
+        if not r.is_error:
             run_logs = r.json()["data"]["records"]
 
             for i in run_logs:
@@ -68,17 +76,16 @@ def get_to_download_runs_ids(session, headers, sport_type):
             last_date = r.json()["data"]["lastTimestamp"]
             since_time = datetime.fromtimestamp(last_date / 1000, tz=timezone.utc)
             print(f"pares keep ids data since {since_time}")
-            time.sleep(1)  # spider rule
             if not last_date:
                 break
     return result
 
 
-def get_single_run_data(session, headers, run_id, sport_type):
-    r = session.get(
+async def get_single_run_data(session, headers, run_id, sport_type):
+    r = await session.get(
         RUN_LOG_API.format(sport_type=sport_type, run_id=run_id), headers=headers
     )
-    if r.ok:
+    if not r.is_error:
         return r.json()
 
 
@@ -94,12 +101,11 @@ def decode_runmap_data(text, is_geo=False):
     return run_points_data
 
 
-def parse_raw_data_to_nametuple(
-    run_data,
-    old_gpx_ids,
-    session,
-    with_download_gpx=False,
-):
+def parse_raw_data_to_dict(run_data, old_gpx_ids, with_download_gpx=False):
+    """
+    Decode a keep run log into the fields of a track, the polyline is returned
+    as a plain string so that the result can be sent back from a worker process
+    """
     run_data = run_data["data"]
     run_points_data = []
 
@@ -123,13 +129,14 @@ def parse_raw_data_to_nametuple(
         run_points_data = decode_runmap_data(run_data["geoPoints"], True)
         run_points_data_gpx = run_points_data
         if TRANS_GCJ02_TO_WGS84:
-            run_points_data = [
-                list(eviltransform.gcj2wgs(p["latitude"], p["longitude"]))
-                for p in run_points_data
-            ]
-            for i, p in enumerate(run_points_data_gpx):
-                p["latitude"] = run_points_data[i][0]
-                p["longitude"] = run_points_data[i][1]
+            latitudes, longitudes = gcj2wgs(
+                [p["latitude"] for p in run_points_data],
+                [p["longitude"] for p in run_points_data],
+            )
+            run_points_data = np.column_stack([latitudes, longitudes]).tolist()
+            for p, (lat, lng) in zip(run_points_data_gpx, run_points_data):
+                p["latitude"] = lat
+                p["longitude"] = lng
 
         for p in run_points_data_gpx:
             if "timestamp" not in p:
@@ -137,16 +144,25 @@ def parse_raw_data_to_nametuple(
                     p["timestamp"] = p["unixTimestamp"]
                 else:
                     p["timestamp"] = 0
-            p_hr = find_nearest_hr(decoded_hr_data, int(p["timestamp"]), start_time)
+        points_hr = find_nearest_hrs(
+            decoded_hr_data,
+            [int(p["timestamp"]) for p in run_points_data_gpx],
+            start_time,
+        )
+        for p, p_hr in zip(run_points_data_gpx, points_hr):
             if p_hr:
                 p["hr"] = p_hr
         if run_data["dataType"].startswith("outdoor"):
-            gpx_data = parse_points_to_gpx(
-                run_points_data_gpx, start_time, KEEP2STRAVA[run_data["dataType"]]
-            )
-            elevation_gain = gpx_data.get_uphill_downhill().uphill
+            elevation_gain = calculate_uphill_downhill(
+                [p.get("altitude") for p in run_points_data_gpx]
+            )[0]
             if with_download_gpx and str(keep_id) not in old_gpx_ids:
-                download_keep_gpx(gpx_data.to_xml(), str(keep_id))
+                download_keep_gpx(
+                    run_points_data_gpx,
+                    start_time,
+                    KEEP2STRAVA[run_data["dataType"]],
+                    str(keep_id),
+                )
     else:
         print(f"ID {keep_id} no gps data")
     polyline_str = polyline.encode(run_points_data) if run_points_data else ""
@@ -172,7 +188,7 @@ def parse_raw_data_to_nametuple(
         "length": run_data["distance"],
         "average_heartrate": int(avg_heart_rate) if avg_heart_rate else None,
         "elevation_gain": run_data["accumulativeUpliftedHeight"],
-        "map": run_map(polyline_str),
+        "map": polyline_str,
         "start_latlng": start_latlng,
         "distance": run_data["distance"],
         "moving_time": timedelta(seconds=run_data["duration"]),
@@ -184,94 +200,102 @@ def parse_raw_data_to_nametuple(
         "location_country": str(run_data.get("region", "")),
         "source": "Keep",
     }
+    return d
+
+
+def track_from_dict(d):
+    d = dict(d, map=run_map(d["map"]))
     return namedtuple("x", d.keys())(*d.values())
 
 
-def get_all_keep_tracks(
-    email, password, old_tracks_ids, keep_sports_data_api, with_download_gpx=False
+async def get_all_keep_tracks(
+    email,
+    password,
+    old_tracks_ids,
+    keep_sports_data_api,
+    with_download_gpx=False,
+    on_tracks=None,
 ):
     if with_download_gpx and not os.path.exists(GPX_FOLDER):
         os.mkdir(GPX_FOLDER)
-    s = requests.Session()
-    s, headers = login(s, email, password)
-    tracks = []
-    for api in keep_sports_data_api:
-        runs = get_to_download_runs_ids(s, headers, api)
-        runs = [run for run in runs if run.split("_")[1] not in old_tracks_ids]
-        print(f"{len(runs)} new keep {api} data to generate")
-        old_gpx_ids = os.listdir(GPX_FOLDER)
-        old_gpx_ids = [i.split(".")[0] for i in old_gpx_ids if not i.startswith(".")]
-        for run in runs:
-            print(f"parsing keep id {run}")
-            try:
-                run_data = get_single_run_data(s, headers, run, api)
-                track = parse_raw_data_to_nametuple(
-                    run_data, old_gpx_ids, s, with_download_gpx
-                )
-                tracks.append(track)
-            except Exception as e:
-                print(f"Something wrong paring keep id {run}" + str(e))
-    return tracks
+    # the token bucket replaces the fixed sleep between keep requests
+    async with HttpClient(
+        http2=True, rate_limits={"api.gotokeep.com": KEEP_RATE_LIMIT}
+    ) as s:
+        s, headers = await login(s, email, password)
+        return await _get_keep_tracks(
+            s,
+            headers,
+            old_tracks_ids,
+            keep_sports_data_api,
+            with_download_gpx,
+            on_tracks,
+        )
 
 
-def parse_points_to_gpx(run_points_data, start_time, sport_type):
+async def _get_keep_tracks(
+    s, headers, old_tracks_ids, keep_sports_data_api, with_download_gpx, on_tracks
+):
+    """
+    Run logs are fetched KEEP_CONCURRENCY at a time and decoded in a process
+    pool, on_tracks is called with every KEEP_BATCH_SIZE converted tracks
     """
-    Convert run points data to GPX format.
+    tracks = []
+    batch = []
+    semaphore = asyncio.Semaphore(KEEP_CONCURRENCY)
+    loop = asyncio.get_running_loop()
+
+    async def get_track(executor, run, api, old_gpx_ids):
+        print(f"parsing keep id {run}")
+        try:
+            async with semaphore:
+                run_data = await get_single_run_data(s, headers, run, api)
+            d = await loop.run_in_executor(
+                executor,
+                parse_raw_data_to_dict,
+                run_data,
+                old_gpx_ids,
+                with_download_gpx,
+            )
+        except Exception as e:
+            print(f"Something wrong paring keep id {run}" + str(e))
+            return
+        if d is None:
+            return
+        track = track_from_dict(d)
+        tracks.append(track)
+        batch.append(track)
+        if on_tracks is not None and len(batch) >= KEEP_BATCH_SIZE:
+            on_tracks(batch[:])
+            batch.clear()
+
+    with concurrent.futures.ProcessPoolExecutor() as executor:
+        for api in keep_sports_data_api:
+            runs = await get_to_download_runs_ids(s, headers, api)
+            runs = [run for run in runs if run.split("_")[1] not in old_tracks_ids]
+            print(f"{len(runs)} new keep {api} data to generate")
+            old_gpx_ids = os.listdir(GPX_FOLDER)
+            old_gpx_ids = [
+                i.split(".")[0] for i in old_gpx_ids if not i.startswith(".")
+            ]
+            await asyncio.gather(
+                *(get_track(executor, run, api, old_gpx_ids) for run in runs)
+            )
+    if on_tracks is not None and batch:
+        on_tracks(batch)
+    return tracks
 
-    Args:
-        run_id (str): The ID of the run.
-        run_points_data (list of dict): A list of run data points.
-        start_time (int): The start time for adjusting timestamps. Note that the unit of the start_time is millisecond
 
-    Returns:
-        gpx_data (str): GPX data in string format.
+def points_times_ms(run_points_data, start_time):
+    """
+    Epoch milliseconds of the run points, start_time is in milliseconds too
     """
-    points_dict_list = []
     # early timestamp fields in keep's data stands for delta time, but in newly data timestamp field stands for exactly time,
     # so it does'nt need to plus extra start_time
     if run_points_data[0]["timestamp"] > TIMESTAMP_THRESHOLD_IN_DECISECOND:
         start_time = 0
-
-    for point in run_points_data:
-        points_dict = {
-            "latitude": point["latitude"],
-            "longitude": point["longitude"],
-            "time": datetime.fromtimestamp(
-                (point["timestamp"] * 100 + start_time)
-                / 1000,  # note that the timestamp of a point is decisecond(分秒)
-                tz=timezone.utc,
-            ),
-            "elevation": point.get("altitude"),
-            "hr": point.get("hr"),
-        }
-        points_dict_list.append(points_dict)
-    gpx = gpxpy.gpx.GPX()
-    gpx.nsmap["gpxtpx"] = "http://www.garmin.com/xmlschemas/TrackPointExtension/v1"
-    gpx_track = gpxpy.gpx.GPXTrack()
-    gpx_track.name = "gpx from keep"
-    gpx_track.type = sport_type
-    gpx.tracks.append(gpx_track)
-
-    # Create first segment in our GPX track:
-    gpx_segment = gpxpy.gpx.GPXTrackSegment()
-    gpx_track.segments.append(gpx_segment)
-    for p in points_dict_list:
-        point = gpxpy.gpx.GPXTrackPoint(
-            latitude=p["latitude"],
-            longitude=p["longitude"],
-            time=p["time"],
-            elevation=p.get("elevation"),
-        )
-        if p.get("hr") is not None:
-            gpx_extension_hr = ET.fromstring(
-                f"""<gpxtpx:TrackPointExtension xmlns:gpxtpx="http://www.garmin.com/xmlschemas/TrackPointExtension/v1">
-                    <gpxtpx:hr>{p["hr"]}</gpxtpx:hr>
-                    </gpxtpx:TrackPointExtension>
-                    """
-            )
-            point.extensions.append(gpx_extension_hr)
-        gpx_segment.points.append(point)
-    return gpx
+    # note that the timestamp of a point is decisecond(分秒)
+    return [p["timestamp"] * 100 + start_time for p in run_points_data]
 
 
 def find_nearest_hr(
@@ -293,37 +317,75 @@ def find_nearest_hr(
     Returns:
         int or None: The heart rate value of the nearest data point, or None if no suitable data point is found.
     """
-    closest_element = None
-    # init difference value
-    min_difference = float("inf")
-    if target_time > TIMESTAMP_THRESHOLD_IN_DECISECOND:
-        target_time = (
-            target_time * 100 - start_time
-        ) / 100  # note that the unit of target_time is decisecond and the unit of start_time is normal millisecond
+    return find_nearest_hrs(hr_data_list, [target_time], start_time, threshold)[0]
 
-    for item in hr_data_list:
-        timestamp = item["timestamp"]
-        difference = abs(timestamp - target_time)
 
-        if difference <= threshold and difference < min_difference:
-            closest_element = item
-            min_difference = difference
+def find_nearest_hrs(
+    hr_data_list, target_times, start_time, threshold=HR_FRAME_THRESHOLD_IN_DECISECOND
+):
+    """
+    Find the nearest heart rate data point of every target time, see find_nearest_hr.
+    The heart rate timestamps are sorted once and every target time is looked up with a
+    binary search, so aligning a whole run is O((points + hr samples) * log(hr samples))
+    instead of scanning the heart rate data for every point.
+    Of data points at the same distance the one first in hr_data_list wins, like in a scan.
 
-    if closest_element:
-        hr = closest_element.get("beatsPerMinute")
-        if hr and hr > 0:
-            return hr
+    Returns:
+        list of int or None: The heart rate value for each target time.
+    """
+    if not hr_data_list or not len(target_times):
+        return [None] * len(target_times)
+    targets = np.asarray(target_times, dtype=float)
+    # note that the unit of target_time is decisecond and the unit of start_time is normal millisecond
+    targets = np.where(
+        targets > TIMESTAMP_THRESHOLD_IN_DECISECOND,
+        (targets * 100 - start_time) / 100,
+        targets,
+    )
+    timestamps = np.array([item["timestamp"] for item in hr_data_list], dtype=float)
+    order = np.argsort(timestamps, kind="stable")
+    sorted_timestamps = timestamps[order]
+    # of equal timestamps, the first one comes first in hr_data_list
+    first_equal = np.searchsorted(sorted_timestamps, sorted_timestamps, side="left")
+
+    right = np.searchsorted(sorted_timestamps, targets, side="left")
+    has_right = right < len(sorted_timestamps)
+    has_left = right > 0
+    left = first_equal[np.maximum(right - 1, 0)]
+    right = np.minimum(right, len(sorted_timestamps) - 1)
+    right_difference = np.where(
+        has_right, np.abs(sorted_timestamps[right] - targets), np.inf
+    )
+    left_difference = np.where(
+        has_left, np.abs(sorted_timestamps[left] - targets), np.inf
+    )
+    is_left = (left_difference < right_difference) | (
+        (left_difference == right_difference) & (order[left] < order[right])
+    )
+    nearest = order[np.where(is_left, left, right)]
+    difference = np.minimum(left_difference, right_difference)
 
-    return None
+    result = []
+    for index, is_close in zip(nearest, difference <= threshold):
+        hr = hr_data_list[index].get("beatsPerMinute") if is_close else None
+        result.append(hr if hr and hr > 0 else None)
+    return result
 
 
-def download_keep_gpx(gpx_data, keep_id):
+def download_keep_gpx(run_points_data, start_time, sport_type, keep_id):
     try:
         print(f"downloading keep_id {str(keep_id)} gpx")
         file_path = os.path.join(GPX_FOLDER, str(keep_id) + ".gpx")
-        with open(file_path, "w") as fb:
-            fb.write(gpx_data)
-        return file_path
+        return write_gpx(
+            file_path,
+            [p["latitude"] for p in run_points_data],
+            [p["longitude"] for p in run_points_data],
+            points_times_ms(run_points_data, start_time),
+            elevations=[p.get("altitude") for p in run_points_data],
+            heart_rates=[p.get("hr") for p in run_points_data],
+            name="gpx from keep",
+            track_type=sport_type,
+        )
     except:
         print(f"wrong id {keep_id}")
         pass
@@ -332,10 +394,17 @@ def download_keep_gpx(gpx_data, keep_id):
 def run_keep_sync(email, password, keep_sports_data_api, with_download_gpx=False):
     generator = Generator(SQL_FILE)
     old_tracks_ids = generator.get_old_tracks_ids()
-    new_tracks = get_all_keep_tracks(
-        email, password, old_tracks_ids, keep_sports_data_api, with_download_gpx
+    # the tracks are written in batches while the others are fetched
+    asyncio.run(
+        get_all_keep_tracks(
+            email,
+            password,
+            old_tracks_ids,
+            keep_sports_data_api,
+            with_download_gpx,
+            on_tracks=generator.sync_from_app,
+        )
     )
-    generator.sync_from_app(new_tracks)
 
     activities_list = generator.load()
     with open(JSON_FILE, "w") as f:
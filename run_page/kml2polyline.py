@@ -1,9 +1,10 @@
 import json
 from datetime import datetime, timedelta
 
-import eviltransform
+import numpy as np
 import polyline
 from config import JSON_FILE, SQL_FILE
+from coord_transform import gcj2wgs
 from fastkml import kml
 from generator import Generator
 from gpxtrackposter.track import Track, start_point
@@ -49,9 +50,8 @@ def load_kml_data(track, k):
     polyline_container = get_points_from_kml(k)
     if IN_CHINA:
         # convert WGS-84 to GCJ-02
-        polyline_container = [
-            eviltransform.gcj2wgs(p[0], p[1]) for p in polyline_container
-        ]
+        latitudes, longitudes = gcj2wgs(*np.array(polyline_container).T)
+        polyline_container = np.column_stack([latitudes, longitudes]).tolist()
 
     track.start_latlng = start_point(polyline_container[0][0], polyline_container[0][1])
     track.polyline_str = polyline.encode(polyline_container)
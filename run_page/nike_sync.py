@@ -1,14 +1,13 @@
 import argparse
+import asyncio
 import json
 import logging
 import os.path
-import time
 from collections import namedtuple
 from datetime import datetime, timedelta, timezone
-from xml.etree import ElementTree
 
-import gpxpy.gpx
-import httpx
+import numpy as np
+import polyline
 from config import (
     BASE_TIMEZONE,
     GPX_FOLDER,
@@ -16,10 +15,16 @@ from config import (
     OUTPUT_DIR,
     SQL_FILE,
     run_map,
+    start_point,
 )
 from generator import Generator
+from generator.db import Activity
+from gpx_writer import write_gpx
+from gpxtrackposter.utils import parse_datetime_to_local, simplify_array
+from http_client import HttpClient
+from synced_data_file_logger import load_synced_file_list, save_synced_data_file_list
 
-from utils import adjust_time, make_activities_file
+from utils import adjust_time
 
 # logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("nike_sync")
@@ -33,53 +38,68 @@ NIKE_HEADERS = {
     "Accept": "application/json",
     "Content-Type": "application/json",
 }
+# activity details fetched at once
+NIKE_CONCURRENCY = 8
+# like the gpx.simplify() the gpx files used to go through
+NIKE_SIMPLIFY_METERS = 10
 
 
 class Nike:
     def __init__(self, access_token):
-        self.client = httpx.Client()
-
-        self.client.headers.update({"Authorization": f"Bearer {access_token}"})
+        # HttpClient retries failed requests with backoff
+        self.client = HttpClient(
+            headers={"Authorization": f"Bearer {access_token}"}, http2=True
+        )
 
-    def get_activities_since_timestamp(self, timestamp):
+    async def get_activities_since_timestamp(self, timestamp):
         # return self.request("activities/before_id/v3/*?limit=30&types=run%2Cjogging&include_deleted=false", timestamp)
-        return self.request(
+        return await self.request(
             "activities/before_id/v3/*?limit=30&types=run%2Cjogging&include_deleted=false",
             timestamp,
         )
 
-    def get_activities_before_id(self, activity_id):
+    async def get_activities_before_id(self, activity_id):
         if not activity_id:
             activity_id = "*"
-        try:
-            return self.request(
-                f"activities/before_id/v3/{activity_id}?limit=30&types=run%2Cjogging&include_deleted=false"
-            )
-        except:
-            print("retry")
-            time.sleep(3)
-            return self.request(
-                f"activities/before_id/v3/{activity_id}?limit=30&types=run%2Cjogging&include_deleted=false"
-            )
-
-    def get_activity(self, activity_id):
-        try:
-            return self.request(f"activity/{activity_id}?metrics=ALL")
-        except:
-            print("retry")
-            time.sleep(3)
-            return self.request(f"activity/{activity_id}?metrics=ALL")
+        return await self.request(
+            f"activities/before_id/v3/{activity_id}?limit=30&types=run%2Cjogging&include_deleted=false"
+        )
+
+    async def get_activity(self, activity_id):
+        return await self.request(f"activity/{activity_id}?metrics=ALL")
 
-    def request(self, resource):
+    async def request(self, resource):
         url = f"{BASE_URL}/{resource}"
         logger.info(f"GET: {url}")
-        response = self.client.get(url)
+        response = await self.client.get(url)
         response.raise_for_status()
         return response.json()
 
 
-def run(refresh_token, is_continue_sync=False):
+async def run(refresh_token, is_continue_sync=False):
     nike = Nike(refresh_token)
+    try:
+        return await sync_activities(nike, is_continue_sync)
+    finally:
+        await nike.client.aclose()
+
+
+async def sync_activities(nike, is_continue_sync=False):
+    """
+    Fetch and save the new activities, details are fetched concurrently while
+    the listing goes on, return the fetched activities
+    an activity that fails to fetch is left out and logged, the next sync
+    without --continue-sync fetches it again
+    """
+    semaphore = asyncio.Semaphore(NIKE_CONCURRENCY)
+
+    async def fetch_activity(activity_id):
+        async with semaphore:
+            full_activity = await nike.get_activity(activity_id)
+        save_activity(full_activity)
+        return full_activity
+
+    fetches = {}
     if is_continue_sync:
         last_id_local = get_last_before_id()
         print(f"Will continue sync before Running from ID {last_id_local}")
@@ -87,7 +107,7 @@ def run(refresh_token, is_continue_sync=False):
         last_id_local = None
     before_id = None
     while True:
-        data = nike.get_activities_before_id(before_id)
+        data = await nike.get_activities_before_id(before_id)
         activities = data["activities"]
         activities_ids = [i["id"] for i in activities]
         is_sync_done = False
@@ -111,12 +131,20 @@ def run(refresh_token, is_continue_sync=False):
                 logger.info(f"Ignore NTC record {activity_id}")
                 continue
 
-            full_activity = nike.get_activity(activity_id)
-            save_activity(full_activity)
+            fetches[activity_id] = asyncio.ensure_future(fetch_activity(activity_id))
 
         if is_sync_done or before_id is None or not activities:
             logger.info("Found no new activities, finishing")
-            return
+            break
+
+    results = await asyncio.gather(*fetches.values(), return_exceptions=True)
+    fetched = []
+    for activity_id, result in zip(fetches, results):
+        if isinstance(result, Exception):
+            print(f"Failed to fetch activity {activity_id}: {str(result)}")
+        else:
+            fetched.append(result)
+    return fetched
 
 
 def save_activity(activity):
@@ -133,6 +161,32 @@ def save_activity(activity):
         raise
 
 
+def get_to_generate_files(activities):
+    """
+    JSON files of activities saved by earlier runs that are not synced yet,
+    for example because the run failed before storing them in the db
+    the files of the just fetched activities are left out
+    """
+    fetched = {f"{activity['end_epoch_ms']}.json" for activity in activities}
+    synced = set(load_synced_file_list())
+    return [
+        os.path.join(OUTPUT_DIR, i)
+        for i in sorted(os.listdir(OUTPUT_DIR))
+        if i.endswith(".json") and i not in synced and i not in fetched
+    ]
+
+
+def load_saved_activities(file_names):
+    activities = []
+    for file_name in file_names:
+        try:
+            with open(file_name) as f:
+                activities.append(json.load(f))
+        except ValueError as e:
+            print(f"Failed to load {file_name}: {str(e)}")
+    return activities
+
+
 def get_last_before_id():
     try:
         file_names = os.listdir(OUTPUT_DIR)
@@ -148,169 +202,24 @@ def get_last_before_id():
         return None
 
 
-def get_to_generate_files():
-    file_names = os.listdir(GPX_FOLDER)
-    try:
-        # error when mixed keep & nike gpx files
-        # since keep has gpx files like 9223370434827882207.gpx
-        # so we need to check gpx file name ensure it is a valid timestamp
-        timestamps = []
-        for i in file_names:
-            if i.startswith("."):
-                continue
-            t = int(i.split(".")[0])
-            # the follow 7226553600000 representing the timestamp(with millisecond)
-            # for "Tue Jan 01 2199 00:00:00 GMT+0800 (CST)"
-            if t > 0 and t < 7226553600000:
-                timestamps.append(t)
-            else:
-                logger.info(f"Invalid timestamp: {t}")
-
-        if len(timestamps) > 0:
-            last_time = max(timestamps)
-        else:
-            last_time = 0
-    except:
-        last_time = 0
-    return [
-        OUTPUT_DIR + "/" + i
-        for i in os.listdir(OUTPUT_DIR)
-        if not i.startswith(".") and int(i.split(".")[0]) > last_time
-    ]
-
-
-def generate_gpx(title, latitude_data, longitude_data, elevation_data, heart_rate_data):
+def save_gpx(activity):
     """
-    Parses the latitude, longitude and elevation data to generate a GPX document
-    Args:
-        title: the title of the GXP document
-        latitude_data: A list of dictionaries containing latitude data
-        longitude_data: A list of dictionaries containing longitude data
-        elevation_data: A list of dictionaries containing elevation data
-    Returns:
-        gpx: The GPX XML document
+    Archive a NRC activity with gps data as gpx file named by its end time
     """
-
-    gpx = gpxpy.gpx.GPX()
-    gpx.nsmap["gpxtpx"] = "http://www.garmin.com/xmlschemas/TrackPointExtension/v1"
-    gpx_track = gpxpy.gpx.GPXTrack()
-    gpx_track.name = title
-    gpx.tracks.append(gpx_track)
-
-    # Create first segment in our GPX track:
-    gpx_segment = gpxpy.gpx.GPXTrackSegment()
-    gpx_track.segments.append(gpx_segment)
-
-    points_dict_list = []
-
-    def update_points(points, update_data, update_name):
-        """
-        Update the points dict list so that can easy create GPXTrackPoint
-        Args:
-            points: basic points list
-            update_data: attr to update points which is a list
-            update_name: attr name
-        Returns:
-            None (just update the points list)
-        """
-        counter = 0
-        for p in points:
-            while p["start_time"] >= update_data[counter]["end_epoch_ms"]:
-                if counter == len(update_data) - 1:
-                    break
-                p[update_name] = update_data[counter]["value"]
-                counter += 1
-
-    for lat, lon in zip(latitude_data, longitude_data):
-        if lat["start_epoch_ms"] != lon["start_epoch_ms"]:
-            raise Exception("\tThe latitude and longitude data is out of order")
-
-        points_dict_list.append(
-            {
-                "latitude": lat["value"],
-                "longitude": lon["value"],
-                "start_time": lat["start_epoch_ms"],
-                "time": datetime.fromtimestamp(
-                    lat["start_epoch_ms"] / 1000, tz=timezone.utc
-                ),
-            }
-        )
-
-    if elevation_data:
-        update_points(points_dict_list, elevation_data, "elevation")
-    if heart_rate_data:
-        update_points(points_dict_list, heart_rate_data, "heart_rate")
-
-    for p in points_dict_list:
-        # delete useless attr
-        del p["start_time"]
-        if p.get("heart_rate") is None:
-            point = gpxpy.gpx.GPXTrackPoint(**p)
-        else:
-            heart_rate_num = p.pop("heart_rate")
-            point = gpxpy.gpx.GPXTrackPoint(**p)
-            gpx_extension_hr = ElementTree.fromstring(
-                f"""<gpxtpx:TrackPointExtension xmlns:gpxtpx="http://www.garmin.com/xmlschemas/TrackPointExtension/v1">
-                <gpxtpx:hr>{heart_rate_num}</gpxtpx:hr>
-                </gpxtpx:TrackPointExtension>
-            """
-            )
-            point.extensions.append(gpx_extension_hr)
-        gpx_segment.points.append(point)
-
-    return gpx.to_xml()
-
-
-def parse_activity_data(activity):
-    """
-    Parses a NRC activity and returns GPX XML
-    Args:
-        activity: a json document for a NRC activity
-    Returns:
-        gpx: the GPX XML doc for the input activity
-    """
-
-    lat_index = None
-    lon_index = None
-    elevation_index = None
-    heart_rate_index = None
-    if not activity.get("metrics"):
-        print(f"The activity {activity['id']} doesn't contain metrics information")
-        return
-    for i, metric in enumerate(activity["metrics"]):
-        if metric["type"] == "latitude":
-            lat_index = i
-        if metric["type"] == "longitude":
-            lon_index = i
-        if metric["type"] == "elevation":
-            elevation_index = i
-        if metric["type"] == "heart_rate":
-            heart_rate_index = i
-
-    if not any([lat_index, lon_index]):
+    columns = get_gps_columns(activity)
+    if columns is None:
         return None
-
-    latitude_data = activity["metrics"][lat_index]["values"]
-    longitude_data = activity["metrics"][lon_index]["values"]
-    elevation_data = None
-    heart_rate_data = None
-    if elevation_index:
-        elevation_data = activity["metrics"][elevation_index]["values"]
-    if heart_rate_index:
-        heart_rate_data = activity["metrics"][heart_rate_index]["values"]
-
-    title = activity["tags"].get("com.nike.name")
-
-    gpx_doc = generate_gpx(
-        title, latitude_data, longitude_data, elevation_data, heart_rate_data
+    times, points, elevations, heart_rates = columns
+    file_path = os.path.join(GPX_FOLDER, str(activity["end_epoch_ms"]) + ".gpx")
+    return write_gpx(
+        file_path,
+        points[:, 0],
+        points[:, 1],
+        times,
+        elevations=elevations,
+        heart_rates=heart_rates,
+        name=activity["tags"].get("com.nike.name"),
     )
-    return gpx_doc
-
-
-def save_gpx(gpx_data, activity_id):
-    file_path = os.path.join(GPX_FOLDER, activity_id + ".gpx")
-    with open(file_path, "w") as f:
-        f.write(gpx_data)
 
 
 def parse_no_gpx_data(activity):
@@ -364,40 +273,143 @@ def parse_no_gpx_data(activity):
     return namedtuple("x", d.keys())(*d.values())
 
 
-def make_new_gpxs(files):
-    # TODO refactor maybe we do not need to upload
-    if not files:
-        print("no files")
-        return
-    if not os.path.exists(GPX_FOLDER):
+def parse_gps_activity(activity):
+    """
+    Build a track straight from the metrics arrays of a NRC activity
+    Args:
+        activity: a json document for a NRC activity
+    Returns:
+        the track namedtuple, or None if the activity has no gps data
+    """
+    columns = get_gps_columns(activity)
+    if columns is None:
+        return None
+    times, points, elevations, heart_rates = columns
+
+    summaries = {
+        s.get("metric"): s.get("value") for s in activity.get("summaries") or []
+    }
+    distance = (summaries.get("distance") or 0) * 1000 or track_length(points)
+    average_heartrate = summaries.get("heart_rate")
+    if average_heartrate is None and not np.isnan(heart_rates).all():
+        average_heartrate = float(np.nanmean(heart_rates))
+    elevation_gain = summaries.get("ascent")
+    if elevation_gain is None and not np.isnan(elevations).all():
+        climbs = np.diff(elevations[~np.isnan(elevations)])
+        elevation_gain = float(climbs[climbs > 0].sum())
+
+    # same id and times the gpx files of these activities used to give
+    start_date = datetime.fromtimestamp(times[0] / 1000, tz=timezone.utc)
+    end_date = datetime.fromtimestamp(times[-1] / 1000, tz=timezone.utc)
+    start_date_local, end_date_local = parse_datetime_to_local(
+        start_date, end_date, points[0].tolist()
+    )
+    moving_seconds = int(activity["active_duration_ms"] / 1000)
+    d = {
+        "id": int(times[0]),
+        "name": activity["tags"].get("com.nike.name") or "",
+        "type": "Run",
+        "subtype": "Run",
+        "start_date": datetime.strftime(start_date, "%Y-%m-%d %H:%M:%S"),
+        "end": datetime.strftime(end_date, "%Y-%m-%d %H:%M:%S"),
+        "start_date_local": datetime.strftime(start_date_local, "%Y-%m-%d %H:%M:%S"),
+        "end_local": datetime.strftime(end_date_local, "%Y-%m-%d %H:%M:%S"),
+        "length": distance,
+        "average_heartrate": int(average_heartrate) if average_heartrate else None,
+        "map": run_map(polyline.encode(simplify_points(points).tolist())),
+        "start_latlng": start_point(*points[0].tolist()),
+        "distance": distance,
+        "moving_time": timedelta(seconds=moving_seconds),
+        "elapsed_time": timedelta(
+            seconds=int((activity["end_epoch_ms"] - activity["start_epoch_ms"]) / 1000)
+        ),
+        "average_speed": distance / moving_seconds if moving_seconds else 0,
+        "elevation_gain": elevation_gain,
+        "source": "nike",
+    }
+    return namedtuple("x", d.keys())(*d.values())
+
+
+def get_gps_columns(activity):
+    """
+    Times, [lat, lon] points, elevations and heart rates of a NRC activity as
+    arrays, nan where a metric has no sample, or None without gps data
+    """
+    latitude_data = get_metric_values(activity, "latitude")
+    longitude_data = get_metric_values(activity, "longitude")
+    if not latitude_data or not longitude_data:
+        return None
+
+    pairs = list(zip(latitude_data, longitude_data))
+    if any(lat["start_epoch_ms"] != lon["start_epoch_ms"] for lat, lon in pairs):
+        raise Exception("\tThe latitude and longitude data is out of order")
+    times = np.array([lat["start_epoch_ms"] for lat, _ in pairs], dtype=np.int64)
+    points = np.array([[lat["value"], lon["value"]] for lat, lon in pairs])
+    elevations = sample_metric_at(times, get_metric_values(activity, "elevation"))
+    heart_rates = sample_metric_at(times, get_metric_values(activity, "heart_rate"))
+    return times, points, elevations, heart_rates
+
+
+def get_metric_values(activity, metric_type):
+    for metric in activity.get("metrics") or []:
+        if metric["type"] == metric_type:
+            return metric["values"]
+    return None
+
+
+def sample_metric_at(times, metric_values):
+    """
+    Value of the metric sample covering each of times, nan where there is none
+    """
+    if not metric_values:
+        return np.full(len(times), np.nan)
+    starts = np.array([v["start_epoch_ms"] for v in metric_values], dtype=np.int64)
+    ends = np.array([v["end_epoch_ms"] for v in metric_values], dtype=np.int64)
+    values = np.array([v["value"] for v in metric_values], dtype=float)
+    index = np.clip(np.searchsorted(starts, times, side="right") - 1, 0, None)
+    covered = (times >= starts[index]) & (times <= ends[index])
+    return np.where(covered, values[index], np.nan)
+
+
+def simplify_points(points, max_distance=NIKE_SIMPLIFY_METERS):
+    """
+    Drop the points within max_distance meters of the simplified line
+    """
+    # meters per degree around the track, fine at the scale of a run
+    scale = np.array([110540, 111320 * np.cos(np.radians(points[0, 0]))])
+    return simplify_array(points * scale, max_distance) / scale
+
+
+def track_length(points):
+    lat, lng = np.radians(points).T
+    a = (
+        np.sin(np.diff(lat) / 2) ** 2
+        + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(np.diff(lng) / 2) ** 2
+    )
+    return float(2 * 6371000 * np.arcsin(np.sqrt(a)).sum())
+
+
+def make_new_tracks(activities, with_gpx=False):
+    """
+    Turn fetched activities into tracks for the db, with_gpx also archives the
+    activities with gps data as gpx files
+    """
+    if with_gpx and not os.path.exists(GPX_FOLDER):
         os.mkdir(GPX_FOLDER)
-    gpx_files = []
-    tracks_list = []
-    for file in files:
-        with open(file, "rb") as f:
-            try:
-                json_data = json.loads(f.read())
-            except:
-                return
-        # ALL save name using utc if you want local please offset
-        activity_name = str(json_data["end_epoch_ms"])
-        parsed_data = parse_activity_data(json_data)
-        if parsed_data:
-            gpx_files.append(os.path.join(GPX_FOLDER, str(activity_name) + ".gpx"))
-            save_gpx(parsed_data, activity_name)
-        else:
-            try:
-                track = parse_no_gpx_data(json_data)
-                if track:
-                    tracks_list.append(track)
-            # just ignore some unexcept run
-            except Exception as e:
-                print(str(e))
-                continue
-    if tracks_list:
-        generator = Generator(SQL_FILE)
-        generator.sync_from_app(tracks_list)
-    return gpx_files
+    tracks = []
+    for activity in activities:
+        try:
+            track = parse_gps_activity(activity) or parse_no_gpx_data(activity)
+            if with_gpx:
+                # ALL save name using utc if you want local please offset
+                save_gpx(activity)
+        # just ignore some unexcept run
+        except Exception as e:
+            print(str(e))
+            continue
+        if track:
+            tracks.append(track)
+    return tracks
 
 
 if __name__ == "__main__":
@@ -411,12 +423,30 @@ if __name__ == "__main__":
         action="store_true",
         help="Continue syncing from the last activity",
     )
+    parser.add_argument(
+        "--with-gpx",
+        dest="with_gpx",
+        action="store_true",
+        help="also save the activities with gps data as gpx files",
+    )
     options = parser.parse_args()
-    run(options.refresh_token, options.continue_sync)
-
-    time.sleep(2)
-    files = get_to_generate_files()
-    make_new_gpxs(files)
-    # waiting for gpx
-    time.sleep(2)
-    make_activities_file(SQL_FILE, GPX_FOLDER, JSON_FILE)
+    activities = asyncio.run(run(options.refresh_token, options.continue_sync))
+    saved_files = get_to_generate_files(activities)
+
+    generator = Generator(SQL_FILE)
+    tracks = make_new_tracks(activities, options.with_gpx)
+    # saved files may also be activities the old gpx sync already stored
+    stored_ids = {run_id for (run_id,) in generator.session.query(Activity.run_id)}
+    tracks.extend(
+        t
+        for t in make_new_tracks(load_saved_activities(saved_files), options.with_gpx)
+        if t.id not in stored_ids
+    )
+    generator.sync_from_app(tracks)
+    save_synced_data_file_list(
+        [f"{activity['end_epoch_ms']}.json" for activity in activities]
+        + [os.path.basename(f) for f in saved_files]
+    )
+    activities_list = generator.load()
+    with open(JSON_FILE, "w") as f:
+        json.dump(activities_list, f, indent=0)
@@ -0,0 +1,109 @@
+"""
+Client side bookkeeping of strava's api quotas, shared by the scripts that
+send many requests, so that they wait for the quota instead of getting 429s
+"""
+
+import asyncio
+import json
+import time
+from datetime import datetime, timezone
+
+READ_LIMIT_HEADER = "X-ReadRateLimit"
+OVERALL_LIMIT_HEADER = "X-RateLimit"
+# strava's default limits, replaced by the ones sent in the headers
+READ_LIMITS = (100, 1000)
+OVERALL_LIMITS = (200, 2000)
+
+
+class QuotaExhausted(Exception):
+    pass
+
+
+class StravaQuota:
+    """
+    Strava's 15 minute and daily request quotas, kept in a state file so that
+    the next run knows what the last one used
+
+    strava resets the short quota at every quarter hour and the daily one at
+    midnight utc, requests are counted here before they are sent, so that
+    concurrent requests never run over the quota and get a 429
+    header is the rate limit header pair to follow, reads count against
+    X-ReadRateLimit and every request against X-RateLimit
+    """
+
+    def __init__(self, state_file, limits=READ_LIMITS, header=READ_LIMIT_HEADER):
+        self.state_file = state_file
+        self.header = header
+        self.state = {
+            "quarter": 0,
+            "day": "",
+            "short_usage": 0,
+            "long_usage": 0,
+            "short_limit": limits[0],
+            "long_limit": limits[1],
+        }
+        try:
+            with open(state_file) as f:
+                self.state.update(json.load(f))
+        except (OSError, ValueError):
+            pass
+        self.lock = asyncio.Lock()
+
+    def _roll(self, now=None):
+        now = now or time.time()
+        quarter = int(now // 900 * 900)
+        day = datetime.fromtimestamp(now, tz=timezone.utc).strftime("%Y-%m-%d")
+        if quarter != self.state["quarter"]:
+            self.state["quarter"] = quarter
+            self.state["short_usage"] = 0
+        if day != self.state["day"]:
+            self.state["day"] = day
+            self.state["long_usage"] = 0
+
+    async def acquire(self):
+        """
+        Wait for a request slot, raise QuotaExhausted when today's quota is used
+        """
+        async with self.lock:
+            while True:
+                self._roll()
+                if self.state["long_usage"] >= self.state["long_limit"]:
+                    self.save()
+                    raise QuotaExhausted
+                if self.state["short_usage"] < self.state["short_limit"]:
+                    break
+                delay = self.state["quarter"] + 900 - time.time() + 1
+                print(f"15 minute quota used, wait {int(delay)} seconds")
+                await asyncio.sleep(delay)
+            self.state["short_usage"] += 1
+            self.state["long_usage"] += 1
+            self.save()
+
+    def update(self, headers):
+        """
+        Take usage and limits from a response, which also counts the requests
+        of other scripts using the same app
+        """
+        usage = headers.get(f"{self.header}-Usage")
+        limit = headers.get(f"{self.header}-Limit")
+        if not usage or not limit:
+            return
+        self._roll()
+        short_usage, long_usage = (int(v) for v in usage.split(",")[:2])
+        short_limit, long_limit = (int(v) for v in limit.split(",")[:2])
+        # requests still in flight are counted here but not by strava yet
+        self.state["short_usage"] = max(self.state["short_usage"], short_usage)
+        self.state["long_usage"] = max(self.state["long_usage"], long_usage)
+        self.state["short_limit"] = short_limit
+        self.state["long_limit"] = long_limit
+        self.save()
+
+    def exceeded(self):
+        # strava disagrees with the count, wait for the next quarter
+        self._roll()
+        self.state["short_usage"] = self.state["short_limit"]
+        self.save()
+
+    def save(self):
+        with open(self.state_file, "w") as f:
+            json.dump(self.state, f)
@@ -0,0 +1,146 @@
+"""
+Full resolution tracks for strava activities
+strava activity summaries only carry a downsampled polyline, this fetches the
+latlng/time/heartrate/altitude streams of each activity within the api quota
+and stores them as compressed numpy files, one per activity
+"""
+
+import asyncio
+import os
+
+import httpx
+import numpy as np
+import polyline
+from config import STRAVA_STREAMS_FOLDER
+from gpxtrackposter.utils import simplify_array
+from http_client import HttpClient
+from strava_quota import QuotaExhausted, StravaQuota
+
+STRAVA_API = "https://www.strava.com/api/v3"
+STREAM_KEYS = ["latlng", "time", "heartrate", "altitude"]
+STREAMS_CONCURRENCY = 4
+# the polyline stored for the map keeps every turn wider than this
+STREAMS_SIMPLIFY_METERS = 5
+# coordinates are stored as integer microdegrees, about 0.1 m
+LATLNG_SCALE = 1e6
+
+
+def streams_file(activity_id):
+    return os.path.join(STRAVA_STREAMS_FOLDER, f"{activity_id}.npz")
+
+
+def has_streams(activity_id):
+    return os.path.exists(streams_file(activity_id))
+
+
+def save_streams(activity_id, streams):
+    """
+    Store the streams of an activity, activities without streams get an
+    empty file so that they are not fetched again
+    """
+    data = {}
+    latlng = streams.get("latlng", {}).get("data")
+    if latlng:
+        points = np.array(latlng, dtype=float)
+        data["latlng"] = np.round(points * LATLNG_SCALE).astype(np.int32)
+        data["polyline"] = np.array(polyline.encode(simplify_points(points).tolist()))
+    if streams.get("time", {}).get("data"):
+        data["time"] = np.array(streams["time"]["data"], dtype=np.int32)
+    if streams.get("heartrate", {}).get("data"):
+        data["heartrate"] = np.array(streams["heartrate"]["data"], dtype=np.int16)
+    if streams.get("altitude", {}).get("data"):
+        data["altitude"] = np.array(streams["altitude"]["data"], dtype=np.float32)
+    file_path = streams_file(activity_id)
+    # write to a temporary name, a killed run must not leave a half file
+    temp_path = file_path + ".tmp.npz"
+    np.savez_compressed(temp_path, **data)
+    os.replace(temp_path, file_path)
+
+
+def load_streams(activity_id):
+    """
+    Streams of an activity as arrays, latlng in degrees, or None
+    """
+    if not has_streams(activity_id):
+        return None
+    with np.load(streams_file(activity_id)) as data:
+        streams = {key: data[key] for key in data.files if key != "polyline"}
+    if "latlng" in streams:
+        streams["latlng"] = streams["latlng"] / LATLNG_SCALE
+    return streams
+
+
+def streams_polyline(activity_id):
+    """
+    Encoded polyline of the full resolution track, or None
+    """
+    if not has_streams(activity_id):
+        return None
+    with np.load(streams_file(activity_id)) as data:
+        if "polyline" not in data.files:
+            return None
+        return str(data["polyline"])
+
+
+def simplify_points(points, max_distance=STREAMS_SIMPLIFY_METERS):
+    # meters per degree around the track, fine at the scale of an activity
+    scale = np.array([110540, 111320 * np.cos(np.radians(points[0, 0]))])
+    return simplify_array(points * scale, max_distance) / scale
+
+
+async def fetch_strava_streams(access_token, activity_ids):
+    """
+    Fetch and store the streams of activity_ids in order, until done or until
+    the daily quota is used, return the ids that were stored
+    """
+    if not os.path.exists(STRAVA_STREAMS_FOLDER):
+        os.mkdir(STRAVA_STREAMS_FOLDER)
+    quota = StravaQuota(os.path.join(STRAVA_STREAMS_FOLDER, ".quota.json"))
+    queue = asyncio.Queue()
+    for activity_id in activity_ids:
+        queue.put_nowait(activity_id)
+    stored = []
+
+    async def worker(client):
+        while not queue.empty():
+            activity_id = queue.get_nowait()
+            try:
+                await quota.acquire()
+            except QuotaExhausted:
+                queue.put_nowait(activity_id)
+                return
+            try:
+                response = await client.get(
+                    f"{STRAVA_API}/activities/{activity_id}/streams",
+                    params={"keys": ",".join(STREAM_KEYS), "key_by_type": "true"},
+                )
+            except httpx.HTTPError as e:
+                # no file is stored, the next run tries again
+                print(f"Failed to get streams of {activity_id}: {str(e)}")
+                continue
+            quota.update(response.headers)
+            if response.status_code == 429:
+                quota.exceeded()
+                queue.put_nowait(activity_id)
+                continue
+            if response.status_code == 404:
+                streams = {}
+            elif response.status_code != 200:
+                print(f"Failed to get streams of {activity_id}: {response.text}")
+                continue
+            else:
+                streams = response.json()
+            save_streams(activity_id, streams)
+            stored.append(activity_id)
+
+    async with HttpClient(
+        headers={"Authorization": f"Bearer {access_token}"},
+        max_connections=STREAMS_CONCURRENCY,
+        # the quota decides when to send, a retried 429 would only waste one
+        max_retries=0,
+    ) as client:
+        await asyncio.gather(*(worker(client) for _ in range(STREAMS_CONCURRENCY)))
+    if not queue.empty():
+        print(f"Daily quota used, {queue.qsize()} activities left for the next run")
+    print(f"Stored the streams of {len(stored)} activities")
+    return stored
@@ -6,12 +6,16 @@ from generator import Generator
 
 
 # for only run type, we use the same logic as garmin_sync
-def run_strava_sync(client_id, client_secret, refresh_token, only_run=False):
+def run_strava_sync(
+    client_id, client_secret, refresh_token, only_run=False, with_streams=False
+):
     generator = Generator(SQL_FILE)
     generator.set_strava_config(client_id, client_secret, refresh_token)
     # if you want to refresh data change False to True
     generator.only_run = only_run
     generator.sync(False)
+    if with_streams:
+        generator.sync_strava_streams()
 
     activities_list = generator.loadForMapping()
     with open(JSON_FILE, "w") as f:
@@ -29,10 +33,17 @@ if __name__ == "__main__":
         action="store_true",
         help="if is only for running",
     )
+    parser.add_argument(
+        "--with-streams",
+        dest="with_streams",
+        action="store_true",
+        help="also fetch full resolution tracks, as far as the api quota allows",
+    )
     options = parser.parse_args()
     run_strava_sync(
         options.client_id,
         options.client_secret,
         options.refresh_token,
         only_run=options.only_run,
+        with_streams=options.with_streams,
     )
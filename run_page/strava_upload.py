@@ -0,0 +1,232 @@
+"""
+Upload activity files to strava
+a bounded number of uploads is in flight at a time, each is polled until
+strava has processed it, and the results are kept in a ledger so that a rerun
+only uploads the files that are not done yet
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import os
+import re
+
+import httpx
+from config import FIT_FOLDER, STRAVA_UPLOAD_LEDGER
+from http_client import HttpClient
+from strava_quota import (
+    OVERALL_LIMIT_HEADER,
+    OVERALL_LIMITS,
+    QuotaExhausted,
+    StravaQuota,
+)
+
+STRAVA_API = "https://www.strava.com/api/v3"
+STRAVA_UPLOAD_CONCURRENCY = 4
+# strava needs about 8 seconds to process a file, every poll is a request
+POLL_INTERVAL = 5
+MAX_POLLS = 60
+UPLOAD_SUFFIXES = ("fit", "fit.gz", "gpx", "gpx.gz", "tcx", "tcx.gz")
+DUPLICATE_RE = re.compile(r"duplicate of .*?activities/(\d+)")
+
+
+def upload_data_type(file_name):
+    name = os.path.basename(file_name).lower()
+    for suffix in UPLOAD_SUFFIXES:
+        if name.endswith("." + suffix):
+            return suffix
+    return None
+
+
+class StravaUploader:
+    """
+    Upload files with the strava api, results are recorded per file name as
+    uploaded (with the activity id), duplicate (with the existing activity id)
+    or error (strava refused the file), files that failed for any other reason
+    are not recorded and are uploaded again by the next run
+
+    every upload and poll waits for the overall quota, polls also for the read
+    quota, an upload still processing when a run stops is polled by the next
+    """
+
+    def __init__(
+        self,
+        access_token,
+        ledger_file=STRAVA_UPLOAD_LEDGER,
+        max_in_flight=STRAVA_UPLOAD_CONCURRENCY,
+        poll_interval=POLL_INTERVAL,
+        force_to_run=True,
+    ):
+        self.access_token = access_token
+        self.ledger_file = ledger_file
+        self.max_in_flight = max_in_flight
+        self.poll_interval = poll_interval
+        self.force_to_run = force_to_run
+        try:
+            with open(ledger_file) as f:
+                self.ledger = json.load(f)
+        except (OSError, ValueError):
+            self.ledger = {}
+        state_dir = os.path.dirname(os.path.abspath(ledger_file))
+        self.quota = StravaQuota(
+            os.path.join(state_dir, ".strava_quota.json"),
+            OVERALL_LIMITS,
+            OVERALL_LIMIT_HEADER,
+        )
+        self.read_quota = StravaQuota(
+            os.path.join(state_dir, ".strava_read_quota.json")
+        )
+        self.counts = collections.Counter()
+
+    def is_done(self, file_name):
+        entry = self.ledger.get(os.path.basename(file_name))
+        return entry is not None and entry["status"] != "processing"
+
+    async def upload_files(self, file_names, data_type=None):
+        """
+        Upload the files that are not in the ledger yet, return the counts of
+        the results of this run
+        data_type is taken from the file names unless it is given
+        """
+        to_upload = []
+        for file_name in file_names:
+            if self.is_done(file_name):
+                self.counts["skipped"] += 1
+            elif (data_type or upload_data_type(file_name)) is None:
+                print(f"Can not upload {file_name} to strava, unknown file type")
+                self.counts["failed"] += 1
+            else:
+                to_upload.append(file_name)
+        print(f"{len(to_upload)} files to upload to strava")
+        slots = asyncio.Semaphore(self.max_in_flight)
+
+        async def upload(client, file_name):
+            async with slots:
+                try:
+                    await self._upload(client, file_name, data_type)
+                except QuotaExhausted:
+                    self.counts["left"] += 1
+                except (httpx.HTTPError, OSError) as e:
+                    print(f"Failed to upload {file_name}: {str(e)}")
+                    self.counts["failed"] += 1
+
+        async with HttpClient(
+            headers={"Authorization": f"Bearer {self.access_token}"},
+            max_connections=self.max_in_flight,
+            # 429s wait for the quota instead
+            max_retries=0,
+        ) as client:
+            await asyncio.gather(*(upload(client, f) for f in to_upload))
+        if self.counts["left"]:
+            print(f"Daily quota used, {self.counts['left']} files left for next run")
+        print(", ".join(f"{count} {status}" for status, count in self.counts.items()))
+        return self.counts
+
+    async def _upload(self, client, file_name, data_type):
+        key = os.path.basename(file_name)
+        entry = self.ledger.get(key)
+        if entry is None:
+            data = {
+                "data_type": data_type or upload_data_type(file_name),
+                "external_id": key,
+            }
+            if self.force_to_run:
+                data["activity_type"] = "run"
+            with open(file_name, "rb") as f:
+                upload = await self._request(
+                    client,
+                    "POST",
+                    f"{STRAVA_API}/uploads",
+                    data=data,
+                    files={"file": (key, f)},
+                )
+            print(f"Uploading {file_name} to strava, upload_id: {upload['id']}.")
+            self._record(key, "processing", upload_id=upload["id"])
+        else:
+            upload = {"id": entry["upload_id"], "status": "", "error": None}
+        polls = 0
+        while not upload.get("activity_id") and not upload.get("error"):
+            if polls >= MAX_POLLS:
+                # keep it as processing, the next run polls it again
+                print(f"Strava is still processing {file_name}")
+                self.counts["processing"] += 1
+                return
+            await asyncio.sleep(self.poll_interval)
+            upload = await self._request(
+                client, "GET", f"{STRAVA_API}/uploads/{upload['id']}", read=True
+            )
+            polls += 1
+        if upload.get("activity_id"):
+            self._record(key, "uploaded", activity_id=upload["activity_id"])
+            return
+        duplicate = DUPLICATE_RE.search(upload["error"])
+        if duplicate:
+            self._record(key, "duplicate", activity_id=int(duplicate.group(1)))
+        else:
+            print(f"Strava refused {file_name}: {upload['error']}")
+            self._record(key, "error", error=upload["error"])
+
+    async def _request(self, client, method, url, read=False, **kwargs):
+        while True:
+            if read:
+                await self.read_quota.acquire()
+            await self.quota.acquire()
+            response = await client.request(method, url, **kwargs)
+            self.quota.update(response.headers)
+            self.read_quota.update(response.headers)
+            if response.status_code == 429:
+                self.quota.exceeded()
+                if read:
+                    self.read_quota.exceeded()
+                continue
+            response.raise_for_status()
+            return response.json()
+
+    def _record(self, key, status, **details):
+        self.ledger[key] = {"status": status, **details}
+        if status != "processing":
+            self.counts[status] += 1
+        temp_file = self.ledger_file + ".tmp"
+        with open(temp_file, "w") as f:
+            json.dump(self.ledger, f, indent=0)
+        os.replace(temp_file, self.ledger_file)
+
+
+def upload_files_to_strava(client, file_names, data_type=None, force_to_run=True):
+    """
+    Upload files with the token of a stravalib client, see StravaUploader
+    """
+    uploader = StravaUploader(client.access_token, force_to_run=force_to_run)
+    return asyncio.run(uploader.upload_files(file_names, data_type))
+
+
+if __name__ == "__main__":
+    # utils imports this module
+    from utils import make_strava_client
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("client_id", help="strava client id")
+    parser.add_argument("client_secret", help="strava client secret")
+    parser.add_argument("refresh_token", help="strava refresh token")
+    parser.add_argument(
+        "--folder",
+        default=FIT_FOLDER,
+        help="folder with the fit, gpx or tcx files to upload (default: FIT_OUT)",
+    )
+    parser.add_argument(
+        "--keep-type",
+        dest="keep_type",
+        action="store_true",
+        help="keep the activity type of the files instead of uploading runs",
+    )
+    options = parser.parse_args()
+    client = make_strava_client(
+        options.client_id, options.client_secret, options.refresh_token
+    )
+    files = sorted(
+        os.path.join(options.folder, name)
+        for name in os.listdir(options.folder)
+        if upload_data_type(name)
+    )
+    upload_files_to_strava(client, files, force_to_run=not options.keep_type)
@@ -0,0 +1,154 @@
+"""
+Parse and store activities while they are downloaded
+downloaded files are parsed in a process pool while the other downloads go
+on, and the parsed tracks are written to the db in batches by a single writer
+"""
+
+import asyncio
+import concurrent.futures
+import os
+
+from generator import Generator
+from generator.db import Activity
+from gpxtrackposter.track_loader import TrackLoader, load_gpx_file
+from synced_data_file_logger import save_synced_data_file_list
+
+
+class SyncPipeline:
+    """
+    Download -> parse -> db writer pipeline used by the sync scripts
+
+    put() waits while max_pending files are being parsed, and parsing waits
+    while batch_size parsed tracks wait for the writer, so downloads slow down
+    to the pace of the parser and the db
+    tracks are filtered like TrackLoader.load_tracks does and written as they
+    come, close() then merges the tracks of the whole run, deletes the rows of
+    tracks merged into an earlier one, writes the merged tracks again and
+    records the files as synced so that a later Generator.sync_from_data_dir
+    skips them, the parsed tracks are kept until then for the merge
+    """
+
+    def __init__(
+        self,
+        sql_file,
+        activity_title_dict=None,
+        max_workers=None,
+        max_pending=None,
+        batch_size=50,
+    ):
+        self.sql_file = sql_file
+        # titles may still be added while the pipeline runs
+        self.activity_title_dict = (
+            activity_title_dict if activity_title_dict is not None else {}
+        )
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pending = max_pending or 2 * self.max_workers
+        self.batch_size = batch_size
+        self.loader = TrackLoader()
+        self.tracks = []
+        # rows created by this run, the ones a merge may delete again
+        self.created_ids = set()
+
+    async def __aenter__(self):
+        self.loop = asyncio.get_running_loop()
+        self.executor = concurrent.futures.ProcessPoolExecutor(self.max_workers)
+        self.slots = asyncio.Semaphore(self.max_pending)
+        self.parsed = asyncio.Queue(self.batch_size)
+        self.parse_tasks = set()
+        self.generator = Generator(self.sql_file)
+        self.writer = asyncio.ensure_future(self._write())
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def put(self, file_path, data=None):
+        """
+        Queue a downloaded file, data is its content if it is still in memory
+        """
+        await self.slots.acquire()
+        task = asyncio.ensure_future(self._parse(file_path, data))
+        self.parse_tasks.add(task)
+        task.add_done_callback(self.parse_tasks.discard)
+
+    async def close(self):
+        """
+        Wait for the queued files, write the last batch and stop the workers
+        """
+        if self.parse_tasks:
+            await asyncio.gather(*self.parse_tasks)
+        await self.parsed.put(None)
+        await self.writer
+        self.executor.shutdown()
+        written = await self.loop.run_in_executor(None, self._merge_run)
+        self.generator.session.close()
+        print(f"Synced {written} tracks while downloading")
+
+    async def _parse(self, file_path, data):
+        suffix = file_path.rsplit(".", 1)[-1]
+        load_func = self.loader.load_func_dict.get(suffix, load_gpx_file)
+        # only FIT files can be parsed from memory
+        args = (file_path, {}, data) if suffix == "fit" else (file_path, {})
+        try:
+            track = await self.loop.run_in_executor(self.executor, load_func, *args)
+            await self.parsed.put(track)
+        except Exception as e:
+            # the file is not recorded as synced, the folder sync loads it again
+            print(f"Failed to parse {file_path}: {str(e)}")
+        finally:
+            self.slots.release()
+
+    async def _write(self):
+        done = False
+        while not done:
+            batch = []
+            while len(batch) < self.batch_size:
+                track = await self.parsed.get()
+                if track is None:
+                    done = True
+                    break
+                batch.append(track)
+            if batch:
+                # keep the event loop free for the downloads
+                await self.loop.run_in_executor(None, self._write_batch, batch)
+
+    def _write_batch(self, tracks):
+        for t in tracks:
+            file_id = t.file_names[0].split(".")[0]
+            t.track_name = self.activity_title_dict.get(file_id, t.track_name)
+        # tracks of other batches may still merge with these, close() fixes
+        # the rows up and records the files as synced
+        prepared = self.loader.prepare_tracks(tracks, merge=False)
+        try:
+            created_ids = self.generator.sync_from_tracks(prepared, save_synced=False)
+        except Exception as e:
+            # left to the folder sync, like a file that failed to parse
+            self.generator.session.rollback()
+            print(f"Failed to write {len(prepared)} tracks: {str(e)}")
+            return
+        self.created_ids.update(created_ids)
+        # short tracks are kept too, merged they may be long enough
+        self.tracks.extend(tracks)
+
+    def _merge_run(self):
+        """
+        Merge the tracks of the whole run like the folder sync does, return the
+        number of tracks stored
+        """
+        tracks = self.loader.prepare_tracks(self.tracks)
+        merged = [t for t in tracks if len(t.file_names) > 1]
+        kept_ids = {t.run_id for t in tracks}
+        stale_ids = [i for i in self.created_ids if i not in kept_ids]
+        try:
+            if stale_ids:
+                self.generator.session.query(Activity).filter(
+                    Activity.run_id.in_(stale_ids)
+                ).delete(synchronize_session=False)
+            self.generator.sync_from_tracks(merged, save_synced=False)
+        except Exception as e:
+            # the files are not recorded as synced, the folder sync loads them
+            self.generator.session.rollback()
+            print(f"Failed to merge {len(merged)} tracks: {str(e)}")
+            return 0
+        save_synced_data_file_list([f for t in tracks for f in t.file_names])
+        return len(tracks)
@@ -1,5 +1,4 @@
 import json
-import time
 from datetime import datetime
 
 import pytz
@@ -10,7 +9,7 @@ except:
     pass
 from generator import Generator
 from stravalib.client import Client
-from stravalib.exc import RateLimitExceeded
+from strava_upload import upload_files_to_strava
 
 
 def adjust_time(time, tz_name):
@@ -109,27 +108,5 @@ def get_strava_last_time(client, is_milliseconds=True):
 
 
 def upload_file_to_strava(client, file_name, data_type, force_to_run=True):
-    with open(file_name, "rb") as f:
-        try:
-            if force_to_run:
-                r = client.upload_activity(
-                    activity_file=f, data_type=data_type, activity_type="run"
-                )
-            else:
-                r = client.upload_activity(activity_file=f, data_type=data_type)
-
-        except RateLimitExceeded as e:
-            timeout = e.timeout
-            print()
-            print(f"Strava API Rate Limit Exceeded. Retry after {timeout} seconds")
-            print()
-            time.sleep(timeout)
-            if force_to_run:
-                r = client.upload_activity(
-                    activity_file=f, data_type=data_type, activity_type="run"
-                )
-            else:
-                r = client.upload_activity(activity_file=f, data_type=data_type)
-        print(
-            f"Uploading {data_type} file: {file_name} to strava, upload_id: {r.upload_id}."
-        )
+    # one file through the upload queue, which also records it in the ledger
+    upload_files_to_strava(client, [file_name], data_type, force_to_run)
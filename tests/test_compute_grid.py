@@ -0,0 +1,52 @@
+import random
+
+import pytest
+from gpxtrackposter.utils import compute_grid
+from gpxtrackposter.xy import XY
+
+
+def compute_grid_quadratic(count, dimensions):
+    # the O(count^2) search compute_grid replaced
+    min_waste = -1.0
+    best_size = None
+    best_counts = None
+    for count_x in range(1, count + 1):
+        size_x = dimensions.x / count_x
+        for count_y in range(1, count + 1):
+            if count_x * count_y >= count:
+                size_y = dimensions.y / count_y
+                size = min(size_x, size_y)
+                waste = dimensions.x * dimensions.y - count * size * size
+                if waste < 0:
+                    continue
+                elif best_size is None or waste < min_waste:
+                    best_size = size
+                    best_counts = count_x, count_y
+                    min_waste = waste
+    return best_size, best_counts
+
+
+@pytest.mark.parametrize(
+    "dimensions",
+    [XY(200, 300), XY(300, 200), XY(100, 100), XY(180, 1), XY(1, 180)],
+)
+def test_compute_grid_matches_quadratic_search(dimensions):
+    for count in range(1, 121):
+        assert compute_grid(count, dimensions) == compute_grid_quadratic(
+            count, dimensions
+        )
+
+
+def test_compute_grid_matches_quadratic_search_random():
+    rng = random.Random(28)
+    for _ in range(200):
+        count = rng.randint(1, 400)
+        # aspect ratios from 1:50 to 50:1
+        dimensions = XY(rng.uniform(10, 500), rng.uniform(10, 500))
+        assert compute_grid(count, dimensions) == compute_grid_quadratic(
+            count, dimensions
+        ), (count, dimensions)
+
+
+def test_compute_grid_without_tracks():
+    assert compute_grid(0, XY(200, 300)) == (None, None)
@@ -0,0 +1,51 @@
+import coord_transform
+import eviltransform
+import numpy as np
+import pytest
+
+POINT_COUNT = 10000
+
+
+@pytest.fixture(scope="module")
+def points():
+    """
+    Seeded random points, half of them in the China box and half worldwide
+    """
+    rng = np.random.default_rng(46)
+    half = POINT_COUNT // 2
+    lat = np.concatenate(
+        [rng.uniform(0.8293, 55.8271, half), rng.uniform(-85, 85, half)]
+    )
+    lng = np.concatenate(
+        [rng.uniform(72.004, 137.8347, half), rng.uniform(-180, 180, half)]
+    )
+    return lat, lng
+
+
+@pytest.mark.parametrize(
+    "name", ["wgs2gcj", "gcj2wgs", "gcj2bd", "bd2gcj", "wgs2bd", "bd2wgs"]
+)
+def test_transforms_match_eviltransform(points, name):
+    lat, lng = points
+    result = np.column_stack(getattr(coord_transform, name)(lat, lng))
+    expected = np.array([getattr(eviltransform, name)(a, b) for a, b in zip(lat, lng)])
+    np.testing.assert_allclose(result, expected, rtol=0, atol=1e-12)
+
+
+def test_gcj2wgs_exact_against_eviltransform(points):
+    lat, lng = points
+    wgs = np.column_stack(coord_transform.gcj2wgs_exact(lat, lng))
+    expected = np.array([eviltransform.gcj2wgs_exact(a, b) for a, b in zip(lat, lng)])
+
+    def residual(result):
+        gcj = np.column_stack(coord_transform.wgs2gcj(result[:, 0], result[:, 1]))
+        return np.abs(gcj - np.column_stack([lat, lng])).max(axis=1)
+
+    ours = residual(wgs)
+    theirs = residual(expected)
+    # every point round trips within the 1e-7 default tolerance
+    assert ours.max() < 1e-7
+    # eviltransform stops its bisection once both offsets are below 1e-6, and
+    # may stop far from the inverse, where the results differ ours is closer
+    differ = np.abs(wgs - expected).max(axis=1) > 1e-6
+    assert (ours[differ] < theirs[differ]).all()
@@ -0,0 +1,100 @@
+import os
+import struct
+from io import BytesIO
+
+import pytest
+from fit_tool.fit_file import FitFile
+from fit_tool.profile.messages.device_info_message import DeviceInfoMessage
+from garmin_device_adaptor import (
+    GARMIN_DEVICE_PRODUCT_ID,
+    GARMIN_DEVICE_SERIAL_NUMBER,
+    UnsupportedFitFile,
+    do_wrap_device_info,
+    fit_crc,
+    patch_device_info,
+    rebuild_device_info,
+)
+from garmin_fit_sdk import Decoder, Stream
+
+FIT_OUT = os.path.join(os.path.dirname(__file__), "..", "FIT_OUT")
+# the smallest of the coros files in the tree, fit_tool is slow on larger ones
+FIT_FILES = ["471786748509192893.fit", "474229313590296678.fit"]
+
+
+def read_fit(file_name):
+    with open(os.path.join(FIT_OUT, file_name), "rb") as f:
+        return f.read()
+
+
+def decode(data):
+    """
+    Messages of a fit file by kind, after checking its crcs
+    """
+    assert Decoder(Stream.from_byte_array(bytearray(data))).check_integrity()
+    messages, errors = Decoder(Stream.from_byte_array(bytearray(data))).read()
+    assert errors == []
+    return messages
+
+
+def other_messages(messages):
+    # repr, developer fields may hold nan
+    return {k: repr(v) for k, v in messages.items() if k != "device_info_mesgs"}
+
+
+@pytest.mark.parametrize("file_name", FIT_FILES)
+def test_patch_device_info_matches_rebuild(file_name):
+    data = read_fit(file_name)
+    patched = patch_device_info(data)
+
+    messages = decode(patched)
+    device_info = messages["device_info_mesgs"]
+    assert len(device_info) == 1
+    assert device_info[0]["manufacturer"] == "garmin"
+    assert device_info[0]["product"] == GARMIN_DEVICE_PRODUCT_ID
+    assert device_info[0]["serial_number"] == GARMIN_DEVICE_SERIAL_NUMBER
+    # the original device info is gone, nothing else changed
+    original = decode(data)
+    assert original["device_info_mesgs"][0]["manufacturer"] != "garmin"
+    assert other_messages(messages) == other_messages(original)
+
+    rebuilt = decode(rebuild_device_info(data))
+    assert device_info == rebuilt["device_info_mesgs"]
+    assert other_messages(messages) == other_messages(rebuilt)
+
+    fit_tool_device_info = [
+        record.message
+        for record in FitFile.from_bytes(patched).records
+        if isinstance(record.message, DeviceInfoMessage)
+    ]
+    assert [(m.manufacturer, m.garmin_product) for m in fit_tool_device_info] == [
+        (1, GARMIN_DEVICE_PRODUCT_ID)
+    ]
+
+
+def test_chained_files_fall_back_to_rebuild():
+    data = read_fit(FIT_FILES[0])
+    chained = data + data
+    with pytest.raises(UnsupportedFitFile):
+        patch_device_info(chained)
+
+    wrapped = do_wrap_device_info(BytesIO(chained))
+    assert wrapped == rebuild_device_info(chained)
+    assert len(decode(wrapped)["device_info_mesgs"]) == 1
+
+
+def test_compressed_timestamps_are_not_patched():
+    # a record definition with a timestamp, a record and a compressed one
+    records = (
+        struct.pack("<BBBHB", 0x40, 0, 0, 20, 1)
+        + bytes([253, 4, 0x86])
+        + struct.pack("<BI", 0, 1000000000)
+        + struct.pack("<BI", 0x80 | 5, 0)
+    )
+    header = bytearray(struct.pack("<BBHI4s", 14, 0x20, 2195, len(records), b".FIT"))
+    header += struct.pack("<H", fit_crc(header))
+    data = bytes(header) + records
+    data += struct.pack("<H", fit_crc(data))
+    assert Decoder(Stream.from_byte_array(bytearray(data))).check_integrity()
+
+    with pytest.raises(UnsupportedFitFile):
+        patch_device_info(data)
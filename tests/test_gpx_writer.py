@@ -0,0 +1,22 @@
+import pytest
+from gpx_writer import format_number, format_numbers
+
+
+@pytest.mark.parametrize(
+    "value, text",
+    [
+        (1e-11, "0"),
+        (-1e-11, "0"),
+        (1e16, "10000000000000000"),
+        (-1.5e16, "-15000000000000000"),
+        (1.5e-05, "0.000015"),
+        (-2.5e-07, "-0.00000025"),
+        (1e-10, "0.0000000001"),
+        (120.5, "120.5"),
+        (30.0, "30.0"),
+        (3, "3"),
+    ],
+)
+def test_format_number(value, text):
+    assert format_number(value) == text
+    assert format_numbers([value]) == [text]
@@ -0,0 +1,83 @@
+import tracemalloc
+
+import numpy as np
+from gpxtrackposter import heatmap_drawer
+from gpxtrackposter.heatmap_drawer import HeatmapDrawer, _clip_segments
+from gpxtrackposter.poster import Poster
+from gpxtrackposter.xy import XY
+
+BBOX = (30.2, 120.1, 30.3, 120.2)
+
+
+def make_drawer(resolution):
+    drawer = HeatmapDrawer(Poster())
+    drawer._resolution = resolution
+    drawer._bbox = BBOX
+    return drawer
+
+
+def random_lines(rng, count):
+    lat_lo, lng_lo, lat_hi, lng_hi = BBOX
+    return [
+        np.column_stack(
+            [
+                rng.uniform(lat_lo + 0.001, lat_hi - 0.001, n),
+                rng.uniform(lng_lo + 0.001, lng_hi - 0.001, n),
+            ]
+        )
+        for n in rng.integers(1, 50, count)
+    ]
+
+
+def test_clip_segments():
+    grid = np.array([10.0, 5.0])
+    origin = np.array([[1, 1], [-5, 2], [1, -1], [20, 20], [3, 7], [2, 2]], float)
+    delta = np.array([[2, 2], [20, 0], [0, 1], [5, 5], [4, 0], [0, 0]], float)
+    t_in, t_out = _clip_segments(origin, delta, grid)
+    # inside, crossing the whole grid, entering half way, outside, parallel
+    # outside, a point inside
+    assert np.allclose(t_in[[0, 1, 2, 5]], [0, 0.25, 1, 0])
+    assert np.allclose(t_out[[0, 1, 2, 5]], [1, 0.75, 1, 1])
+    assert (t_in[[3, 4]] > t_out[[3, 4]]).all()
+
+
+def test_histogram_of_tracks_inside_the_grid_is_unchanged(monkeypatch):
+    rng = np.random.default_rng(32)
+    lines = random_lines(rng, 30)
+    drawer = make_drawer(300)
+    size = XY(200, 300)
+    counts = drawer._histogram(lines, size)
+
+    # sampling the whole segments, as before clipping
+    monkeypatch.setattr(
+        heatmap_drawer,
+        "_clip_segments",
+        lambda origin, delta, grid: (np.zeros(len(origin)), np.ones(len(origin))),
+    )
+    assert (drawer._histogram(lines, size) == counts).all()
+    assert counts.sum() >= sum(len(line) for line in lines)
+
+
+def test_histogram_ignores_far_away_segments():
+    rng = np.random.default_rng(33)
+    lines = random_lines(rng, 5)
+    # a glitch to 0,0 and back, millions of cells away at this resolution
+    glitch = lines[0].copy()
+    glitch[len(glitch) // 2] = 0
+    drawer = make_drawer(4000)
+    size = XY(200, 300)
+
+    def histogram(lines):
+        tracemalloc.start()
+        counts = drawer._histogram(lines, size)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return counts, peak
+
+    expected, expected_peak = histogram(lines[1:])
+    counts, peak = histogram([glitch] + lines[1:])
+
+    # sampling the glitch at cell resolution took four times the grid itself
+    assert peak < 1.5 * expected_peak
+    assert counts.sum() > expected.sum()
+    assert (counts >= expected).all()
@@ -0,0 +1,77 @@
+import random
+
+from keep_sync import (
+    HR_FRAME_THRESHOLD_IN_DECISECOND,
+    TIMESTAMP_THRESHOLD_IN_DECISECOND,
+    find_nearest_hrs,
+)
+
+
+def find_nearest_hr_scan(
+    hr_data_list, target_time, start_time, threshold=HR_FRAME_THRESHOLD_IN_DECISECOND
+):
+    # the per point scan find_nearest_hrs replaced
+    closest_element = None
+    min_difference = float("inf")
+    if target_time > TIMESTAMP_THRESHOLD_IN_DECISECOND:
+        target_time = (target_time * 100 - start_time) / 100
+
+    for item in hr_data_list:
+        timestamp = item["timestamp"]
+        difference = abs(timestamp - target_time)
+
+        if difference <= threshold and difference < min_difference:
+            closest_element = item
+            min_difference = difference
+
+    if closest_element:
+        hr = closest_element.get("beatsPerMinute")
+        if hr and hr > 0:
+            return hr
+
+    return None
+
+
+def make_run(rng):
+    """
+    A synthetic keep payload: heart rate samples in deciseconds from the start,
+    with gaps, duplicate timestamps, missing or zero beats and some disorder,
+    and the decisecond timestamps of the gps points, relative or absolute
+    """
+    start_time = rng.randint(1_500_000_000_000, 1_700_000_000_000)
+    duration = rng.randint(1, 36_000)
+    hr_data_list = []
+    for _ in range(rng.randint(0, 300)):
+        timestamp = rng.randint(0, duration)
+        if hr_data_list and rng.random() < 0.1:
+            timestamp = rng.choice(hr_data_list)["timestamp"]
+        item = {"timestamp": timestamp}
+        if rng.random() < 0.9:
+            item["beatsPerMinute"] = rng.choice([0, rng.randint(60, 200)])
+        hr_data_list.append(item)
+    if rng.random() < 0.8:
+        hr_data_list.sort(key=lambda item: item["timestamp"])
+    target_times = [rng.randint(-200, duration + 200) for _ in range(50)]
+    if rng.random() < 0.5:
+        target_times = [(start_time + t * 100) // 100 for t in target_times]
+    return hr_data_list, target_times, start_time
+
+
+def test_find_nearest_hrs_matches_scan():
+    rng = random.Random(43)
+    for _ in range(2000):
+        hr_data_list, target_times, start_time = make_run(rng)
+        threshold = rng.choice([HR_FRAME_THRESHOLD_IN_DECISECOND, 0, 5])
+        expected = [
+            find_nearest_hr_scan(hr_data_list, t, start_time, threshold)
+            for t in target_times
+        ]
+        assert (
+            find_nearest_hrs(hr_data_list, target_times, start_time, threshold)
+            == expected
+        )
+
+
+def test_find_nearest_hrs_without_data():
+    assert find_nearest_hrs([], [1, 2], 0) == [None, None]
+    assert find_nearest_hrs([{"timestamp": 1, "beatsPerMinute": 90}], [], 0) == []
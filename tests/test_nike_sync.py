@@ -0,0 +1,49 @@
+import asyncio
+import json
+
+import httpx
+import nike_sync
+
+
+class FakeNike:
+    def __init__(self, activity_ids, failing_ids):
+        self.activity_ids = activity_ids
+        self.failing_ids = failing_ids
+
+    async def get_activities_before_id(self, before_id):
+        return {
+            "activities": [
+                {"id": i, "app_id": "com.nike.sport.running.ios"}
+                for i in self.activity_ids
+            ],
+            "paging": {},
+        }
+
+    async def get_activity(self, activity_id):
+        await asyncio.sleep(0)
+        if activity_id in self.failing_ids:
+            raise httpx.HTTPError("server error")
+        return {"id": activity_id, "end_epoch_ms": int(activity_id)}
+
+
+def test_failed_fetch_keeps_the_other_activities(tmp_path, monkeypatch):
+    monkeypatch.setattr(nike_sync, "OUTPUT_DIR", str(tmp_path))
+    nike = FakeNike(["1000", "2000", "3000"], failing_ids={"2000"})
+
+    activities = asyncio.run(nike_sync.sync_activities(nike))
+
+    assert [a["id"] for a in activities] == ["1000", "3000"]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["1000.json", "3000.json"]
+
+
+def test_files_of_earlier_runs_are_picked_up(tmp_path, monkeypatch):
+    monkeypatch.setattr(nike_sync, "OUTPUT_DIR", str(tmp_path))
+    monkeypatch.setattr(nike_sync, "load_synced_file_list", lambda: ["1000.json"])
+    for name in ["1000", "2000", "3000"]:
+        (tmp_path / f"{name}.json").write_text(json.dumps({"id": name}))
+    (tmp_path / ".DS_Store").write_text("")
+
+    files = nike_sync.get_to_generate_files([{"end_epoch_ms": 3000}])
+
+    assert files == [str(tmp_path / "2000.json")]
+    assert nike_sync.load_saved_activities(files) == [{"id": "2000"}]
@@ -0,0 +1,16 @@
+from gpxtrackposter.poster import PLAIN_COLORS, Poster
+from gpxtrackposter.tracks_drawer import TracksDrawer
+
+
+def test_plain_poster_draws_without_changing_its_colors(tmp_path):
+    p = Poster()
+    p.drawer_type = "plain"
+    colors = dict(p.colors)
+    p.draw(TracksDrawer(p), str(tmp_path / "plain.svg"))
+
+    assert p.colors == colors
+    assert p.draw_colors() == {**colors, **PLAIN_COLORS}
+    assert 'fill="#1a1a1a"' in (tmp_path / "plain.svg").read_text()
+
+    p.drawer_type = "title"
+    assert p.draw_colors() == colors
@@ -0,0 +1,119 @@
+import asyncio
+import datetime
+
+import gpxpy
+import polyline
+import sync_pipeline
+from generator import Generator
+from generator.db import Activity
+from gpxtrackposter.track import Track
+from gpxtrackposter.track_loader import TrackLoader, load_gpx_file
+from sync_pipeline import SyncPipeline
+
+
+def make_track(run_id, start, minutes, length):
+    t = Track()
+    t.file_names = [f"{run_id}.fit"]
+    t.run_id = run_id
+    t.start_time = t.start_time_local = start
+    t.end_time = t.end_time_local = start + datetime.timedelta(minutes=minutes)
+    t.length = length
+    t.polyline_container = [[30.0, 120.0], [30.01, 120.01]]
+    t.polyline_str = polyline.encode(t.polyline_container)
+    t.moving_dict = {
+        "distance": length,
+        "moving_time": datetime.timedelta(minutes=minutes),
+        "elapsed_time": datetime.timedelta(minutes=minutes),
+        "average_speed": length / (minutes * 60),
+    }
+    return t
+
+
+def test_tracks_of_different_batches_are_merged(tmp_path, monkeypatch):
+    synced = []
+    monkeypatch.setattr(sync_pipeline, "save_synced_data_file_list", synced.extend)
+    pipeline = SyncPipeline(tmp_path / "data.db")
+    pipeline.generator = Generator(tmp_path / "data.db")
+
+    day = datetime.datetime(2024, 5, 1, 7)
+    # a run split in two files, and a short warm up, in three batches that
+    # arrive in download order
+    first = make_track(1, day, 30, 5000)
+    second = make_track(2, day + datetime.timedelta(minutes=40), 30, 5000)
+    warm_up = make_track(3, day - datetime.timedelta(minutes=20), 10, 50)
+    other_day = make_track(4, day + datetime.timedelta(days=1), 30, 5000)
+    pipeline._write_batch([second, other_day])
+    pipeline._write_batch([first])
+    pipeline._write_batch([warm_up])
+    assert pipeline._merge_run() == 2
+
+    rows = {a.run_id: a.distance for a in pipeline.generator.session.query(Activity)}
+    assert rows == {3: 10050, 4: 5000}
+    assert sorted(synced) == ["1.fit", "2.fit", "3.fit", "4.fit"]
+
+
+def write_gpx(path, start, minutes):
+    # a straight run north, about 150 m a minute
+    gpx = gpxpy.gpx.GPX()
+    track = gpxpy.gpx.GPXTrack()
+    segment = gpxpy.gpx.GPXTrackSegment()
+    for i in range(minutes + 1):
+        segment.points.append(
+            gpxpy.gpx.GPXTrackPoint(
+                30.0 + i * 0.00135,
+                120.0,
+                time=start + datetime.timedelta(minutes=i),
+            )
+        )
+    track.segments.append(segment)
+    gpx.tracks.append(track)
+    path.write_text(gpx.to_xml())
+    return str(path)
+
+
+def test_pipeline_stores_the_files_put_while_downloading(tmp_path, monkeypatch):
+    synced = []
+    monkeypatch.setattr(sync_pipeline, "save_synced_data_file_list", synced.extend)
+    day = datetime.datetime(2024, 5, 1, 7, tzinfo=datetime.timezone.utc)
+    # the second half of a split run comes first, the first half last, so
+    # that they are written in different batches and merged by close()
+    files = [write_gpx(tmp_path / "b.gpx", day + datetime.timedelta(minutes=40), 30)]
+    for i in range(1, 9):
+        path = tmp_path / f"{i}.gpx"
+        files.append(write_gpx(path, day + datetime.timedelta(days=i), 30))
+    files.append(write_gpx(tmp_path / "a.gpx", day, 30))
+    expected = {
+        t.run_id: t.length
+        for t in TrackLoader().prepare_tracks([load_gpx_file(f) for f in files])
+    }
+    assert len(expected) == len(files) - 1
+
+    # put() waits while max_pending files are being parsed
+    parsing = []
+    parse = SyncPipeline._parse
+
+    async def counted_parse(self, file_path, data):
+        parsing.append(file_path)
+        assert len(parsing) <= self.max_pending
+        try:
+            await parse(self, file_path, data)
+        finally:
+            parsing.remove(file_path)
+
+    monkeypatch.setattr(SyncPipeline, "_parse", counted_parse)
+
+    async def download():
+        async with SyncPipeline(
+            tmp_path / "data.db", max_workers=2, max_pending=2, batch_size=2
+        ) as pipeline:
+            for file_path in files:
+                await pipeline.put(file_path)
+
+    asyncio.run(download())
+
+    session = Generator(tmp_path / "data.db").session
+    rows = {a.run_id: a.distance for a in session.query(Activity)}
+    assert rows.keys() == expected.keys()
+    for run_id, length in expected.items():
+        assert abs(rows[run_id] - length) < 1
+    assert sorted(synced) == sorted(f.rsplit("/", 1)[-1] for f in files)